@@ -6,18 +6,137 @@ import os
 import sys
 import logging
 import re
-from typing import Dict, List, Any
+import time
+import hashlib
+import asyncio
+import itertools
+import collections
+import threading
+from concurrent.futures import Future
+from functools import partial
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Dict, List, Any, Optional, Tuple, Iterable, Iterator
 
 
 import openai
-
+from tenacity import AsyncRetrying, Retrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+from plan_model import Plan, format_ms, format_bytes
+from plan_rules import evaluate_query
+from plan_summary import estimate_tokens, summarize_plan, summarize_text
+from fingerprint import fingerprint
+from kv_cache import KeyValueCache
+from baseline import BaselineStore
+from artifacts import read_records
+from concurrency import ordered_map, completed_future, FutureGroup
+from rate_limiter import AsyncTokenBucket
+from instrumentation import metrics
+
+# Версия шаблона промпта: увеличивать при любом изменении _build_prompt,
+# чтобы закэшированные ответы на старый промпт не использовались
+PROMPT_VERSION = 5
+
+VALID_EVALUATIONS = ("GOOD", "ACCEPTABLE", "NEEDS_IMPROVEMENT", "CRITICAL")
+# Сколько строк текстового плана попадает в пакетный промпт, если нет JSON-плана
+BATCH_PLAN_LINES = 15
+# Сколько последних отпечатков помним для дедупликации (как в ExplainRunner): память не растёт
+# с числом запросов, а повторы дальше окна берутся из кэша ответов LLM
+DEDUPE_WINDOW = 10000
+# Ответ на пакет: примерно столько токенов на один запрос, но не больше общего потолка
+BATCH_TOKENS_PER_ITEM = 250
+BATCH_MAX_COMPLETION_TOKENS = 4000
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
 logger = logging.getLogger(__name__)
 
+# Ошибки, после которых запрос к API имеет смысл повторить
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+def benchmark_time(benchmark: Dict[str, Any]) -> str:
+    """Время в режиме замеров для отчёта: медиана первой, чтобы столбец сортировался по ней"""
+    execution = benchmark['execution_ms']
+    return f"{format_ms(execution['p50'])} (p95 {format_ms(execution['p95'])}, прогонов {benchmark['runs']})"
+
+
+def workload_facts(workload: Optional[Dict[str, Any]]) -> str:
+    """Статистика реальной нагрузки из pg_stat_statements для промпта"""
+    if not workload:
+        return ''
+    touched = workload['shared_blks_hit'] + workload['shared_blks_read']
+    hit_ratio = f", попаданий в shared buffers {workload['shared_blks_hit'] / touched:.0%}" if touched else ''
+    rows = workload['rows'] / workload['calls'] if workload['calls'] else 0
+    return (f"Нагрузка в production (pg_stat_statements): вызовов {workload['calls']}, "
+            f"суммарно {format_ms(workload['total_ms'])}, в среднем {format_ms(workload['mean_ms'])}, "
+            f"строк за вызов ~{rows:.0f}{hit_ratio}. Учитывай частоту вызовов при оценке.\n")
+
+
+def _index_text(index: Dict[str, Any]) -> str:
+    """"trip_pkey btree (trip_no)" вместо полного CREATE INDEX"""
+    definition = index['definition'].split(' USING ', 1)[-1]
+    return f"{index['name']} {definition}"
+
+
+def table_facts(query_data: Dict[str, Any], detailed: bool = True) -> str:
+    """Таблицы запроса с оценкой строк и размерами из каталога; detailed — с индексами и столбцами"""
+    tables = query_data.get('tables') or []
+    if not tables:
+        return 'N/A'
+    stats = query_data.get('table_stats') or {}
+    lines = []
+    for name in tables:
+        info = stats.get(name)
+        if info is None:
+            lines.append(name)
+            continue
+        rows = f"~{info['rows']} строк" if info['rows'] is not None else "статистика не собрана"
+        size = f"{rows}, {format_bytes(info['table_bytes'])}, индексы {format_bytes(info['index_bytes'])}"
+        if not detailed:
+            lines.append(f"{name} ({size})")
+            continue
+        lines.append(f"- {name}: {size}")
+        if info['indexes']:
+            lines.append("  индексы: " + '; '.join(_index_text(index) for index in info['indexes']))
+        columns = []
+        for column, column_stats in info['columns'].items():
+            parts = [f"NULL {column_stats['null_frac']:.0%}"]
+            if column_stats['distinct']:
+                parts.insert(0, f"различных ~{column_stats['distinct']}")
+            if column_stats.get('correlation') is not None:
+                parts.append(f"корреляция {column_stats['correlation']}")
+            columns.append(f"{column} ({', '.join(parts)})")
+        if columns:
+            lines.append("  столбцы: " + '; '.join(columns))
+    if not detailed:
+        return ', '.join(lines)
+    return '\n' + '\n'.join(lines)
+
+
+def _retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Достаёт задержку из заголовка Retry-After ответа 429/503, если он есть"""
+    response = getattr(exc, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
 
 class OpenRouterAnalyzer:
-    def __init__(self):
+    def __init__(self, cache: Optional[KeyValueCache] = None, requests_per_minute: float = 20,
+                 max_retries: int = 5, plan_tokens: int = 1500):
 
         self.api_key = os.getenv("OPENROUTER_API_KEY")
         if not self.api_key:
@@ -25,25 +144,48 @@ class OpenRouterAnalyzer:
             raise ValueError("API ключ не найден")
 
 
-        self.base_url = "https://openrouter.ai/api/v1"
+        # Переопределяется для локальной замены провайдера (benchmarks/mock_openrouter.py)
+        self.base_url = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
         self.model = "mistralai/mistral-7b-instruct:free"
+        self.temperature = 0.2
+        self.max_tokens = 500
+        # Бюджет токенов на текст плана в промпте: большие планы сжимаются (plan_summary.py)
+        self.plan_tokens = plan_tokens
+        # Кэш успешно распарсенных ответов: ключ — хэш модели, версии и текста промпта, температуры
+        self.cache = cache
+        self.max_retries = max_retries
+        self.usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        # Лимит провайдера на число запросов: общий для всех параллельных вызовов
+        self.rate_limiter = AsyncTokenBucket(requests_per_minute / 60.0, capacity=1)
 
         try:
+            # Повторы делаем сами через tenacity, встроенные повторы клиента отключаем
             self.client = openai.OpenAI(
                 api_key=self.api_key,
-                base_url=self.base_url
+                base_url=self.base_url,
+                max_retries=0
+            )
+            self.async_client = openai.AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                max_retries=0
             )
             logger.info("OpenRouter клиент инициализирован")
         except Exception as e:
             logger.error(f"Ошибка инициализации OpenRouter: {e}")
             raise
 
-    def _build_prompt(self, query_data: Dict[str, Any]) -> str:
-        """Формируем строгий промпт, чтобы LLM всегда возвращал issues и recommendations"""
-        explain_output = '\n'.join(query_data.get('explain_output', [])) if query_data.get('explain_output') else 'N/A'
-        tables = ', '.join(query_data.get('tables', [])) if query_data.get('tables') else 'N/A'
+    def _build_prompt(self, query_data: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """Формируем строгий промпт, чтобы LLM всегда возвращал issues и recommendations.
 
-        return f"""
+        Возвращает промпт и описание того, что из плана в него не попало.
+        """
+        explain_lines, elided = self.plan_excerpt(query_data)
+        explain_output = '\n'.join(explain_lines) or 'N/A'
+        tables = table_facts(query_data)
+        plan_facts = workload_facts(query_data.get('workload')) + self._plan_facts(query_data)
+
+        prompt = f"""
 Проанализируй SQL-запрос и его EXPLAIN ANALYZE вывод. Отвечай ТОЛЬКО на русском языке. Верни ТОЛЬКО валидный JSON.
 
 Запрос: 
@@ -54,7 +196,7 @@ EXPLAIN ANALYZE:
 
 Таблицы: {tables}
 Тип: {query_data['type']}
-
+{plan_facts}
 Критерии оценки:
 - GOOD: эффективно, быстро, с индексами, время < 50ms
 - ACCEPTABLE: работает, но есть риски, время < 200ms
@@ -97,9 +239,125 @@ EXPLAIN: Seq Scan on logs ...
   "recommendations": ["Create index on frequently queried columns"]
 }}
 """
+        return prompt, elided
+
+    def plan_excerpt(self, query_data: Dict[str, Any]) -> Tuple[List[str], Dict[str, Any]]:
+        """Текст плана для промпта в пределах plan_tokens и описание того, что из него убрано"""
+        if query_data.get('plan'):
+            return summarize_plan(Plan.from_explain(query_data['plan']), self.plan_tokens)
+        return summarize_text(query_data.get('explain_output') or [], self.plan_tokens)
+
+    def _plan_facts(self, query_data: Dict[str, Any]) -> str:
+        """Измеренные показатели плана, чтобы модель не выводила их из текста EXPLAIN"""
+        if not query_data.get('plan'):
+            return ''
+        plan = Plan.from_explain(query_data['plan'])
+        if query_data.get('generic_plan'):
+            return (f"Текст запроса из pg_stat_statements с параметрами $n: план общий (GENERIC_PLAN), "
+                    f"запрос не выполнялся, время и число строк в плане только оценочные.\n"
+                    f"Оценочная стоимость плана: {plan.root.total_cost}\n")
+        if query_data.get('estimated_only'):
+            return (f"Запрос не уложился в лимит {format_ms(query_data.get('time_budget_ms'))} — "
+                    f"план получен без ANALYZE, время и число строк только оценочные.\n"
+                    f"Оценочная стоимость плана: {plan.root.total_cost}\n")
+
+        benchmark = query_data.get('benchmark')
+        if benchmark and benchmark.get('execution_ms'):
+            execution, planning = benchmark['execution_ms'], benchmark.get('planning_ms') or {}
+            lines = [f"Время выполнения по {benchmark['runs']} прогонам (после {benchmark['warmup']} прогревочных): "
+                     f"p50 {format_ms(execution['p50'])}, p95 {format_ms(execution['p95'])}, "
+                     f"min {format_ms(execution['min'])}, max {format_ms(execution['max'])} "
+                     f"(планирование p50: {format_ms(planning.get('p50'))}). Оценивай по p50 и p95, "
+                     f"план ниже — прогон, ближайший к медиане."]
+            if benchmark.get('shared_hit_ratio'):
+                lines.append(f"Доля попаданий в shared buffers: p50 {benchmark['shared_hit_ratio']['p50']:.0%}, "
+                             f"min {benchmark['shared_hit_ratio']['min']:.0%}")
+            cold = benchmark.get('cold')
+            if cold:
+                lines.append(f"Первый (холодный) прогон: {format_ms(cold['execution_ms'])}, "
+                             f"прочитано блоков с диска: {cold['shared_read']}")
+        else:
+            lines = [f"Измеренное время выполнения: {format_ms(plan.total_time)} "
+                     f"(планирование: {format_ms(plan.planning_time)})"]
+        buffers = plan.buffers()
+        lines.append(f"Буферы: shared hit={buffers['shared_hit']}, read={buffers['shared_read']}, "
+                     f"temp read={buffers['temp_read']}, temp written={buffers['temp_written']}")
+        lines.append("Самые дорогие узлы (собственное время):")
+        for node in plan.top_nodes(3):
+            lines.append(f"- {node.label()}: {format_ms(node.self_time)}, строк {node.actual_rows} "
+                         f"(оценка {node.plan_rows}), циклов {node.actual_loops}")
+        for node, ratio in plan.estimate_errors()[:3]:
+            lines.append(f"- Ошибка оценки строк x{ratio:.0f}: {node.label()}")
+        return '\n'.join(lines) + '\n'
+
+    def _compact_plan(self, query_data: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """Короткая сводка плана для пакетного промпта и описание того, что в неё не попало"""
+        elided = {}
+        if query_data.get('plan'):
+            plan = Plan.from_explain(query_data['plan'])
+            # В сводку попадают только три самых дорогих узла, без условий и прочих деталей
+            top = plan.top_nodes(3)
+            hidden = [node for _, node in plan.iter_nodes() if node not in top]
+            if hidden:
+                elided["nodes"] = len(hidden)
+                if plan.analyzed:
+                    elided["self_time_ms"] = round(sum(node.self_time or 0 for node in hidden), 3)
+            elided["node_details"] = True
+            if query_data.get('estimated_only'):
+                parts = [f"без ANALYZE (превышен лимит времени), стоимость {plan.root.total_cost}"]
+            elif query_data.get('benchmark') and query_data['benchmark'].get('execution_ms'):
+                parts = [f"время {benchmark_time(query_data['benchmark'])}"]
+            else:
+                parts = [f"время {format_ms(plan.total_time)}"]
+            for node in top:
+                if node.analyzed:
+                    parts.append(f"{node.label()} (собственное время {format_ms(node.self_time)}, "
+                                 f"строк {node.actual_rows}, оценка {node.plan_rows})")
+                else:
+                    parts.append(f"{node.label()} (стоимость {node.total_cost}, оценка строк {node.plan_rows})")
+            return '; '.join(parts), elided
+        lines = query_data.get('explain_output') or []
+        if len(lines) > BATCH_PLAN_LINES:
+            elided["lines"] = len(lines) - BATCH_PLAN_LINES
+        return '\n'.join(lines[:BATCH_PLAN_LINES]) or 'N/A', elided
+
+    def _batch_item_text(self, item_id: str, query_data: Dict[str, Any]) -> str:
+        tables = table_facts(query_data, detailed=False)
+        return f"""### {item_id}
+Тип: {query_data['type']}
+Таблицы: {tables}
+{workload_facts(query_data.get('workload'))}Запрос:
+{query_data['query']}
+План: {self._compact_plan(query_data)[0]}
+"""
+
+    def _build_batch_prompt(self, entries: List[Tuple[str, Dict[str, Any]]]) -> str:
+        """Один промпт на несколько запросов: общая инструкция и компактные планы"""
+        items_text = '\n'.join(self._batch_item_text(item_id, query_data) for item_id, query_data in entries)
+        return f"""
+Проанализируй каждый SQL-запрос ниже по его плану выполнения. Отвечай ТОЛЬКО на русском языке.
+Верни ТОЛЬКО валидный JSON-массив: ровно один объект на каждый запрос, с полем "id" из заголовка ###.
 
-    def _extract_json(self, text: str) -> Dict[str, Any]:
-        """Извлекает JSON из любого текста — максимально надёжно"""
+Критерии оценки:
+- GOOD: эффективно, быстро, с индексами, время < 50ms
+- ACCEPTABLE: работает, но есть риски, время < 200ms
+- NEEDS_IMPROVEMENT: медленно, seq scan, нет индексов, время > 500ms
+- CRITICAL: DROP/DELETE без WHERE, очень медленно (>2s)
+
+Обязательно заполни ВСЕ поля, никогда не используй пустые массивы и | в evaluation.
+
+Формат ответа:
+[
+  {{"id": "q1", "evaluation": "GOOD", "severity": "LOW", "execution_time": "10ms",
+    "issues": ["описание проблемы"], "recommendations": ["рекомендация"]}}
+]
+
+Запросы:
+{items_text}"""
+
+    def _extract_json(self, text: str, array: bool = False) -> Any:
+        """Извлекает JSON-объект (или массив при array=True) из любого текста — максимально надёжно"""
+        opening, closing = ('[', ']') if array else ('{', '}')
         # Убираем Markdown
         text = re.sub(r'```json\s*', '', text)
         text = re.sub(r'```\s*', '', text)
@@ -108,11 +366,11 @@ EXPLAIN: Seq Scan on logs ...
         stack = []
         start = -1
         for i, char in enumerate(text):
-            if char == '{':
+            if char == opening:
                 if start == -1:
                     start = i
                 stack.append(char)
-            elif char == '}':
+            elif char == closing:
                 if stack:
                     stack.pop()
                     if not stack:  # Сбалансирована
@@ -123,6 +381,29 @@ EXPLAIN: Seq Scan on logs ...
                             return None
         return None
 
+    def _split_batch_response(self, content: str, ids) -> Dict[str, Dict[str, Any]]:
+        """Проверяет JSON-массив пакетного ответа и раскладывает его по id запросов"""
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            data = None
+        if not isinstance(data, list):
+            data = self._extract_json(content, array=True)
+        if not isinstance(data, list):
+            return {}
+
+        results = {}
+        for entry in data:
+            if not isinstance(entry, dict) or entry.get("id") not in ids:
+                continue
+            entry = dict(entry)
+            item_id = entry.pop("id")
+            entry = self._fix_evaluation(entry)
+            if entry.get("evaluation") not in VALID_EVALUATIONS:
+                continue
+            results[item_id] = self._ensure_non_empty_fields(entry)
+        return results
+
     def _fix_evaluation(self, result: Dict[str, Any]) -> Dict[str, Any]:
         """Исправляет некорректные значения evaluation"""
         if "|" in str(result.get("evaluation", "")):
@@ -142,119 +423,515 @@ EXPLAIN: Seq Scan on logs ...
             ]
         return result
 
-    def analyze_query(self, query_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Анализирует один SQL-запрос через LLM"""
-        prompt = self._build_prompt(query_data)
+    def _cache_key(self, prompt: str) -> str:
+        # Адрес провайдера в ключе: ответы замены не должны попадать в кэш настоящей модели
+        payload = json.dumps([self.base_url, self.model, PROMPT_VERSION, prompt, self.temperature],
+                             ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
 
+    def _parse_response(self, content: str) -> Optional[Dict[str, Any]]:
+        """Разбирает ответ модели; None, если JSON извлечь не удалось или в нём нет допустимой оценки"""
+        # Попытка 1: прямой JSON
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.2,
-                max_tokens=500
-            )
-            content = response.choices[0].message.content.strip()
-            logger.info(f"LLM response for query: {query_data['query'][:50]}...")
-            logger.debug(f"Raw LLM output: {content}")
+            result = json.loads(content)
+        except json.JSONDecodeError:
+            result = None
 
-            # Попытка 1: прямой JSON
+        # Попытка 2: извлечение JSON из текста
+        if not isinstance(result, dict):
             try:
-                result = json.loads(content)
-                if isinstance(result, dict):
-                    result = self._fix_evaluation(result)
-                    result = self._ensure_non_empty_fields(result)
-                    return result
-            except json.JSONDecodeError:
-                pass
-
-            # Попытка 2: извлечение JSON из текста
-            try:
-                extracted = self._extract_json(content)
-                if extracted:
-                    extracted = self._fix_evaluation(extracted)
-                    extracted = self._ensure_non_empty_fields(extracted)
-                    return extracted
+                result = self._extract_json(content)
             except Exception as e:
                 logger.warning(f"Ошибка при извлечении JSON: {e}")
+                result = None
+        if not isinstance(result, dict):
+            return None
+
+        # Та же проверка, что и в пакетном ответе: без неё в кэш навсегда попал бы испорченный анализ
+        result = self._fix_evaluation(result)
+        if result.get("evaluation") not in VALID_EVALUATIONS:
+            logger.warning(f"Недопустимое значение evaluation в ответе LLM: {result.get('evaluation')!r}")
+            return None
+        return self._ensure_non_empty_fields(result)
+
+    def _wait_before_retry(self, retry_state) -> float:
+        """Ждём столько, сколько просит Retry-After, иначе — экспоненциально с джиттером"""
+        exc = retry_state.outcome.exception()
+        delay = _retry_after_seconds(exc)
+        if delay is None:
+            delay = wait_random_exponential(multiplier=1, max=60)(retry_state)
+        elif isinstance(exc, openai.RateLimitError):
+            # Лимит общий: притормаживаем и остальные параллельные вызовы
+            self.rate_limiter.pause(delay)
+        metrics.count("llm.retries")
+        logger.warning(f"Повтор запроса к OpenRouter через {delay:.1f}s "
+                       f"(попытка {retry_state.attempt_number}): {exc}")
+        return delay
+
+    def _retry_options(self) -> Dict[str, Any]:
+        return {
+            "retry": retry_if_exception_type(RETRYABLE_ERRORS),
+            # max_retries — число повторов, первая попытка в него не входит
+            "stop": stop_after_attempt(self.max_retries + 1),
+            "wait": self._wait_before_retry,
+            "reraise": True,
+        }
+
+    def _request_options(self, prompt: str, max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": self.temperature,
+            "max_tokens": max_tokens or self.max_tokens,
+        }
+
+    def _record_usage(self, response) -> str:
+        self.usage["requests"] += 1
+        metrics.count("llm.requests")
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            self.usage["prompt_tokens"] += usage.prompt_tokens or 0
+            self.usage["completion_tokens"] += usage.completion_tokens or 0
+            metrics.count("llm.prompt_tokens", usage.prompt_tokens or 0)
+            metrics.count("llm.completion_tokens", usage.completion_tokens or 0)
+        return response.choices[0].message.content.strip()
+
+    def _complete(self, prompt: str, max_tokens: Optional[int] = None) -> str:
+        for attempt in Retrying(**self._retry_options()):
+            with attempt:
+                # Лимит частоты соблюдается и без параллельности (--concurrency 1)
+                with metrics.span("llm.rate_limit_wait"):
+                    self.rate_limiter.acquire_sync()
+                with metrics.span("llm.request", attempt=attempt.retry_state.attempt_number):
+                    response = self.client.chat.completions.create(**self._request_options(prompt, max_tokens))
+        return self._record_usage(response)
+
+    async def _complete_async(self, prompt: str, max_tokens: Optional[int] = None) -> str:
+        async for attempt in AsyncRetrying(**self._retry_options()):
+            with attempt:
+                with metrics.span("llm.rate_limit_wait"):
+                    await self.rate_limiter.acquire()
+                with metrics.span("llm.request", attempt=attempt.retry_state.attempt_number):
+                    response = await self.async_client.chat.completions.create(
+                        **self._request_options(prompt, max_tokens)
+                    )
+        return self._record_usage(response)
+
+    def _lookup_cache(self, prompt: str):
+        """Возвращает (ключ кэша, закэшированный анализ или None)"""
+        if not self.cache:
+            return None, None
+        cache_key = self._cache_key(prompt)
+        cached = self.cache.get(cache_key)
+        if cached is not None and cached.get("evaluation") not in VALID_EVALUATIONS:
+            # Испорченный анализ, закэшированный до проверки evaluation, — запрашиваем заново
+            cached = None
+        metrics.count("llm.cache_misses" if cached is None else "llm.cache_hits")
+        return cache_key, cached
+
+    def _handle_content(self, query_data: Dict[str, Any], cache_key: Optional[str], content: str,
+                        elapsed: float, elided: Dict[str, Any]) -> Dict[str, Any]:
+        logger.info(f"LLM response for query: {query_data['query'][:50]}... ({elapsed:.2f}s)")
+        logger.debug(f"Raw LLM output: {content}")
+
+        result = self._parse_response(content)
+        if result is not None:
+            # Что из плана не попало именно в этот промпт: хранится вместе с ответом и в кэше
+            if elided:
+                result["plan_elided"] = elided
+            # Кэшируем только успешно распарсенный анализ с допустимой оценкой, не фоллбэки
+            if self.cache:
+                self.cache.put(cache_key, result)
+            return result
+
+        # Фоллбэк: ручной анализ
+        logger.error(f"Не удалось извлечь анализ из ответа LLM")
+        metrics.count("llm.fallbacks")
+        return {
+            "evaluation": "ACCEPTABLE",
+            "severity": "MEDIUM",
+            "execution_time": "unknown",
+            "issues": ["Не удалось распарсить ответ LLM"],
+            "recommendations": [
+                "Проверьте запрос вручную",
+                "Рассмотрите возможность создания индексов на часто используемые столбцы"
+            ],
+            "source": "fallback"
+        }
+
+    def _api_error(self, e: Exception) -> Dict[str, Any]:
+        logger.error(f"Ошибка при вызове OpenRouter: {e}")
+        metrics.count("llm.fallbacks")
+        return {
+            "evaluation": "ACCEPTABLE",
+            "severity": "HIGH",
+            "execution_time": "unknown",
+            "issues": [f"Ошибка API: {str(e)}"],
+            "recommendations": ["Проверьте подключение к API"],
+            "source": "fallback"
+        }
 
-            # Фоллбэк: ручной анализ
-            logger.error(f"Не удалось извлечь JSON из ответа LLM")
-            return {
-                "evaluation": "ACCEPTABLE",
-                "severity": "MEDIUM",
-                "execution_time": "unknown",
-                "issues": ["Не удалось распарсить ответ LLM"],
-                "recommendations": [
-                    "Проверьте запрос вручную",
-                    "Рассмотрите возможность создания индексов на часто используемые столбцы"
-                ]
-            }
+    def analyze_query(self, query_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Анализирует один SQL-запрос через LLM"""
+        prompt, elided = self._build_prompt(query_data)
+        cache_key, cached = self._lookup_cache(prompt)
+        if cached is not None:
+            logger.info(f"LLM cache hit for query: {query_data['query'][:50]}...")
+            return cached
 
+        started = time.perf_counter()
+        try:
+            content = self._complete(prompt)
+        except Exception as e:
+            return self._api_error(e)
+        return self._handle_content(query_data, cache_key, content, time.perf_counter() - started, elided)
+
+    async def analyze_query_async(self, query_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Асинхронный вариант analyze_query с учётом лимита частоты запросов"""
+        prompt, elided = self._build_prompt(query_data)
+        cache_key, cached = self._lookup_cache(prompt)
+        if cached is not None:
+            logger.info(f"LLM cache hit for query: {query_data['query'][:50]}...")
+            return cached
+
+        started = time.perf_counter()
+        try:
+            content = await self._complete_async(prompt)
         except Exception as e:
-            logger.error(f"Ошибка при вызове OpenRouter: {e}")
-            return {
-                "evaluation": "ACCEPTABLE",
-                "severity": "HIGH",
-                "execution_time": "unknown",
-                "issues": [f"Ошибка API: {str(e)}"],
-                "recommendations": ["Проверьте подключение к API"]
-            }
-
-
-def generate_report(results_file: str, analyzer: OpenRouterAnalyzer) -> List[Dict]:
-    """Генерирует отчёт по всем запросам"""
+            return self._api_error(e)
+        return self._handle_content(query_data, cache_key, content, time.perf_counter() - started, elided)
+
+    def _prepare_batch(self, items: List[Dict[str, Any]]):
+        """Берёт из кэша что есть; возвращает (результаты, ключи кэша, {id в промпте: индекс})"""
+        results, keys, ids = [], [], {}
+        for index, query_data in enumerate(items):
+            # Ключ — от одиночного промпта, чтобы пакетный и одиночный режимы делили кэш
+            cache_key, cached = self._lookup_cache(self._build_prompt(query_data)[0])
+            results.append(cached)
+            keys.append(cache_key)
+            if cached is None:
+                ids[f"q{len(ids) + 1}"] = index
+        return results, keys, ids
+
+    def _batch_request(self, items: List[Dict[str, Any]], ids: Dict[str, int]) -> Tuple[str, int]:
+        prompt = self._build_batch_prompt([(item_id, items[index]) for item_id, index in ids.items()])
+        return prompt, min(BATCH_MAX_COMPLETION_TOKENS, BATCH_TOKENS_PER_ITEM * len(ids))
+
+    def _apply_batch_response(self, items, results, keys, ids, content: Optional[str]) -> List[int]:
+        """Раскладывает ответ по запросам; возвращает индексы, которых в ответе не оказалось"""
+        parsed = self._split_batch_response(content, ids) if content else {}
+        for item_id, index in ids.items():
+            if item_id in parsed:
+                # Ответ дан по компактной сводке пакетного промпта, а не по одиночному плану
+                elided = self._compact_plan(items[index])[1]
+                if elided:
+                    parsed[item_id]["plan_elided"] = elided
+                results[index] = parsed[item_id]
+                if self.cache:
+                    self.cache.put(keys[index], parsed[item_id])
+        missing = [index for index in ids.values() if results[index] is None]
+        if missing:
+            logger.warning(f"В пакетном ответе нет {len(missing)} из {len(ids)} запросов — анализируем по одному")
+        return missing
+
+    def analyze_batch(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Анализирует несколько запросов одним промптом; пропущенные в ответе — по одному"""
+        if len(items) == 1:
+            return [self.analyze_query(items[0])]
+
+        results, keys, ids = self._prepare_batch(items)
+        if len(ids) == 1:
+            index = next(iter(ids.values()))
+            results[index] = self.analyze_query(items[index])
+        elif ids:
+            content = None
+            started = time.perf_counter()
+            try:
+                content = self._complete(*self._batch_request(items, ids))
+                logger.info(f"LLM response for batch of {len(ids)} queries ({time.perf_counter() - started:.2f}s)")
+            except Exception as e:
+                logger.error(f"Ошибка пакетного вызова OpenRouter: {e}")
+            for index in self._apply_batch_response(items, results, keys, ids, content):
+                results[index] = self.analyze_query(items[index])
+        return results
+
+    async def analyze_batch_async(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Асинхронный вариант analyze_batch"""
+        if len(items) == 1:
+            return [await self.analyze_query_async(items[0])]
+
+        results, keys, ids = self._prepare_batch(items)
+        if len(ids) == 1:
+            index = next(iter(ids.values()))
+            results[index] = await self.analyze_query_async(items[index])
+        elif ids:
+            content = None
+            started = time.perf_counter()
+            try:
+                content = await self._complete_async(*self._batch_request(items, ids))
+                logger.info(f"LLM response for batch of {len(ids)} queries ({time.perf_counter() - started:.2f}s)")
+            except Exception as e:
+                logger.error(f"Ошибка пакетного вызова OpenRouter: {e}")
+            missing = self._apply_batch_response(items, results, keys, ids, content)
+            retried = await asyncio.gather(*(self.analyze_query_async(items[index]) for index in missing))
+            for index, result in zip(missing, retried):
+                results[index] = result
+        return results
+
+
+class AsyncAnalysisEngine:
+    """Параллельный анализ: цикл asyncio в фоновом потоке и не более concurrency запросов к API.
+
+    submit() принимает пакет запросов и возвращает concurrent.futures.Future со списком
+    анализов, поэтому движок можно использовать из обычного синхронного кода вместе с ordered_map.
+    """
+
+    def __init__(self, analyzer: OpenRouterAnalyzer, concurrency: int):
+        self.analyzer = analyzer
+        self.concurrency = concurrency
+        self.loop = asyncio.new_event_loop()
+        self._semaphore = None
+        self._thread = threading.Thread(target=self.loop.run_forever, name='llm-engine', daemon=True)
+        self._thread.start()
+
+    async def _analyze(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            return await self.analyzer.analyze_batch_async(items)
+
+    def submit(self, items: List[Dict[str, Any]]) -> Future:
+        return asyncio.run_coroutine_threadsafe(self._analyze(items), self.loop)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+def _pack_batches(items, analyzer: OpenRouterAnalyzer, batch_tokens: int, batch_size: int):
+    """Группирует запросы в пакеты, умещающиеся в бюджет токенов промпта; без бюджета — по одному"""
+    if batch_tokens <= 0:
+        for item in items:
+            yield [item]
+        return
+
+    budget = batch_tokens - estimate_tokens(analyzer._build_batch_prompt([]))
+    batch, used = [], 0
+    for item in items:
+        cost = estimate_tokens(analyzer._batch_item_text('q00', item))
+        if batch and (used + cost > budget or len(batch) >= batch_size):
+            yield batch
+            batch, used = [], 0
+        batch.append(item)
+        used += cost
+    if batch:
+        yield batch
+
+
+def _resolve_batch(futures: List[Future], batch_future: Future):
+    """Раздаёт результаты пакета по Future отдельных запросов"""
+    try:
+        results = batch_future.result()
+    except Exception as e:
+        for future in futures:
+            future.set_exception(e)
+        return
+    for future, result in zip(futures, results):
+        future.set_result(result)
+
+
+def analyze_results(results: Iterable[Dict], analyzer: OpenRouterAnalyzer, concurrency: int = 1,
+                    batch_tokens: int = 0, batch_size: int = 10, rules: bool = True,
+                    stored=None, baseline: Optional[BaselineStore] = None) -> Iterator[Dict]:
+    """Отдаёт элементы отчёта по мере анализа результатов EXPLAIN, в порядке входа.
+
+    stored(item) может вернуть элемент отчёта, сохранённый прошлым запуском (--resume):
+    он отдаётся как есть, без правил и LLM.
+    baseline — эталонные измерения: к элементам добавляется сравнение с ними ("baseline").
+    rules — однозначные случаи оцениваются локальными правилами (plan_rules.py) без вызова LLM.
+    concurrency > 1 — запросы к LLM идут параллельно; batch_tokens > 0 — несколько запросов
+    упаковываются в один промпт в пределах этого бюджета токенов (не более batch_size).
+    """
+    engine = AsyncAnalysisEngine(analyzer, concurrency) if concurrency > 1 else None
+    analyze = engine.submit if engine else (lambda batch: completed_future(analyzer.analyze_batch(batch)))
+
+    # Анализ представителя по отпечатку раздаётся всем копиям запроса
+    analyses = collections.OrderedDict()
+    unique = 0
+    saved_calls = 0
+    rule_verdicts = 0
+    restored = set()
+
+    def submit(batch):
+        nonlocal unique, saved_calls, rule_verdicts
+        futures, to_analyze, pending = [], [], []
+        for item in batch:
+            previous = stored(item) if stored else None
+            if previous is not None:
+                restored.add(id(item))
+                futures.append(completed_future(previous))
+                continue
+            fp = item.get('fingerprint') or fingerprint(item['query'])
+            verdict = None
+            if rules and not item.get('error') and fp not in analyses:
+                verdict = evaluate_query(item)
+            if item.get('error'):
+                futures.append(completed_future({
+                    "evaluation": "CRITICAL",
+                    "severity": "CRITICAL",
+                    "execution_time": "0ms",
+                    "issues": [f"Ошибка выполнения: {item['error']}"],
+                    "recommendations": ["Исправьте синтаксис SQL"]
+                }))
+            elif verdict is not None:
+                rule_verdicts += 1
+                metrics.count("llm.rule_verdicts")
+                futures.append(completed_future(verdict))
+            elif item.get('skipped'):
+                # Плана нет из-за ограничения сервера, а не ошибки в запросе: деплой не блокируем
+                futures.append(completed_future({
+                    "evaluation": "ACCEPTABLE",
+                    "severity": "LOW",
+                    "execution_time": "unknown",
+                    "issues": [f"План не снят: {item['skipped']}"],
+                    "recommendations": ["Проверьте план запроса вручную или на PostgreSQL 16+"],
+                    "source": "skipped"
+                }))
+            elif fp in analyses:
+                saved_calls += 1
+                metrics.count("llm.deduplicated")
+                analyses.move_to_end(fp)
+                futures.append(analyses[fp])
+            else:
+                unique += 1
+                analyses[fp] = Future()
+                futures.append(analyses[fp])
+                if len(analyses) > DEDUPE_WINDOW:
+                    analyses.popitem(last=False)
+                pending.append(analyses[fp])
+                to_analyze.append(item)
+        if to_analyze:
+            analyze(to_analyze).add_done_callback(partial(_resolve_batch, pending))
+        return FutureGroup(futures)
+
+    total = 0
+    try:
+        # Порядок отчёта совпадает с порядком входа независимо от порядка ответов API
+        batches = _pack_batches(results, analyzer, batch_tokens, batch_size)
+        for batch, batch_analyses in ordered_map(submit, batches, max(1, concurrency) * 2):
+            for item, analysis in zip(batch, batch_analyses):
+                total += 1
+                if id(item) in restored:
+                    restored.discard(id(item))
+                    # Сравнение с эталоном уже есть в сохранённом элементе
+                    if baseline is not None and baseline.update:
+                        baseline.record(item)
+                    yield analysis
+                    continue
+                analysis = dict(analysis)
+                # Что из плана не попало в промпт, по которому модель дала этот ответ
+                elided = analysis.pop("plan_elided", None)
+                if not item.get('error'):
+                    if item.get('skipped'):
+                        workload = item.get('workload')
+                        analysis["execution_time"] = (f"{format_ms(workload['mean_ms'])} (pg_stat_statements)"
+                                                      if workload else "unknown")
+                    elif item.get('generic_plan'):
+                        # Запрос не выполнялся — показываем среднее время по нагрузке, если оно есть
+                        workload = item.get('workload')
+                        analysis["execution_time"] = (f"{format_ms(workload['mean_ms'])} (pg_stat_statements)"
+                                                      if workload else "GENERIC_PLAN")
+                    elif item.get('estimated_only'):
+                        analysis["execution_time"] = f"> {format_ms(item.get('time_budget_ms'))}"
+                    elif item.get('benchmark') and item['benchmark'].get('execution_ms'):
+                        analysis["execution_time"] = benchmark_time(item['benchmark'])
+                    elif item.get('execution_time_ms') is not None:
+                        # Время измерено EXPLAIN ANALYZE — не полагаемся на оценку модели
+                        analysis["execution_time"] = format_ms(item['execution_time_ms'])
+
+                entry = {
+                    "query": item["query"],
+                    "type": item["type"],
+                    "tables": item.get("tables", []),
+                    "file_path": item.get("file_path", "unknown"),
+                    "fingerprint": item.get('fingerprint') or fingerprint(item['query']),
+                    "analysis": analysis
+                }
+                if elided:
+                    entry["plan_elided"] = elided
+                if item.get('workload'):
+                    entry["workload"] = item['workload']
+                if baseline is not None:
+                    # Сначала сравнение, потом запись: иначе замер сравнивается сам с собой,
+                    # а смена плана сбрасывает историю до того, как её успели обнаружить
+                    comparison = baseline.compare(item)
+                    if comparison:
+                        entry["baseline"] = comparison
+                    if baseline.update:
+                        baseline.record(item)
+                if "query_id" in item:
+                    entry["query_id"] = item["query_id"]
+                yield entry
+    finally:
+        if engine:
+            engine.close()
+
+    logger.info(f"Оценено правилами без LLM: {rule_verdicts} из {total}")
+    logger.info(f"Дедупликация по отпечаткам: сэкономлено {saved_calls} вызовов LLM "
+                f"({unique} уникальных запросов из {total})")
+    logger.info(f"Вызовов LLM: {analyzer.usage['requests']}, токенов: prompt {analyzer.usage['prompt_tokens']}, "
+                f"completion {analyzer.usage['completion_tokens']}")
+
+
+def generate_report(results_file: str, analyzer: OpenRouterAnalyzer, concurrency: int = 1,
+                    batch_tokens: int = 0, batch_size: int = 10, rules: bool = True,
+                    baseline: Optional[BaselineStore] = None) -> List[Dict]:
+    """Генерирует отчёт по всем запросам из файла результатов (см. analyze_results)"""
     try:
-        with open(results_file, 'r', encoding='utf-8') as f:
-            results = json.load(f)
+        results = read_records(results_file)
+        first = next(results, None)
     except Exception as e:
         logger.error(f"Не удалось прочитать {results_file}: {e}")
         sys.exit(1)
+    if first is None:
+        return []
+    return list(analyze_results(itertools.chain([first], results), analyzer, concurrency,
+                                batch_tokens, batch_size, rules, baseline=baseline))
 
-    report = []
-    for item in results:
-        if item.get('error'):
-            analysis = {
-                "evaluation": "CRITICAL",
-                "severity": "CRITICAL",
-                "execution_time": "0ms",
-                "issues": [f"Ошибка выполнения: {item['error']}"],
-                "recommendations": ["Исправьте синтаксис SQL"]
-            }
-        else:
-            analysis = analyzer.analyze_query(item)
-
-        report.append({
-            "query": item["query"],
-            "type": item["type"],
-            "tables": item.get("tables", []),
-            "file_path": item.get("file_path", "unknown"),
-            "analysis": analysis
-        })
 
-    return report
+def check_deployment_criteria(report: Iterable[Dict], fail_on_regression: bool = False) -> bool:
+    """Проверяет, можно ли разрешить деплой (отчёт может быть потоком элементов).
 
-
-def check_deployment_criteria(report: List[Dict]) -> bool:
-    """Проверяет, можно ли разрешить деплой"""
+    fail_on_regression — запрещать деплой и при регрессиях относительно эталона.
+    """
     critical_count = 0
     improvable_count = 0
-    total = len(report)
-
-    if total == 0:
-        print("Нет SQL-запросов для анализа!")
-        return False
+    regression_count = 0
+    flip_count = 0
+    total = 0
 
     for item in report:
+        total += 1
+        comparison = item.get("baseline")
+        if comparison:
+            regression_count += comparison["regression"]
+            flip_count += bool(comparison["plan_flips"])
         eval_status = item["analysis"]["evaluation"]
         if eval_status == "CRITICAL":
             critical_count += 1
         if eval_status in ["NEEDS_IMPROVEMENT", "CRITICAL"]:
             improvable_count += 1
 
+    if total == 0:
+        print("Нет SQL-запросов для анализа!")
+        return False
+
     print(f"\nРезультаты анализа:")
     print(f"- Всего запросов: {total}")
     print(f"- Критических: {critical_count}")
     print(f"- Для улучшения: {improvable_count}/{total} ({improvable_count / total:.0%})")
+    print(f"- Регрессий относительно эталона: {regression_count}, смен плана: {flip_count}")
 
     if critical_count > 0:
         print("Обнаружены критические запросы! Деплой запрещён.")
@@ -264,6 +941,10 @@ def check_deployment_criteria(report: List[Dict]) -> bool:
         print("Слишком много запросов требуют улучшения (>60%). Деплой запрещён.")
         return False
 
+    if fail_on_regression and regression_count > 0:
+        print("Обнаружены регрессии производительности относительно эталона! Деплой запрещён.")
+        return False
+
     print("Все запросы в порядке. Деплой разрешён.")
     return True
 
@@ -272,15 +953,50 @@ def main():
     parser = argparse.ArgumentParser(description='SQL анализатор через OpenRouter')
     parser.add_argument('--results', default='explain_results.json', help='Входной файл с EXPLAIN ANALYZE')
     parser.add_argument('--report', default='llm_report.json', help='Выходной файл отчёта')
+    parser.add_argument('--llm-cache', default='.llm_cache.db', help='Кэш ответов LLM (SQLite)')
+    parser.add_argument('--no-llm-cache', action='store_true', help='Не использовать кэш ответов LLM')
+    parser.add_argument('--llm-cache-ttl', type=float, default=7 * 24, help='Время жизни ответа в кэше, ч')
+    parser.add_argument('--llm-cache-size', type=int, default=20000, help='Максимум ответов в кэше')
+    parser.add_argument('--concurrency', type=int, default=1, help='Число параллельных запросов к LLM')
+    parser.add_argument('--rpm', type=float, default=20, help='Лимит провайдера: запросов в минуту')
+    parser.add_argument('--max-retries', type=int, default=5, help='Повторов запроса при 429/5xx/сетевых ошибках')
+    parser.add_argument('--batch-tokens', type=int, default=0,
+                        help='Пакетный режим: бюджет токенов промпта на пакет запросов (0 — по одному)')
+    parser.add_argument('--batch-size', type=int, default=10, help='Максимум запросов в одном пакете')
+    parser.add_argument('--plan-tokens', type=int, default=1500,
+                        help='Бюджет токенов на план в промпте: большие планы сжимаются')
+    parser.add_argument('--baseline', default=None,
+                        help='Эталонные измерения (SQLite): сравнивать с ними время и планы')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='Добавить измерения этого запуска в эталон (сборки main)')
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help='Запрещать деплой при регрессиях относительно эталона')
+    parser.add_argument('--no-rules', action='store_true',
+                        help='Отправлять в LLM все запросы, без локальной оценки правилами')
+    parser.add_argument('--trace', default=None, help='JSON-трасса спанов стадии')
+    parser.add_argument('--metrics', default=None, help='Textfile Prometheus с метриками стадии')
     args = parser.parse_args()
 
+    cache = None
+    if not args.no_llm_cache:
+        cache = KeyValueCache(args.llm_cache, args.llm_cache_size, args.llm_cache_ttl * 3600)
+
     try:
-        analyzer = OpenRouterAnalyzer()
+        analyzer = OpenRouterAnalyzer(cache, args.rpm, args.max_retries, args.plan_tokens)
     except Exception as e:
         logger.error(f"Не удалось инициализировать анализатор: {e}")
         sys.exit(1)
 
-    report = generate_report(args.results, analyzer)
+    baseline = BaselineStore(args.baseline, args.update_baseline) if args.baseline else None
+    report = generate_report(args.results, analyzer, args.concurrency, args.batch_tokens, args.batch_size,
+                             not args.no_rules, baseline)
+    if baseline:
+        baseline.close()
+    if cache:
+        stats = cache.stats()
+        logger.info(f"Кэш LLM: {stats['hits']} попаданий, {stats['misses']} промахов, "
+                    f"{stats['evicted']} вытеснено")
+        cache.close()
 
     try:
         with open(args.report, 'w', encoding='utf-8') as f:
@@ -289,8 +1005,9 @@ def main():
     except Exception as e:
         logger.error(f"Не удалось сохранить отчёт: {e}")
         sys.exit(1)
+    metrics.export(args.trace, args.metrics)
 
-    if not check_deployment_criteria(report):
+    if not check_deployment_criteria(report, args.fail_on_regression):
         sys.exit(1)
 
     sys.exit(0)
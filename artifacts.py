@@ -0,0 +1,73 @@
+import json
+import textwrap
+
+
+def is_jsonl(path):
+    """Определяет формат артефакта по расширению файла"""
+    return path.endswith('.jsonl')
+
+
+def read_records(path):
+    """Построчно читает записи из .jsonl или целиком из .json артефакта"""
+    with open(path, 'r', encoding='utf-8') as f:
+        if is_jsonl(path):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            data = json.load(f)
+            if isinstance(data, list):
+                yield from data
+            else:
+                yield data
+
+
+class RecordWriter:
+    """Пишет записи в .jsonl или .json артефакт по одной, не собирая их в памяти"""
+
+    def __init__(self, path):
+        self.path = path
+        self.jsonl = is_jsonl(path)
+        self.count = 0
+        self.file = open(path, 'w', encoding='utf-8')
+        if not self.jsonl:
+            self.file.write('[')
+
+    def write(self, record):
+        if self.jsonl:
+            self.file.write(json.dumps(record, ensure_ascii=False))
+            self.file.write('\n')
+            # Следующая стадия (или человек) может читать файл, пока он пишется
+            self.file.flush()
+        else:
+            self.file.write(',\n' if self.count else '\n')
+            self.file.write(textwrap.indent(json.dumps(record, indent=2, ensure_ascii=False), '  '))
+        self.count += 1
+
+    def close(self):
+        if not self.jsonl:
+            self.file.write('\n]' if self.count else ']')
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_records(records, path):
+    """Потоково записывает записи в .jsonl или .json артефакт, возвращает их количество"""
+    with RecordWriter(path) as writer:
+        for record in records:
+            writer.write(record)
+    return writer.count
+
+
+def tee_records(records, path):
+    """Пропускает записи дальше по конвейеру, попутно сохраняя их в артефакт"""
+    with RecordWriter(path) as writer:
+        for record in records:
+            writer.write(record)
+            yield record
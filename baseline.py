@@ -0,0 +1,143 @@
+import json
+import time
+import sqlite3
+import statistics
+
+from plan_model import Plan, format_ms
+
+# Сколько последних измерений хранить на отпечаток: по ним оценивается шум
+BASELINE_HISTORY = 10
+# Регрессия — замедление больше всех трёх порогов: относительного, абсолютного и шумового
+REGRESSION_RATIO = 0.2
+REGRESSION_MIN_MS = 1.0
+NOISE_MADS = 3.0
+
+
+def scan_methods(plan):
+    """Способ доступа к каждой таблице плана: {"orders o": "Index Scan using orders_pkey"}"""
+    methods = {}
+    for _, node in plan.iter_nodes():
+        if node.relation:
+            key = node.relation if node.alias in (None, node.relation) else f"{node.relation} {node.alias}"
+            methods[key] = f"{node.node_type} using {node.index_name}" if node.index_name else node.node_type
+    return methods
+
+
+def plan_shape(plan):
+    """Структура плана без чисел: типы узлов, таблицы и индексы в порядке обхода"""
+    return [f"{depth}:{node.node_type}:{node.relation or ''}:{node.index_name or ''}"
+            for depth, node in plan.iter_nodes()]
+
+
+class BaselineStore:
+    """Эталонные измерения запросов по отпечатку (обычно — со сборок main) в SQLite.
+
+    compare() сравнивает текущий результат EXPLAIN ANALYZE с эталоном: время с учётом
+    разброса прошлых измерений и смена способа доступа к таблицам (plan flip).
+    При update=True record() добавляет текущие измерения в историю эталона.
+    """
+
+    def __init__(self, path, update=False):
+        self.update = update
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS baselines (
+                fingerprint TEXT PRIMARY KEY,
+                samples TEXT NOT NULL,
+                shared_hit INTEGER,
+                shared_read INTEGER,
+                scans TEXT NOT NULL,
+                shape TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+        self._recorded = set()
+
+    @staticmethod
+    def measurable(item):
+        return bool(item.get('plan')) and not item.get('error') and not item.get('estimated_only') \
+            and item.get('execution_time_ms') is not None
+
+    def compare(self, item):
+        """Отличия результата от эталона или None, если эталона нет или время не измерено"""
+        if not self.measurable(item):
+            return None
+        row = self.conn.execute(
+            "SELECT samples, shared_hit, shared_read, scans, shape FROM baselines WHERE fingerprint = ?",
+            (item['fingerprint'],)
+        ).fetchone()
+        if row is None:
+            return None
+
+        samples = json.loads(row[0])
+        baseline_ms = statistics.median(samples)
+        noise_ms = statistics.median(abs(s - baseline_ms) for s in samples) * 1.4826
+        threshold_ms = max(baseline_ms * REGRESSION_RATIO, REGRESSION_MIN_MS, noise_ms * NOISE_MADS)
+        current_ms = item['execution_time_ms']
+        delta_ms = current_ms - baseline_ms
+
+        plan = Plan.from_explain(item['plan'])
+        before, after = json.loads(row[3]), scan_methods(plan)
+        flips = [f"{table}: {before[table]} → {after[table]}"
+                 for table in sorted(before.keys() & after.keys()) if before[table] != after[table]]
+
+        comparison = {
+            "baseline_ms": round(baseline_ms, 3),
+            "current_ms": round(current_ms, 3),
+            "delta_ms": round(delta_ms, 3),
+            "delta_pct": round(delta_ms / baseline_ms * 100, 1) if baseline_ms else None,
+            "threshold_ms": round(threshold_ms, 3),
+            "samples": len(samples),
+            "regression": delta_ms > threshold_ms,
+            "improvement": -delta_ms > threshold_ms,
+            "plan_flips": flips,
+            "plan_changed": json.loads(row[4]) != plan_shape(plan),
+        }
+        buffers = plan.buffers()
+        if row[2] is not None:
+            comparison["shared_read_delta"] = buffers["shared_read"] - row[2]
+        return comparison
+
+    def record(self, item):
+        """Добавляет измерение в историю эталона (один раз за запуск на отпечаток)"""
+        fp = item.get('fingerprint')
+        if not self.measurable(item) or fp in self._recorded:
+            return
+        self._recorded.add(fp)
+        plan = Plan.from_explain(item['plan'])
+        row = self.conn.execute("SELECT samples, shape FROM baselines WHERE fingerprint = ?", (fp,)).fetchone()
+        samples = json.loads(row[0]) if row else []
+        if row and json.loads(row[1]) != plan_shape(plan):
+            # План сменился — старые измерения относятся к другому плану
+            samples = []
+        samples = (samples + [item['execution_time_ms']])[-BASELINE_HISTORY:]
+        buffers = plan.buffers()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO baselines (fingerprint, samples, shared_hit, shared_read, scans, shape, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (fp, json.dumps(samples), buffers["shared_hit"], buffers["shared_read"],
+             json.dumps(scan_methods(plan), ensure_ascii=False), json.dumps(plan_shape(plan)), time.time())
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def describe(comparison):
+    """Короткое описание отличия от эталона для отчёта"""
+    text = f"{comparison['delta_ms']:+.3f}ms"
+    if comparison['delta_pct'] is not None:
+        text = f"{comparison['delta_pct']:+.1f}% ({text})"
+    text += f": {format_ms(comparison['baseline_ms'])} → {format_ms(comparison['current_ms'])}"
+    if comparison['regression']:
+        text += " — РЕГРЕССИЯ"
+    elif comparison['improvement']:
+        text += " — ускорение"
+    if comparison['plan_flips']:
+        text += "; смена плана: " + "; ".join(comparison['plan_flips'])
+    elif comparison['plan_changed']:
+        text += "; структура плана изменилась"
+    return text
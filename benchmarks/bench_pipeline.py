@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Сквозной бенчмарк: пропускная способность, p95 и пиковая память каждой стадии.
+
+Генерирует N синтетических .sql файлов по схеме init.sql, поднимает локальную замену
+OpenRouter (mock_openrouter.py) и по очереди запускает стадии отдельными процессами —
+sqlParse.py, explainRunner.py, LLM_aggregator.py, report_converter.py, — а затем весь
+конвейер pipeline.py. Для каждого запуска: запросов в секунду, p95 основного спана из
+трассы (--trace) и пиковый RSS процесса (os.wait4, Linux). Кэши отключены.
+Код выхода 1 у LLM_aggregator.py и pipeline.py обычно означает запрет деплоя по
+синтетическим оценкам, а не сбой — подробности в bench.log.
+
+EXPLAIN выполняется на настоящей БД — например, из docker-compose:
+
+    docker-compose up -d db
+    DB_HOST=localhost DB_NAME=postgres DB_USER=postgres DB_PASSWORD=postgres \\
+        python benchmarks/bench_pipeline.py --files 200 --queries-per-file 25 -j 4 --concurrency 16
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import psycopg2  # noqa: E402
+
+from explainRunner import get_connection_params  # noqa: E402
+from instrumentation import load_summary  # noqa: E402
+from mock_openrouter import add_config_arguments, config_from_args, serve  # noqa: E402
+
+STAGES = ("parse", "explain", "analyze", "report", "pipeline")
+# Спан одной единицы работы стадии, по которому считается p95
+LATENCY_SPANS = {
+    "parse": ("parse.file",),
+    "explain": ("explain.query",),
+    "analyze": ("llm.request",),
+    "report": (),
+    "pipeline": ("explain.query", "llm.request"),
+}
+
+TOWNS = ("Москва", "Париж", "Berlin", "Rostov", "New York", "Казань", "Sochi")
+TRIP_COLUMNS = ("id", "plane", "company", "town_from", "town_to", "time_out", "time_in")
+PASSENGER_COLUMNS = ("id", "full_name", "phone", "email", "is_active", "created_at")
+
+
+def _columns(rng, columns, alias=None):
+    """Случайный набор столбцов: разные наборы дают разные отпечатки, и запросы не схлопываются"""
+    chosen = rng.sample(columns, rng.randint(1, len(columns)))
+    return ", ".join(f"{alias}.{column}" if alias else column for column in chosen)
+
+
+def random_query(rng):
+    town = rng.choice(TOWNS)
+    kind = rng.randrange(6)
+    if kind == 0:
+        return (f"SELECT {_columns(rng, TRIP_COLUMNS)} FROM trip WHERE town_from = '{town}' "
+                f"ORDER BY {rng.choice(TRIP_COLUMNS)} LIMIT {rng.randint(10, 1000)};")
+    if kind == 1:
+        columns = _columns(rng, TRIP_COLUMNS, 't')
+        return (f"SELECT {columns}, count(*) FROM trip t "
+                f"JOIN pass_in_trip p ON p.trip = t.id WHERE t.time_out > '2024-0{rng.randint(1, 9)}-01' "
+                f"GROUP BY {columns};")
+    if kind == 2:
+        return (f"SELECT {_columns(rng, PASSENGER_COLUMNS)} FROM passengers "
+                f"WHERE created_at > now() - interval '{rng.randint(1, 90)} days' AND is_active;")
+    if kind == 3:
+        return (f"SELECT c.name, count(*) FROM companies c JOIN trip t ON t.company = c.id "
+                f"WHERE t.{rng.choice(('town_from', 'town_to'))} = '{town}' "
+                f"GROUP BY c.name HAVING count(*) > {rng.randint(1, 100)};")
+    if kind == 4:
+        return (f"SELECT {_columns(rng, PASSENGER_COLUMNS, 'ps')} FROM passengers ps "
+                f"WHERE ps.id IN (SELECT passenger FROM pass_in_trip WHERE trip = {rng.randint(1, 100000)});")
+    return f"UPDATE passengers SET phone = '+7{rng.randint(10 ** 9, 10 ** 10 - 1)}' WHERE id = {rng.randint(1, 10 ** 6)};"
+
+
+def generate_sql_files(directory, files, queries_per_file, seed=42):
+    """Пишет files файлов по queries_per_file запросов; возвращает общее число запросов"""
+    rng = random.Random(seed)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    for i in range(files):
+        with open(os.path.join(directory, f"queries_{i:05d}.sql"), "w", encoding="utf-8") as f:
+            f.write(f"-- Синтетический файл {i} для bench_pipeline.py\n")
+            for _ in range(queries_per_file):
+                f.write(random_query(rng) + "\n\n")
+    return files * queries_per_file
+
+
+def _script(name):
+    return os.path.join(ROOT, name)
+
+
+def stage_commands(args):
+    python = sys.executable
+    analyze_options = ["--concurrency", str(args.concurrency), "--rpm", str(args.rpm),
+                       "--batch-tokens", str(args.batch_tokens)]
+    if not args.rules:
+        analyze_options.append("--no-rules")
+    return {
+        "parse": [python, _script("sqlParse.py"), "sql", "-o", "parsed.jsonl", "--no-cache",
+                  "-j", str(args.workers), "--trace", "parse.trace.json"],
+        "explain": [python, _script("explainRunner.py"), "--input", "parsed.jsonl", "--output", "explained.jsonl",
+                    "-j", str(args.workers), "--no-plan-cache", "--trace", "explain.trace.json"]
+                   + (["--no-dedupe"] if args.no_dedupe else []),
+        "analyze": [python, _script("LLM_aggregator.py"), "--results", "explained.jsonl", "--report", "report.json",
+                    "--no-llm-cache", "--trace", "analyze.trace.json"] + analyze_options,
+        "report": [python, _script("report_converter.py"), "report.json", "report.html"],
+        "pipeline": [python, _script("pipeline.py"), "sql", "--parsed", "pipeline_parsed.jsonl",
+                     "--explained", "pipeline_explained.jsonl", "--report", "pipeline_report.jsonl",
+                     "--html", "pipeline.html", "--run-db", "pipeline.run.db", "--no-parse-cache",
+                     "--no-plan-cache", "--no-llm-cache", "--parse-workers", str(args.workers),
+                     "--explain-workers", str(args.workers), "--trace", "pipeline.trace.json"]
+                    + (["--no-dedupe"] if args.no_dedupe else []) + analyze_options,
+    }
+
+
+def run_stage(command, workdir, env):
+    """Запускает стадию; возвращает (время, код выхода, пиковый RSS в МБ)"""
+    started = time.perf_counter()
+    with open(os.path.join(workdir, "bench.log"), "a", encoding="utf-8") as log:
+        log.write(f"\n$ {' '.join(command)}\n")
+        log.flush()
+        process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 отдаёт ресурсы именно этого процесса; ru_maxrss на Linux — в килобайтах
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    return time.perf_counter() - started, process.returncode, usage.ru_maxrss / 1024
+
+
+def stage_result(stage, workdir, wall_s, exit_code, rss_mb, queries):
+    result = {"wall_s": round(wall_s, 3), "queries": queries, "queries_per_s": round(queries / wall_s, 1),
+              "peak_rss_mb": round(rss_mb, 1), "exit_code": exit_code, "p95_s": {}}
+    trace = os.path.join(workdir, f"{stage}.trace.json")
+    if os.path.exists(trace):
+        spans = load_summary([trace])["spans"]
+        result["p95_s"] = {name: spans[name]["p95_s"] for name in LATENCY_SPANS[stage] if name in spans}
+    return result
+
+
+def print_results(results):
+    print(f"{'stage':<10} {'wall, s':>9} {'queries/s':>10} {'peak RSS, MB':>13}  p95")
+    for stage, result in results.items():
+        p95 = ", ".join(f"{name} {value * 1000:.1f}ms" for name, value in result["p95_s"].items()) or "-"
+        mark = "" if result["exit_code"] == 0 else f"  (exit {result['exit_code']})"
+        print(f"{stage:<10} {result['wall_s']:>9.2f} {result['queries_per_s']:>10.1f} "
+              f"{result['peak_rss_mb']:>13.1f}  {p95}{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сквозной бенчмарк конвейера с локальной заменой OpenRouter')
+    parser.add_argument('--files', type=int, default=100, help='Сколько .sql файлов сгенерировать')
+    parser.add_argument('--queries-per-file', type=int, default=20, help='Запросов в файле')
+    parser.add_argument('--workdir', default='bench_run', help='Каталог для файлов и артефактов (очищается)')
+    parser.add_argument('--stages', default=','.join(STAGES), help='Какие стадии запускать, через запятую')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='Процессов разбора и соединений EXPLAIN')
+    parser.add_argument('--no-dedupe', action='store_true', help='Выполнять EXPLAIN для каждого запроса')
+    parser.add_argument('--concurrency', type=int, default=8, help='Параллельных запросов к LLM')
+    parser.add_argument('--rpm', type=float, default=100000, help='Лимит запросов в минуту на стороне клиента')
+    parser.add_argument('--batch-tokens', type=int, default=0, help='Пакетный режим LLM (0 — по одному)')
+    parser.add_argument('--rules', action='store_true',
+                        help='Оценивать однозначные случаи правилами (по умолчанию всё идёт в LLM)')
+    parser.add_argument('--base-url', default=None,
+                        help='Внешний сервер вместо встроенной замены (например, отдельно запущенный mock)')
+    parser.add_argument('-o', '--output', default='bench_results.json', help='Результаты в JSON')
+    # Параметры замены OpenRouter; её --seed задаёт и генерацию запросов
+    add_config_arguments(parser)
+    parser.set_defaults(seed=42)
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    if {"explain", "pipeline"} & set(stages):
+        try:
+            psycopg2.connect(**get_connection_params()).close()
+        except Exception as e:
+            print(f"Cannot connect to PostgreSQL ({e}). Start it with `docker-compose up -d db` "
+                  f"and set DB_HOST/DB_NAME/DB_USER/DB_PASSWORD")
+            sys.exit(1)
+
+    workdir = os.path.abspath(args.workdir)
+    queries = generate_sql_files(os.path.join(workdir, "sql"), args.files, args.queries_per_file, args.seed)
+    if os.path.exists(os.path.join(workdir, "bench.log")):
+        os.remove(os.path.join(workdir, "bench.log"))
+    print(f"Generated {args.files} files with {queries} queries in {workdir}/sql")
+
+    env = dict(os.environ)
+    server, config = None, None
+    if args.base_url:
+        env["OPENROUTER_BASE_URL"] = args.base_url
+    else:
+        config = config_from_args(args)
+        server = serve(config)
+        env["OPENROUTER_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/api/v1"
+        env.setdefault("OPENROUTER_API_KEY", "mock")
+
+    results = {}
+    commands = stage_commands(args)
+    try:
+        for stage in stages:
+            print(f"Running {stage}...")
+            trace = os.path.join(workdir, f"{stage}.trace.json")
+            if os.path.exists(trace):
+                os.remove(trace)
+            wall_s, exit_code, rss_mb = run_stage(commands[stage], workdir, env)
+            results[stage] = stage_result(stage, workdir, wall_s, exit_code, rss_mb, queries)
+    finally:
+        if server:
+            server.shutdown()
+
+    print_results(results)
+    summary = {"files": args.files, "queries": queries, "workers": args.workers,
+               "concurrency": args.concurrency, "stages": results}
+    if config:
+        summary["mock"] = dict(config.stats)
+        print(f"Mock OpenRouter: {config.stats}")
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"Results saved to {args.output}; stage output in {workdir}/bench.log")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Микробенчмарк: быстрый лексер sql_lexer против полного разбора sqlparse.
+
+Генерирует файл в стиле pg_dump заданного размера и замеряет скорость обоих путей.
+Полный разбор sqlparse на сотнях мегабайт идёт очень долго, поэтому он меряется на
+префиксе файла (--sqlparse-mb), а скорость сравнивается в MB/s.
+
+    python benchmarks/bench_splitter.py --size-mb 500
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlparse  # noqa: E402
+
+from sqlParse import get_clean_query, get_query_type  # noqa: E402
+from sql_lexer import split_statements  # noqa: E402
+
+DUMP_HEADER = """--
+-- PostgreSQL database dump
+--
+
+SET statement_timeout = 0;
+SET client_encoding = 'UTF8';
+SET standard_conforming_strings = on;
+
+CREATE FUNCTION public.touch_updated_at() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    NEW.updated_at := now(); -- комментарий внутри тела
+    RETURN NEW;
+END;
+$$;
+
+CREATE TABLE public.trip (
+    id integer NOT NULL,
+    plane text,
+    company integer,
+    town_from text,
+    town_to text,
+    time_out timestamp without time zone
+);
+
+/* Данные таблицы public.trip */
+"""
+
+TOWNS = ['Москва', 'Париж', "O'Hare", 'Rostov; on Don', 'New York', 'Berlin']
+
+
+def generate_dump(path, size_mb, seed=42):
+    """Пишет синтетический дамп с INSERT-ами (pg_dump --inserts) до нужного размера"""
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        written += f.write(DUMP_HEADER)
+        row_id = 0
+        while written < target:
+            rows = []
+            for _ in range(50):
+                row_id += 1
+                town_from, town_to = rng.sample(TOWNS, 2)
+                rows.append(
+                    f"({row_id}, 'A{rng.randint(300, 380)}', {rng.randint(1, 100)}, "
+                    f"'{town_from.replace(chr(39), chr(39) * 2)}', '{town_to.replace(chr(39), chr(39) * 2)}', "
+                    f"'2024-01-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:00:00')"
+                )
+            chunk = "INSERT INTO public.trip VALUES\n" + ",\n".join(rows) + ";\n"
+            if row_id % 5000 == 0:
+                chunk += f"-- checkpoint {row_id}\nCOMMENT ON TABLE public.trip IS 'rows: {row_id}';\n"
+            written += f.write(chunk)
+
+
+def sqlparse_path(sql):
+    statements = []
+    for stmt in sqlparse.parse(sql):
+        clean_query = get_clean_query(stmt)
+        if clean_query and not clean_query.isspace():
+            statements.append((clean_query, get_query_type(stmt)))
+    return statements
+
+
+def measure(func, sql):
+    start = time.perf_counter()
+    result = func(sql)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк разбиения SQL на запросы')
+    parser.add_argument('--size-mb', type=int, default=50, help='Размер сгенерированного дампа')
+    parser.add_argument('--sqlparse-mb', type=float, default=2, help='Размер префикса для sqlparse')
+    parser.add_argument('--dump', default='bench_dump.sql', help='Путь к дампу (переиспользуется, если есть)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.dump) or os.path.getsize(args.dump) < args.size_mb * 1024 * 1024:
+        print(f"Генерация дампа {args.size_mb} MB в {args.dump}...")
+        generate_dump(args.dump, args.size_mb)
+
+    with open(args.dump, 'r', encoding='utf-8') as f:
+        sql = f.read()
+    size_mb = len(sql.encode('utf-8')) / 1024 / 1024
+
+    fast_time, fast_result = measure(split_statements, sql)
+    if fast_result is None:
+        print("Лексер счёл дамп неоднозначным — проверьте генератор")
+        sys.exit(1)
+    print(f"sql_lexer: {size_mb:.1f} MB, {len(fast_result)} statements, "
+          f"{fast_time:.2f}s ({size_mb / fast_time:.1f} MB/s)")
+
+    # sqlparse меряем на префиксе, обрезанном по границе запроса
+    cut = sql.find(';\n', int(args.sqlparse_mb * 1024 * 1024))
+    prefix = sql if cut == -1 else sql[:cut + 2]
+    prefix_mb = len(prefix.encode('utf-8')) / 1024 / 1024
+
+    slow_time, slow_result = measure(sqlparse_path, prefix)
+    prefix_fast_time, prefix_fast = measure(split_statements, prefix)
+    print(f"sqlparse:  {prefix_mb:.1f} MB, {len(slow_result)} statements, "
+          f"{slow_time:.2f}s ({prefix_mb / slow_time:.2f} MB/s)")
+    print(f"Ускорение на префиксе: x{slow_time / prefix_fast_time:.0f}")
+
+    if len(prefix_fast) != len(slow_result):
+        print(f"⚠️  Число запросов различается: {len(prefix_fast)} против {len(slow_result)}")
+    mismatched = sum(1 for a, b in zip(prefix_fast, slow_result) if a[1] != b[1])
+    if mismatched:
+        print(f"⚠️  Тип запроса различается в {mismatched} запросах")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""Локальная замена OpenRouter: протокол OpenAI chat completions без расхода квоты.
+
+Отвечает правдоподобными анализами в формате промпта LLM_aggregator (одиночными и
+пакетными) с настраиваемой задержкой, долей ошибок 429/5xx и долей испорченных ответов,
+на которых проверяется _extract_json и повторный анализ. Анализатор направляется сюда
+переменной окружения OPENROUTER_BASE_URL:
+
+    python benchmarks/mock_openrouter.py --port 8765 --latency-ms 800 --rate-429 0.05
+    OPENROUTER_BASE_URL=http://127.0.0.1:8765/api/v1 OPENROUTER_API_KEY=mock python pipeline.py .
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EVALUATIONS = ("GOOD", "ACCEPTABLE", "NEEDS_IMPROVEMENT", "CRITICAL")
+SEVERITIES = {"GOOD": "LOW", "ACCEPTABLE": "LOW", "NEEDS_IMPROVEMENT": "MEDIUM", "CRITICAL": "CRITICAL"}
+# Виды испорченных ответов: что реально приходит от бесплатных моделей
+MALFORMED_KINDS = ("markdown", "prose", "truncated", "no_json", "bad_evaluation")
+
+_BATCH_ID = re.compile(r'^### (\S+)\s*$', re.MULTILINE)
+
+
+class MockConfig:
+    """Поведение сервера; доли — вероятности на один запрос"""
+
+    def __init__(self, latency_ms=300.0, latency_dist="lognormal", latency_sigma=0.5, rate_429=0.0,
+                 rate_5xx=0.0, malformed=0.0, retry_after=1.0, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.malformed = malformed
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "ok": 0, "429": 0, "5xx": 0, "malformed": 0}
+
+    def latency_s(self):
+        """Задержка ответа: latency_ms — медиана (для uniform — середина диапазона)"""
+        with self.lock:
+            if self.latency_dist == "fixed":
+                value = self.latency_ms
+            elif self.latency_dist == "uniform":
+                value = self.rng.uniform(0, 2 * self.latency_ms)
+            elif self.latency_dist == "exponential":
+                value = self.rng.expovariate(1 / self.latency_ms) if self.latency_ms else 0
+            else:
+                # Логнормальное: длинный хвост, как у реальных провайдеров
+                value = self.latency_ms * self.rng.lognormvariate(0, self.latency_sigma)
+        return value / 1000
+
+    def draw(self):
+        """Исход запроса: "429", "5xx", "malformed" или "ok" """
+        with self.lock:
+            self.stats["requests"] += 1
+            roll = self.rng.random()
+            if roll < self.rate_429:
+                outcome = "429"
+            elif roll < self.rate_429 + self.rate_5xx:
+                outcome = "5xx"
+            elif roll < self.rate_429 + self.rate_5xx + self.malformed:
+                outcome = "malformed"
+            else:
+                outcome = "ok"
+            self.stats[outcome] += 1
+            return outcome
+
+    def choice(self, items):
+        with self.lock:
+            return self.rng.choice(items)
+
+
+def analysis(text):
+    """Детерминированный по тексту анализ: одинаковые промпты получают одинаковый ответ"""
+    digest = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+    evaluation = EVALUATIONS[digest % len(EVALUATIONS)]
+    return {
+        "evaluation": evaluation,
+        "severity": SEVERITIES[evaluation],
+        "execution_time": f"{digest % 5000 / 10:.1f}ms",
+        "issues": [f"Синтетическое замечание {digest % 97}"],
+        "recommendations": [f"Синтетическая рекомендация {digest % 89}"],
+    }
+
+
+def answer(prompt):
+    """Ответ на промпт LLM_aggregator: объект или массив по id из заголовков ### пакета"""
+    ids = _BATCH_ID.findall(prompt)
+    if not ids:
+        return json.dumps(analysis(prompt), ensure_ascii=False, indent=2)
+    sections = re.split(_BATCH_ID, prompt)
+    return json.dumps([dict(analysis(text), id=item_id) for item_id, text in zip(ids, sections[2::2])],
+                      ensure_ascii=False, indent=2)
+
+
+def malformed_answer(content, kind):
+    if kind == "markdown":
+        return f"```json\n{content}\n```"
+    if kind == "prose":
+        return f"Вот результат анализа:\n{content}\nНадеюсь, это поможет."
+    if kind == "truncated":
+        return content[:len(content) // 2]
+    if kind == "no_json":
+        return "Запрос выглядит нормально, замечаний нет."
+    return content.replace('"evaluation": "', '"evaluation": "GOOD|', 1)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload, headers=()):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.config.lock:
+                self._send(200, dict(self.config.stats))
+        else:
+            self._send(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {"error": {"message": "not found"}})
+            return
+        request = json.loads(body or b"{}")
+        prompt = "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+
+        time.sleep(self.config.latency_s())
+        outcome = self.config.draw()
+        if outcome == "429":
+            self._send(429, {"error": {"message": "Rate limit exceeded", "code": 429}},
+                       [("Retry-After", f"{self.config.retry_after:g}")])
+            return
+        if outcome == "5xx":
+            status = self.config.choice((500, 502, 503))
+            self._send(status, {"error": {"message": "Upstream error", "code": status}})
+            return
+
+        content = answer(prompt)
+        if outcome == "malformed":
+            content = malformed_answer(content, self.config.choice(MALFORMED_KINDS))
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(content) // 4
+        self._send(200, {
+            "id": f"mock-{time.time_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+
+def serve(config, host="127.0.0.1", port=0):
+    """Запускает сервер в фоновом потоке; port=0 — свободный порт (см. server.server_port)"""
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-openrouter", daemon=True).start()
+    return server
+
+
+def add_config_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=300, help='Медианная задержка ответа, мс')
+    parser.add_argument('--latency-dist', choices=('fixed', 'uniform', 'lognormal', 'exponential'),
+                        default='lognormal', help='Распределение задержки')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='Разброс логнормальной задержки')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='Доля ответов 429 (с Retry-After)')
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help='Доля ответов 500/502/503')
+    parser.add_argument('--malformed', type=float, default=0.0, help='Доля ответов с испорченным JSON')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After в ответах 429, с')
+    parser.add_argument('--seed', type=int, default=None, help='Зерно для воспроизводимых сбоев')
+
+
+def config_from_args(args):
+    return MockConfig(args.latency_ms, args.latency_dist, args.latency_sigma, args.rate_429,
+                      args.rate_5xx, args.malformed, args.retry_after, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальная замена OpenRouter (OpenAI chat completions)')
+    parser.add_argument('--host', default='127.0.0.1', help='Адрес сервера')
+    parser.add_argument('--port', type=int, default=8765, help='Порт сервера')
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    config = config_from_args(args)
+    server = serve(config, args.host, args.port)
+    print(f"Mock OpenRouter on http://{args.host}:{server.server_port}/api/v1 "
+          f"(set OPENROUTER_BASE_URL to this address)")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        print(f"Served: {config.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import hashlib
+
+# Всё, от чего зависит план: структура таблиц, определения индексов, статистика и версия сервера
+SCHEMA_VERSION_QUERY = """
+SELECT item FROM (
+    SELECT format('rel %s.%s %s %s', n.nspname, c.relname, c.relkind, c.reltuples::bigint) AS item
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind IN ('r', 'p', 'm', 'v', 'f')
+      AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+      AND n.nspname NOT LIKE 'pg_toast%'
+    UNION ALL
+    SELECT format('col %s.%s.%s %s %s', n.nspname, c.relname, a.attname,
+                  format_type(a.atttypid, a.atttypmod), a.attnotnull)
+    FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE a.attnum > 0 AND NOT a.attisdropped
+      AND c.relkind IN ('r', 'p', 'm', 'v', 'f')
+      AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+      AND n.nspname NOT LIKE 'pg_toast%'
+    UNION ALL
+    SELECT format('idx %s', pg_get_indexdef(i.indexrelid))
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname NOT IN ('pg_catalog', 'information_schema')
+      AND n.nspname NOT LIKE 'pg_toast%'
+    UNION ALL
+    SELECT format('server %s', current_setting('server_version_num'))
+) items
+ORDER BY item
+"""
+
+
+def schema_version(conn):
+    """Хэш схемы и статистики: меняется при изменении таблиц, индексов или reltuples после ANALYZE"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SCHEMA_VERSION_QUERY)
+        digest = hashlib.sha256()
+        for (item,) in cursor:
+            digest.update(item.encode('utf-8'))
+            digest.update(b'\n')
+        return digest.hexdigest()[:16]
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+# Столбцы обычных и секционированных таблиц схемы (генерируемые столбцы заполняет сервер)
+TABLE_COLUMNS_QUERY = """
+SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod), a.attnotnull,
+       pg_get_expr(d.adbin, d.adrelid), a.attidentity
+FROM pg_attribute a
+JOIN pg_class c ON c.oid = a.attrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+WHERE n.nspname = %s AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+  AND a.attnum > 0 AND NOT a.attisdropped AND a.attgenerated = ''
+ORDER BY c.relname, a.attnum
+"""
+
+# Одностолбцовые уникальные индексы (включая первичные ключи)
+UNIQUE_COLUMNS_QUERY = """
+SELECT c.relname, a.attname, i.indisprimary
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+WHERE n.nspname = %s AND i.indisunique AND i.indnatts = 1
+"""
+
+# Одностолбцовые внешние ключи
+FOREIGN_KEYS_QUERY = """
+SELECT c.relname, a.attname, rn.nspname, rc.relname, ra.attname
+FROM pg_constraint k
+JOIN pg_class c ON c.oid = k.conrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_class rc ON rc.oid = k.confrelid
+JOIN pg_namespace rn ON rn.oid = rc.relnamespace
+JOIN pg_attribute a ON a.attrelid = k.conrelid AND a.attnum = k.conkey[1]
+JOIN pg_attribute ra ON ra.attrelid = k.confrelid AND ra.attnum = k.confkey[1]
+WHERE n.nspname = %s AND k.contype = 'f' AND cardinality(k.conkey) = 1
+"""
+
+
+def describe_tables(conn, schema="public"):
+    """Таблицы схемы: столбцы, уникальные столбцы, первичный ключ и внешние ключи.
+
+    {"trip": {"columns": [{"name", "type", "not_null", "default", "identity"}],
+              "unique": {"id"}, "primary_key": "id",
+              "foreign_keys": {"company": ("public", "companies", "id")}}}
+    """
+    cursor = conn.cursor()
+    try:
+        tables = {}
+        cursor.execute(TABLE_COLUMNS_QUERY, (schema,))
+        for table, name, type_name, not_null, default, identity in cursor.fetchall():
+            info = tables.setdefault(table, {"columns": [], "unique": set(), "primary_key": None,
+                                             "foreign_keys": {}})
+            info["columns"].append({"name": name, "type": type_name, "not_null": not_null,
+                                    "default": default, "identity": identity})
+        cursor.execute(UNIQUE_COLUMNS_QUERY, (schema,))
+        for table, name, primary in cursor.fetchall():
+            if table in tables:
+                tables[table]["unique"].add(name)
+                if primary:
+                    tables[table]["primary_key"] = name
+        cursor.execute(FOREIGN_KEYS_QUERY, (schema,))
+        for table, name, ref_schema, ref_table, ref_column in cursor.fetchall():
+            if table in tables:
+                tables[table]["foreign_keys"][name] = (ref_schema, ref_table, ref_column)
+        return tables
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+# Ключевые столбцы существующих индексов (индексы по выражениям и частичные пропускаются)
+INDEX_COLUMNS_QUERY = """
+SELECT n.nspname, c.relname, array_agg(a.attname ORDER BY k.position)
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+CROSS JOIN LATERAL unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, position)
+JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+WHERE n.nspname NOT IN ('pg_catalog', 'information_schema')
+  AND n.nspname NOT LIKE 'pg_toast%'
+  AND i.indexprs IS NULL AND i.indpred IS NULL AND k.position <= i.indnkeyatts
+GROUP BY i.indexrelid, n.nspname, c.relname
+"""
+
+
+def index_columns(conn):
+    """Существующие индексы: {(схема, таблица): [(столбец, ...), ...]}"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(INDEX_COLUMNS_QUERY)
+        indexes = {}
+        for schema, table, columns in cursor.fetchall():
+            indexes.setdefault((schema, table), []).append(tuple(columns))
+        return indexes
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+# Размеры, оценка строк, индексы и статистика столбцов всех таблиц — одним запросом
+TABLE_STATS_QUERY = """
+SELECT n.nspname, c.relname, c.reltuples::bigint, pg_table_size(c.oid), pg_indexes_size(c.oid),
+       (SELECT coalesce(json_agg(json_build_object(
+                   'name', ic.relname, 'definition', pg_get_indexdef(i.indexrelid),
+                   'bytes', pg_relation_size(i.indexrelid), 'unique', i.indisunique) ORDER BY ic.relname), '[]')
+        FROM pg_index i JOIN pg_class ic ON ic.oid = i.indexrelid
+        WHERE i.indrelid = c.oid),
+       (SELECT coalesce(jsonb_object_agg(s.attname, jsonb_build_object(
+                   'null_frac', s.null_frac, 'n_distinct', s.n_distinct, 'correlation', s.correlation)), '{}')
+        FROM pg_stats s
+        WHERE s.schemaname = n.nspname AND s.tablename = c.relname)
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind IN ('r', 'p', 'm')
+  AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+  AND n.nspname NOT LIKE 'pg_toast%'
+"""
+
+
+def _column_stats(stats, rows):
+    """Статистика столбца; n_distinct < 0 — доля от числа строк, пересчитываем в абсолютное"""
+    distinct = stats["n_distinct"]
+    if distinct is not None and distinct < 0:
+        distinct = -distinct * rows if rows else None
+    column = {"null_frac": round(stats["null_frac"], 4), "distinct": round(distinct) if distinct else None}
+    # Доля строк, которую отбирает равенство по столбцу при равномерном распределении
+    column["eq_selectivity"] = round((1 - stats["null_frac"]) / distinct, 6) if distinct else None
+    if stats.get("correlation") is not None:
+        column["correlation"] = round(stats["correlation"], 3)
+    return column
+
+
+def table_stats(conn):
+    """Статистика всех таблиц: {"public.trip": {"rows", "table_bytes", "index_bytes",
+    "indexes": [{"name", "definition", "bytes", "unique"}], "columns": {столбец: {...}}}}.
+
+    rows — оценка планировщика (reltuples; None, если таблицу ни разу не анализировали).
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(TABLE_STATS_QUERY)
+        tables = {}
+        for schema, table, rows, table_bytes, index_bytes, indexes, columns in cursor.fetchall():
+            rows = rows if rows is not None and rows >= 0 else None
+            tables[f"{schema}.{table}"] = {
+                "rows": rows,
+                "table_bytes": table_bytes,
+                "index_bytes": index_bytes,
+                "indexes": indexes,
+                "columns": {name: _column_stats(stats, rows) for name, stats in columns.items()},
+            }
+        return tables
+    finally:
+        cursor.close()
+        conn.rollback()
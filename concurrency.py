@@ -0,0 +1,84 @@
+import queue
+import threading
+import collections
+from concurrent.futures import Future
+
+_DONE = object()
+
+
+def ordered_map(submit, items, window):
+    """Отдаёт пары (item, результат) в порядке входа, держа в работе не более window задач.
+
+    submit(item) должен возвращать concurrent.futures.Future (или FutureGroup). Вход читается лениво,
+    поэтому генератор годится для потоковой обработки без накопления всех результатов.
+    """
+    pending = collections.deque()
+    for item in items:
+        pending.append((item, submit(item)))
+        if len(pending) >= window:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+def completed_future(value):
+    """Future, уже завершённый значением value"""
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class FutureGroup:
+    """Несколько Future как одна задача: result() возвращает список их результатов по порядку"""
+
+    def __init__(self, futures):
+        self.futures = futures
+
+    def result(self):
+        return [future.result() for future in self.futures]
+
+
+def prefetch(items, size):
+    """Читает итератор в фоновом потоке через очередь на size элементов.
+
+    Так стадии конвейера работают одновременно: пока потребитель обрабатывает
+    элемент, производитель уже готовит следующие, но не более size вперёд.
+    Исключение производителя пробрасывается потребителю.
+    """
+    buffer = queue.Queue(size)
+    stopped = threading.Event()
+
+    def put(value):
+        # Не блокируемся навсегда, если потребитель бросил чтение
+        while not stopped.is_set():
+            try:
+                buffer.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((_DONE, None))
+        except BaseException as e:
+            put((_DONE, e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import re
+import math
+import time
+import uuid
+import random
+import argparse
+import datetime
+import graphlib
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import psycopg2
+from psycopg2 import sql
+
+from catalog import describe_tables
+from explainRunner import get_connection_params
+
+# Объёмы по умолчанию для схемы из init.sql (умножаются на --scale)
+DEFAULT_ROWS = {
+    "companies": 500,
+    "trip": 1_000_000,
+    "passengers": 2_000_000,
+    "pass_in_trip": 10_000_000,
+}
+# Строк в одном COPY: единица работы процесса и одна транзакция
+CHUNK_ROWS = 500_000
+# Строк в одном блоке, который отдаётся в COPY
+COPY_BLOCK_ROWS = 1000
+# Множитель для перестановки ключей: популярные значения разбросаны по таблице, а не идут подряд
+SCATTER_PRIME = 2654435761
+# Доля NULL в необязательных столбцах
+NULL_FRACTION = 0.02
+# Временные метки — за два года от фиксированной даты, чтобы данные воспроизводились по --seed
+TIME_START = datetime.datetime(2023, 1, 1)
+TIME_SPAN_SECONDS = 730 * 24 * 3600
+
+INTEGER_TYPES = ("smallint", "integer", "bigint")
+FLOAT_TYPES = ("real", "double precision")
+
+TOWNS = ("Москва", "Санкт-Петербург", "Париж", "Сочи", "Казань", "Новосибирск", "Екатеринбург", "Стамбул",
+         "Дубай", "Калининград", "Минск", "Ереван", "Тбилиси", "Алматы", "Владивосток", "Берлин", "Рим",
+         "Мадрид", "Лондон", "Пекин")
+PLANES = ("A320", "B737", "SSJ100", "A321", "B777", "A330", "E190", "MC-21")
+FIRST_NAMES = ("Александр", "Мария", "Дмитрий", "Анна", "Сергей", "Елена", "Иван", "Ольга", "Михаил",
+               "Наталья", "Андрей", "Татьяна", "Алексей", "Ирина", "Павел", "Светлана")
+LAST_NAMES = ("Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов",
+              "Новиков", "Фёдоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семёнов", "Егоров")
+NAME_WORDS = ("Aero", "Sky", "Nord", "Star", "Jet", "Air", "Sun", "Blue", "Polar", "Ural")
+
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+_TEXT_TYPE = re.compile(r'^(?:text|character varying|character)(?:\((\d+)\))?$')
+
+
+def skewed_index(rng, n, skew):
+    """Индекс 0..n-1: при skew=0 равномерно, с ростом skew малые индексы всё популярнее"""
+    return min(int(n * rng.random() ** (1 + skew)), n - 1)
+
+
+def _scatter(index, n):
+    """Взаимно однозначная перестановка индексов 0..n-1"""
+    if math.gcd(SCATTER_PRIME, n) != 1:
+        return index
+    return index * SCATTER_PRIME % n
+
+
+def _pick(rng, values, skew):
+    return values[skewed_index(rng, len(values), skew)]
+
+
+def key_pool(conn, schema, table, column):
+    """Ключи родительской таблицы: (первый, число, None) для плотного диапазона, иначе (None, число, ключи)"""
+    cursor = conn.cursor()
+    try:
+        target, key = sql.Identifier(schema, table), sql.Identifier(column)
+        cursor.execute(sql.SQL("SELECT min({key}), max({key}), count({key}) FROM {target}")
+                       .format(key=key, target=target))
+        low, high, count = cursor.fetchone()
+        if not count:
+            return None
+        if isinstance(low, int) and high - low + 1 == count:
+            return low, count, None
+        cursor.execute(sql.SQL("SELECT DISTINCT {key} FROM {target} WHERE {key} IS NOT NULL")
+                       .format(key=key, target=target))
+        keys = [row[0] for row in cursor]
+        return None, len(keys), array('q', keys) if isinstance(low, int) else keys
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+def _text_generator(name, unique, skew, start):
+    """Правдоподобные строки по имени столбца; уникальные столбцы получают номер строки"""
+    if "email" in name:
+        return lambda rng, index, row: f"user{start + index}@example.com"
+    if "phone" in name:
+        return lambda rng, index, row: f"+7{9000000000 + (start + index) % 1000000000}"
+    if unique:
+        return lambda rng, index, row: f"{name}-{start + index}"
+    if "full_name" in name:
+        return lambda rng, index, row: f"{_pick(rng, LAST_NAMES, skew)} {_pick(rng, FIRST_NAMES, skew)}"
+    if "town" in name or "city" in name:
+        return lambda rng, index, row: _pick(rng, TOWNS, skew)
+    if "plane" in name or "model" in name:
+        return lambda rng, index, row: _pick(rng, PLANES, skew)
+    if "place" in name or "seat" in name:
+        return lambda rng, index, row: f"{rng.randint(1, 40)}{rng.choice('ABCDEF')}"
+    if "name" in name:
+        return lambda rng, index, row: f"{_pick(rng, NAME_WORDS, skew)} {start + index}"
+    return lambda rng, index, row: f"{name}-{skewed_index(rng, 1000, skew)}"
+
+
+def _moment(rng, index, row):
+    """Случайный момент; если в строке уже есть метка времени — чуть позже неё (вылет → прилёт)"""
+    previous = next((value for value in reversed(row) if isinstance(value, datetime.datetime)), None)
+    if previous is not None:
+        return previous + datetime.timedelta(minutes=rng.randint(30, 720))
+    return TIME_START + datetime.timedelta(seconds=int(rng.random() * TIME_SPAN_SECONDS))
+
+
+def column_generator(column, info, pools, skew, start):
+    """Функция (rng, index, row) -> значение столбца; None — столбец заполняет сервер (serial, default)"""
+    name, type_name = column["name"], column["type"]
+    unique = name in info["unique"]
+    if column["identity"] or (column["default"] or "").startswith("nextval("):
+        # Ключи выдаёт последовательность — она остаётся согласованной с данными
+        return None
+
+    if name in info["foreign_keys"]:
+        pool = pools.get(name)
+        if pool is None:
+            if not column["not_null"]:
+                return lambda rng, index, row: None
+            raise ValueError(f"No parent keys for {name}: load the referenced table first")
+        first, count, keys = pool
+
+        def foreign_key(rng, index, row):
+            position = _scatter(skewed_index(rng, count, skew), count)
+            return keys[position] if keys is not None else first + position
+        return foreign_key
+
+    if type_name in INTEGER_TYPES:
+        generate = (lambda rng, index, row: start + index) if unique else \
+            (lambda rng, index, row: skewed_index(rng, 1000, skew))
+    elif type_name in FLOAT_TYPES or type_name.startswith("numeric"):
+        generate = lambda rng, index, row: round(rng.lognormvariate(3, 1), 2)
+    elif type_name == "boolean":
+        generate = lambda rng, index, row: rng.random() < 0.9
+    elif type_name.startswith("timestamp"):
+        generate = _moment
+    elif type_name == "date":
+        generate = lambda rng, index, row: _moment(rng, index, row).date()
+    elif type_name == "uuid":
+        generate = lambda rng, index, row: uuid.UUID(int=rng.getrandbits(128), version=4)
+    elif type_name in ("json", "jsonb"):
+        generate = lambda rng, index, row: "{}"
+    elif _TEXT_TYPE.match(type_name):
+        generate = _text_generator(name.lower(), unique, skew, start)
+        length = _TEXT_TYPE.match(type_name).group(1)
+        if length:
+            text, limit = generate, int(length)
+            generate = lambda rng, index, row: text(rng, index, row)[:limit]
+    elif column["default"] is not None or not column["not_null"]:
+        return None
+    else:
+        raise ValueError(f"Unsupported column type {type_name} for {name}")
+
+    if not column["not_null"] and not unique:
+        value = generate
+        generate = lambda rng, index, row: None if rng.random() < NULL_FRACTION else value(rng, index, row)
+    return generate
+
+
+def _copy_text(value):
+    """Значение в текстовом формате COPY"""
+    if value is None:
+        return "\\N"
+    if value is True:
+        return "t"
+    if value is False:
+        return "f"
+    if isinstance(value, str):
+        return value.translate(_COPY_ESCAPES)
+    return str(value)
+
+
+class CopyStream(io.RawIOBase):
+    """Файлоподобный поток для COPY FROM STDIN: строки формируются генератором по мере чтения"""
+
+    def __init__(self, rows):
+        self._blocks = self._encode(rows)
+        self._buffer = memoryview(b"")
+
+    @staticmethod
+    def _encode(rows):
+        lines = []
+        for row in rows:
+            lines.append("\t".join(map(_copy_text, row)))
+            if len(lines) >= COPY_BLOCK_ROWS:
+                yield ("\n".join(lines) + "\n").encode("utf-8")
+                lines = []
+        if lines:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer:
+            block = next(self._blocks, None)
+            if block is None:
+                return 0
+            self._buffer = memoryview(block)
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def generate_rows(generators, start, stop, seed):
+    """Строки [start, stop) таблицы; результат зависит только от seed и номеров строк"""
+    rng = random.Random(seed)
+    for index in range(start, stop):
+        row = []
+        for generate in generators:
+            row.append(generate(rng, index, row))
+        yield row
+
+
+def load_chunk(task):
+    """Загружает строки [start, stop) одной таблицы одним COPY в отдельном соединении"""
+    info = task["info"]
+    columns, generators = [], []
+    for column in info["columns"]:
+        generate = column_generator(column, info, task["pools"], task["skew"],
+                                    task["starts"].get(column["name"], 0))
+        if generate is not None:
+            columns.append(column["name"])
+            generators.append(generate)
+
+    seed = f"{task['seed']}:{task['table']}:{task['start']}"
+    rows = generate_rows(generators, task["start"], task["stop"], seed)
+    copy = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(task["schema"], task["table"]),
+        sql.SQL(", ").join(map(sql.Identifier, columns)))
+
+    conn = psycopg2.connect(**task["conn_params"])
+    try:
+        cursor = conn.cursor()
+        # Данные синтетические: ждать fsync на каждый коммит незачем
+        cursor.execute("SET synchronous_commit = off")
+        cursor.copy_expert(copy.as_string(conn), CopyStream(rows), size=65536)
+        conn.commit()
+    finally:
+        conn.close()
+    return task["table"], task["stop"] - task["start"]
+
+
+def _unique_starts(conn, schema, table, info):
+    """С какого значения нумеровать уникальные столбцы, чтобы не пересечься с уже загруженными строками"""
+    starts = {}
+    cursor = conn.cursor()
+    try:
+        target = sql.Identifier(schema, table)
+        for column in info["columns"]:
+            if column["name"] not in info["unique"]:
+                continue
+            if column["type"] in INTEGER_TYPES:
+                query = sql.SQL("SELECT coalesce(max({}), 0) + 1 FROM {}").format(
+                    sql.Identifier(column["name"]), target)
+            else:
+                query = sql.SQL("SELECT count(*) FROM {}").format(target)
+            cursor.execute(query)
+            starts[column["name"]] = cursor.fetchone()[0]
+        return starts
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+def table_levels(tables, targets, schema):
+    """Таблицы по уровням зависимостей: родители загружаются раньше детей, таблицы уровня — параллельно"""
+    sorter = graphlib.TopologicalSorter({
+        table: {ref_table for ref_schema, ref_table, _ in tables[table]["foreign_keys"].values()
+                if ref_schema == schema and ref_table in targets and ref_table != table}
+        for table in targets
+    })
+    sorter.prepare()
+    while sorter.is_active():
+        level = sorted(sorter.get_ready())
+        yield level
+        sorter.done(*level)
+
+
+def row_counts(targets, scale=1.0, overrides=None, default_rows=100000):
+    """Сколько строк генерировать в каждую таблицу"""
+    counts = {}
+    for table in targets:
+        if overrides and table in overrides:
+            counts[table] = overrides[table]
+        else:
+            counts[table] = max(1, int(DEFAULT_ROWS.get(table, default_rows) * scale))
+    return counts
+
+
+def generate_data(schema="public", targets=None, scale=1.0, overrides=None, default_rows=100000, skew=1.0,
+                  seed=42, workers=1, truncate=False, analyze=True):
+    """Заполняет таблицы схемы синтетическими данными через COPY и обновляет статистику.
+
+    Внешние ключи берутся из уже загруженных родительских таблиц (с перекосом skew),
+    большие таблицы делятся на части по CHUNK_ROWS строк, которые грузятся параллельно.
+    """
+    conn_params = get_connection_params()
+    if workers == 0:
+        workers = os.cpu_count() or 1
+
+    conn = psycopg2.connect(**conn_params)
+    started = time.monotonic()
+    total = 0
+    # spawn: дочерние процессы не наследуют открытое соединение
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) if workers > 1 else None
+    try:
+        tables = describe_tables(conn, schema)
+        targets = list(targets or tables)
+        unknown = [table for table in targets if table not in tables]
+        if unknown:
+            raise ValueError(f"Tables not found in schema {schema}: {', '.join(unknown)}")
+        counts = row_counts(targets, scale, overrides, default_rows)
+        print("Rows to generate: " + ", ".join(f"{table}={count}" for table, count in counts.items()))
+
+        if truncate:
+            with conn.cursor() as cursor:
+                cursor.execute(sql.SQL("TRUNCATE {} RESTART IDENTITY").format(
+                    sql.SQL(", ").join(sql.Identifier(schema, table) for table in targets)))
+            conn.commit()
+
+        for level in table_levels(tables, targets, schema):
+            level_started = time.monotonic()
+            tasks = []
+            for table in level:
+                info = tables[table]
+                pools = {name: key_pool(conn, *reference)
+                         for name, reference in info["foreign_keys"].items()
+                         if reference[:2] != (schema, table)}
+                starts = _unique_starts(conn, schema, table, info)
+                for start in range(0, counts[table], CHUNK_ROWS):
+                    tasks.append({
+                        "conn_params": conn_params, "schema": schema, "table": table, "info": info,
+                        "pools": pools, "starts": starts, "skew": skew, "seed": seed,
+                        "start": start, "stop": min(start + CHUNK_ROWS, counts[table]),
+                    })
+
+            loaded = dict.fromkeys(level, 0)
+            for table, count in (pool.map(load_chunk, tasks) if pool else map(load_chunk, tasks)):
+                loaded[table] += count
+            elapsed = time.monotonic() - level_started
+            for table in level:
+                print(f"Loaded {loaded[table]} rows into {schema}.{table}")
+            print(f"Level {', '.join(level)} done in {elapsed:.1f}s")
+            total += sum(loaded.values())
+
+        if analyze:
+            # VACUUM заодно заполняет карту видимости — без неё планы не выбирают Index Only Scan
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                for table in targets:
+                    cursor.execute(sql.SQL("VACUUM (ANALYZE) {}").format(sql.Identifier(schema, table)))
+            print(f"Vacuumed and analyzed {len(targets)} tables")
+    finally:
+        if pool:
+            pool.shutdown()
+        conn.close()
+
+    elapsed = time.monotonic() - started
+    print(f"Generated {total} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s)")
+    return total
+
+
+def _parse_rows(values):
+    overrides = {}
+    for value in values or []:
+        table, _, count = value.partition("=")
+        if not count.isdigit():
+            raise argparse.ArgumentTypeError(f"Expected TABLE=N, got {value}")
+        overrides[table] = int(count)
+    return overrides
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Синтетические данные для схемы БД: COPY из генераторов и ANALYZE')
+    parser.add_argument('--schema', default='public', help='Схема, таблицы которой заполняются')
+    parser.add_argument('--tables', default=None, help='Через запятую: только эти таблицы (по умолчанию все)')
+    parser.add_argument('--rows', action='append', metavar='TABLE=N', help='Число строк таблицы (можно повторять)')
+    parser.add_argument('--scale', type=float, default=1.0, help='Множитель объёмов по умолчанию')
+    parser.add_argument('--default-rows', type=int, default=100000,
+                        help='Строк в таблицах, для которых нет объёма по умолчанию')
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help='Перекос распределений: 0 — равномерно, больше — сильнее популярные значения')
+    parser.add_argument('--seed', type=int, default=42, help='Зерно генератора: одинаковое — одинаковые данные')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='Параллельных COPY (0 — по числу ядер)')
+    parser.add_argument('--truncate', action='store_true', help='Очистить таблицы перед загрузкой')
+    parser.add_argument('--no-analyze', action='store_true', help='Не выполнять VACUUM ANALYZE после загрузки')
+    args = parser.parse_args()
+
+    generate_data(args.schema, args.tables.split(',') if args.tables else None, args.scale,
+                  _parse_rows(args.rows), args.default_rows, args.skew, args.seed, args.workers,
+                  args.truncate, not args.no_analyze)
@@ -1,73 +1,519 @@
+import re
 import json
+import argparse
+import time
+import threading
+import collections
 import psycopg2
+import psycopg2.errors
 from psycopg2 import sql
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+from artifacts import read_records, write_records
+from concurrency import ordered_map, completed_future
+from plan_model import Plan
+from fingerprint import fingerprint, has_parameters
+from catalog import schema_version, table_stats
+from kv_cache import KeyValueCache
+from stats import summarize
+from instrumentation import metrics
+
 load_dotenv()
 
-def run_explain_analyze():
+_WRITE_KEYWORDS = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE)\b', re.IGNORECASE)
+_WORD = re.compile(r'\w+')
+
+ANALYZE_OPTIONS = "ANALYZE, VERBOSE, COSTS, BUFFERS, FORMAT JSON"
+PLAN_ONLY_OPTIONS = "COSTS, VERBOSE, FORMAT JSON"
+# Для запросов с параметрами $n (тексты из pg_stat_statements): общий план без выполнения, PG 16+
+GENERIC_PLAN_OPTIONS = "GENERIC_PLAN, COSTS, VERBOSE, FORMAT JSON"
+GENERIC_PLAN_UNAVAILABLE = "query has $n parameters: EXPLAIN (GENERIC_PLAN) requires PostgreSQL 16+"
+# Лимит на EXPLAIN без ANALYZE, когда общий бюджет уже исчерпан: планирование не должно висеть
+PLAN_ONLY_TIMEOUT_MS = 10000
+# Запас на случай, если statement_timeout не сработал (например, завис сетевой обмен)
+CANCEL_GRACE_SECONDS = 5
+# Сколько последних отпечатков помним для дедупликации, чтобы память не росла с числом запросов
+DEDUPE_WINDOW = 10000
+
+
+def get_connection_params():
     # Проверка обязательных переменных
     required_vars = ['DB_NAME', 'DB_USER', 'DB_PASSWORD']
     for var in required_vars:
         if not os.getenv(var):
             raise ValueError(f"Missing required environment variable: {var}")
-    
-    # Подключение к тестовой БД
-    conn = psycopg2.connect(
-        host=os.getenv("DB_HOST", "db"),
-        port=os.getenv("DB_PORT", "5432"),
-        dbname=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD")
-    )
-    conn.autocommit = False
-    cursor = conn.cursor()
-
-    # Загружаем запросы
-    with open('parsed_queries.json', 'r') as f:
-        queries = json.load(f)
-
-    results = []
-    for query_obj in queries:
+
+    return {
+        "host": os.getenv("DB_HOST", "db"),
+        "port": os.getenv("DB_PORT", "5432"),
+        "dbname": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD")
+    }
+
+
+def is_read_only(query_obj):
+    """Запрос только читает данные и может выполняться параллельно с другими"""
+    if query_obj["type"] == "SELECT":
+        return True
+    # WITH может содержать data-modifying CTE
+    return query_obj["type"] == "WITH" and not _WRITE_KEYWORDS.search(query_obj["query"])
+
+
+class ExplainRunner:
+    """Выполняет EXPLAIN ANALYZE на пуле соединений, по одному соединению на поток.
+
+    Каждый запрос выполняется в своей транзакции, которая всегда откатывается.
+    При serialize_writes DML/DDL идут в отдельную очередь с одним соединением,
+    чтобы не блокировать и не искажать планы друг друга.
+
+    query_timeout_ms ограничивает каждый запрос, total_budget_s — весь прогон.
+    Запрос, не уложившийся в лимит, переснимается EXPLAIN без ANALYZE
+    и помечается как estimated_only.
+
+    При dedupe запросы с одинаковым отпечатком выполняются один раз,
+    а результат представителя раздаётся всем копиям.
+
+    plan_cache (KeyValueCache) хранит планы по отпечатку и версии схемы/статистики:
+    неизменные запросы к неизменной схеме в БД не отправляются.
+    refresh_plans заставляет переснять планы и обновить кэш.
+
+    Режим замеров: repeat прогонов после warmup прогревочных; при cold самый первый
+    прогон (до прогрева кэшей) учитывается отдельно. Время в результате — медиана.
+
+    Запросы с параметрами $n (из pg_stat_statements, см. workload.py) не выполняются:
+    для них снимается общий план EXPLAIN (GENERIC_PLAN), результат помечается generic_plan.
+    До PostgreSQL 16 такой план не построить: результат без плана помечается skipped с причиной.
+
+    К результату добавляются таблицы плана ("tables") и их статистика из каталога
+    ("table_stats"): она снимается одним запросом на прогон и кэшируется по версии схемы.
+    """
+
+    def __init__(self, workers=1, serialize_writes=False, query_timeout_ms=None, total_budget_s=None,
+                 dedupe=True, plan_cache=None, refresh_plans=False, repeat=1, warmup=0, cold=False):
+        self.conn_params = get_connection_params()
+        self.workers = max(1, workers)
+        self.dedupe = dedupe
+        self.saved_calls = 0
+        self.plan_cache = plan_cache
+        self.refresh_plans = refresh_plans
+        self.schema_version = None
+        self.query_timeout_ms = query_timeout_ms
+        self.total_budget_s = total_budget_s
+        self._deadline = None
+        self.repeat = max(1, repeat)
+        self.warmup = max(0, warmup)
+        self.cold = cold
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._table_stats = None
+        self._table_stats_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='explain')
+        self._write_lane = ThreadPoolExecutor(1, thread_name_prefix='explain-write') if serialize_writes else None
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Подключение к тестовой БД
+            with metrics.span("explain.connect"):
+                conn = psycopg2.connect(**self.conn_params)
+            conn.autocommit = False
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _catalog_stats(self):
+        """Статистика всех таблиц БД: снимается при первом обращении, с версией схемы — из кэша"""
+        with self._table_stats_lock:
+            if self._table_stats is None:
+                key = None
+                if self.plan_cache is not None and self.schema_version is not None:
+                    key = f"catalog:{self.schema_version}"
+                stats = self.plan_cache.get(key) if key and not self.refresh_plans else None
+                if stats is None:
+                    conn = self._connection()
+                    # Откат снимает statement_timeout транзакции только что выполненного запроса
+                    conn.rollback()
+                    try:
+                        with metrics.span("explain.catalog"):
+                            stats = table_stats(conn)
+                    except psycopg2.Error as e:
+                        print(f"Could not read table statistics: {e}")
+                        stats = {}
+                    if key and stats:
+                        self.plan_cache.put(key, stats)
+                self._table_stats = stats
+            return self._table_stats
+
+    def _relation_stats(self, tables, query):
+        """Статистика таблиц запроса; по столбцам — только упомянутым в тексте запроса"""
+        catalog = self._catalog_stats()
+        words = set(_WORD.findall(query.lower()))
+        stats = {}
+        for name in tables:
+            info = catalog.get(name)
+            if info is not None:
+                stats[name] = dict(info, columns={column: values for column, values in info["columns"].items()
+                                                  if column.lower() in words})
+        return stats
+
+    def _time_budget_ms(self):
+        """Лимит для очередного запроса: None — без лимита, 0 — общий бюджет исчерпан"""
+        budget = self.query_timeout_ms
+        if self._deadline is not None:
+            remaining_ms = max(0, int((self._deadline - time.monotonic()) * 1000))
+            budget = remaining_ms if budget is None else min(budget, remaining_ms)
+        return budget
+
+    def _explain_plan(self, conn, cursor, query, options, timeout_ms):
+        """Выполняет EXPLAIN с серверным statement_timeout и клиентской отменой про запас"""
+        watchdog = None
+        if timeout_ms:
+            cursor.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms),))
+            watchdog = threading.Timer(timeout_ms / 1000 + CANCEL_GRACE_SECONDS, conn.cancel)
+            watchdog.daemon = True
+            watchdog.start()
+        try:
+            # Круговой путь до БД: выполнение EXPLAIN и передача плана
+            with metrics.span("explain.db", analyze=options.startswith("ANALYZE")):
+                cursor.execute(sql.SQL("EXPLAIN ({}) {}").format(sql.SQL(options), sql.SQL(query)))
+                raw_plan = cursor.fetchone()[0]
+        finally:
+            if watchdog:
+                watchdog.cancel()
+        if isinstance(raw_plan, str):
+            raw_plan = json.loads(raw_plan)
+        return raw_plan
+
+    @property
+    def benchmarking(self):
+        return self.repeat > 1 or self.warmup > 0 or self.cold
+
+    def _benchmark(self, conn, cursor, query, first_plan):
+        """Повторяет EXPLAIN ANALYZE и сводит прогоны: (план медианного прогона, статистика)"""
+        runs = [first_plan]
+        total = int(self.cold) + self.warmup + self.repeat
+        while len(runs) < total:
+            timeout_ms = self._time_budget_ms()
+            if timeout_ms == 0:
+                break
+            conn.rollback()
+            try:
+                runs.append(self._explain_plan(conn, cursor, query, ANALYZE_OPTIONS, timeout_ms))
+            except psycopg2.errors.QueryCanceled:
+                # Повтор не уложился в лимит — обходимся уже сделанными замерами
+                conn.rollback()
+                break
+
+        cold = Plan.from_explain(runs[0]) if self.cold and len(runs) > 1 else None
+        measured = runs[max(int(cold is not None), len(runs) - self.repeat):]
+        plans = [Plan.from_explain(raw) for raw in measured]
+        execution = summarize(plan.execution_time for plan in plans)
+
+        def hit_ratio(plan):
+            buffers = plan.buffers()
+            touched = buffers["shared_hit"] + buffers["shared_read"]
+            return buffers["shared_hit"] / touched if touched else None
+
+        stats = {
+            "runs": len(plans),
+            "warmup": len(runs) - len(plans) - int(cold is not None),
+            "execution_ms": execution,
+            "planning_ms": summarize(plan.planning_time for plan in plans),
+            "shared_hit_ratio": summarize(hit_ratio(plan) for plan in plans),
+            "shared_read": summarize(plan.buffers()["shared_read"] for plan in plans),
+        }
+        if cold is not None:
+            stats["cold"] = {
+                "execution_ms": cold.execution_time,
+                "planning_ms": cold.planning_time,
+                "shared_hit_ratio": hit_ratio(cold),
+                "shared_read": cold.buffers()["shared_read"],
+            }
+
+        # Показываем план прогона, ближайшего к медиане, чтобы числа в нём не расходились со статистикой
+        if execution:
+            index = min(range(len(plans)), key=lambda i: abs((plans[i].execution_time or 0) - execution["p50"]))
+        else:
+            index = len(plans) - 1
+        return measured[index], stats
+
+    def explain(self, query_obj):
+        with metrics.span("explain.query", type=query_obj["type"]) as span:
+            result = self._explain_query(query_obj)
+            span["estimated_only"] = result["estimated_only"]
+        metrics.count("explain.errors" if result["error"] else "explain.queries")
+        if result.get("skipped"):
+            metrics.count("explain.skipped")
+        elif result.get("generic_plan"):
+            metrics.count("explain.generic_plans")
+        elif result["estimated_only"]:
+            metrics.count("explain.estimated_only")
+        return result
+
+    @staticmethod
+    def _skipped_result(query_obj, reason):
+        """Результат без плана для запроса, который на этом сервере не объяснить: не ошибка, а пропуск"""
+        return {
+            "query": query_obj["query"],
+            "type": query_obj["type"],
+            "tables": [],
+            "explain_output": [],
+            "plan": None,
+            "execution_time_ms": None,
+            "planning_time_ms": None,
+            "estimated_only": True,
+            "time_budget_ms": None,
+            "file_path": query_obj["file_path"],
+            "error": None,
+            "skipped": reason,
+        }
+
+    def _explain_query(self, query_obj):
         query = query_obj["query"]
+        conn = self._connection()
+        cursor = conn.cursor()
+        timeout_ms = self._time_budget_ms()
+        estimated_only = generic_plan = False
         try:
-            cursor.execute("BEGIN;")  # Начинаем транзакцию
-            explain_query = sql.SQL("EXPLAIN (ANALYZE, VERBOSE, COSTS, BUFFERS) {}").format(
-                sql.SQL(query)
-            )
-            cursor.execute(explain_query)
-            explain_result = "\n".join([str(row) for row in cursor.fetchall()])
-
-            results.append({
+            if has_parameters(query):
+                # Вместо констант $n — выполнить нельзя, можно только построить общий план
+                if conn.server_version < 160000:
+                    # Запрос не ошибочный: план просто не построить на этом сервере
+                    print(f"Skipping query, {GENERIC_PLAN_UNAVAILABLE}: {query}")
+                    return self._skipped_result(query_obj, GENERIC_PLAN_UNAVAILABLE)
+                raw_plan = self._explain_plan(conn, cursor, query, GENERIC_PLAN_OPTIONS,
+                                              self.query_timeout_ms or PLAN_ONLY_TIMEOUT_MS)
+                estimated_only = generic_plan = True
+            elif timeout_ms == 0:
+                print(f"Time budget exhausted, running plan-only EXPLAIN: {query}")
+                raw_plan = self._explain_plan(conn, cursor, query, PLAN_ONLY_OPTIONS, PLAN_ONLY_TIMEOUT_MS)
+                estimated_only = True
+            else:
+                try:
+                    raw_plan = self._explain_plan(conn, cursor, query, ANALYZE_OPTIONS, timeout_ms)
+                except psycopg2.errors.QueryCanceled:
+                    conn.rollback()
+                    metrics.count("explain.timeouts")
+                    print(f"Query exceeded {timeout_ms}ms, falling back to plan-only EXPLAIN: {query}")
+                    raw_plan = self._explain_plan(conn, cursor, query, PLAN_ONLY_OPTIONS,
+                                                  self.query_timeout_ms or PLAN_ONLY_TIMEOUT_MS)
+                    estimated_only = True
+            benchmark = None
+            if self.benchmarking and not estimated_only:
+                raw_plan, benchmark = self._benchmark(conn, cursor, query, raw_plan)
+            plan = Plan.from_explain(raw_plan)
+            tables = plan.relations()
+
+            result = {
                 "query": query,
                 "type": query_obj["type"],
-                "tables": [],  # Пустой список, так как мы не извлекаем таблицы
-                "explain_output": explain_result.split('\n'),  # Преобразуем в список строк
+                "tables": tables,
+                "table_stats": self._relation_stats(tables, query),
+                "explain_output": plan.text_lines(),
+                "plan": raw_plan,
+                "execution_time_ms": plan.execution_time,
+                "planning_time_ms": plan.planning_time,
+                "estimated_only": estimated_only,
+                "time_budget_ms": None if generic_plan else timeout_ms,
                 "file_path": query_obj["file_path"],
                 "error": None
-            })
-            cursor.execute("ROLLBACK;")  # Откатываем изменения
+            }
+            if generic_plan:
+                result["generic_plan"] = True
+            if benchmark:
+                result["benchmark"] = benchmark
+                result["execution_time_ms"] = benchmark["execution_ms"]["p50"] if benchmark["execution_ms"] else None
+                result["planning_time_ms"] = benchmark["planning_ms"]["p50"] if benchmark["planning_ms"] else None
+            return result
         except Exception as e:
-            cursor.execute("ROLLBACK;")
             print(f"Error analyzing query: {query}\n{str(e)}")
-            results.append({
+            return {
                 "query": query,
                 "type": query_obj["type"],
                 "tables": [],
                 "explain_output": [],
+                "plan": None,
+                "execution_time_ms": None,
+                "planning_time_ms": None,
+                "estimated_only": False,
+                "time_budget_ms": timeout_ms,
                 "file_path": query_obj["file_path"],
                 "error": str(e)
-            })
+            }
+        finally:
+            conn.rollback()  # Откатываем изменения
+            cursor.close()
+
+    def submit(self, query_obj):
+        if self._write_lane and not is_read_only(query_obj):
+            return self._write_lane.submit(self.explain, query_obj)
+        return self._pool.submit(self.explain, query_obj)
+
+    def _cache_key(self, fp):
+        key = f"{fp}:{self.schema_version}:{ANALYZE_OPTIONS}"
+        if self.benchmarking:
+            key += f":bench {int(self.cold)}/{self.warmup}/{self.repeat}"
+        return key
+
+    def _store_plan(self, key, future):
+        result = future.result()
+        # Ошибки и оценочные планы после таймаута не кэшируем — они могут быть случайными
+        if result["error"] is None and not result["estimated_only"]:
+            self.plan_cache.put(key, {k: v for k, v in result.items()
+                                      if k not in ("query", "type", "file_path")})
 
-    conn.close()
+    def submit_cached(self, query_obj, fp):
+        """Берёт план из кэша или отправляет запрос в пул, сохраняя результат в кэш"""
+        if self.plan_cache is None:
+            return self.submit(query_obj)
 
-    # Сохраняем результаты
-    with open('explain_results.json', 'w') as f:
-        json.dump(results, f, indent=2)
+        key = self._cache_key(fp)
+        cached = None if self.refresh_plans else self.plan_cache.get(key)
+        if cached is not None:
+            metrics.count("explain.plan_cache_hits")
+            return completed_future(dict(cached, query=query_obj["query"], type=query_obj["type"],
+                                         file_path=query_obj["file_path"], plan_cached=True))
 
-    print(f"Analyzed {len(results)} queries. Results saved to explain_results.json")
+        metrics.count("explain.plan_cache_misses")
+        future = self.submit(query_obj)
+        future.add_done_callback(lambda f: self._store_plan(key, f))
+        return future
+
+    def run(self, queries, stored=None, on_result=None):
+        """Отдаёт результаты в порядке входных запросов.
+
+        stored(query_obj) может вернуть результат, сохранённый прошлым запуском (--resume):
+        он отдаётся как есть, без EXPLAIN. on_result(record) вызывается сразу по готовности
+        результата, не дожидаясь очереди на выдачу, — чтобы сохранить его до возможного падения.
+        """
+        if self.total_budget_s is not None and self._deadline is None:
+            self._deadline = time.monotonic() + self.total_budget_s
+        if self.plan_cache is not None and self.schema_version is None:
+            self.schema_version = schema_version(self._connection())
+
+        futures = collections.OrderedDict()
+        # id() представителей: объекты живут в окне ordered_map до выдачи результата
+        representatives = set()
+        restored = set()
+
+        def submit(query_obj):
+            previous = stored(query_obj) if stored else None
+            if previous is not None:
+                metrics.count("explain.restored")
+                restored.add(id(query_obj))
+                return completed_future(previous)
+            fp = query_obj.get("fingerprint") or fingerprint(query_obj["query"])
+            if self.dedupe and fp in futures:
+                self.saved_calls += 1
+                metrics.count("explain.deduplicated")
+                futures.move_to_end(fp)
+                future = futures[fp]
+            else:
+                future = self.submit_cached(query_obj, fp)
+                representatives.add(id(query_obj))
+                if self.dedupe:
+                    futures[fp] = future
+                    if len(futures) > DEDUPE_WINDOW:
+                        futures.popitem(last=False)
+            if on_result:
+                reused = id(query_obj) not in representatives
+                future.add_done_callback(
+                    lambda f: on_result(self._result_record(query_obj, f.result(), fp, reused)))
+            return future
+
+        for query_obj, result in ordered_map(submit, queries, self.workers * 4):
+            if id(query_obj) in restored:
+                restored.discard(id(query_obj))
+                yield result
+                continue
+            fp = query_obj.get("fingerprint") or fingerprint(query_obj["query"])
+            reused = id(query_obj) not in representatives
+            representatives.discard(id(query_obj))
+            yield self._result_record(query_obj, result, fp, reused)
+
+    @staticmethod
+    def _result_record(query_obj, result, fp, reused):
+        """Результат представителя раздаём копии с её собственным текстом и путём"""
+        record = dict(result, query=query_obj["query"], type=query_obj["type"],
+                      file_path=query_obj["file_path"], fingerprint=fp, reused_result=reused,
+                      plan_cached=result.get("plan_cached", False))
+        if "query_id" in query_obj:
+            record["query_id"] = query_obj["query_id"]
+        if "workload" in query_obj:
+            record["workload"] = query_obj["workload"]
+        return record
+
+    def close(self):
+        self._pool.shutdown()
+        if self._write_lane:
+            self._write_lane.shutdown()
+        for conn in self._connections:
+            conn.close()
+
+
+def run_explain_analyze(input_path='parsed_queries.json', output_path='explain_results.json',
+                        workers=1, serialize_writes=False, query_timeout_ms=None, total_budget_s=None,
+                        dedupe=True, plan_cache=None, refresh_plans=False, repeat=1, warmup=0, cold=False):
+    runner = ExplainRunner(workers, serialize_writes, query_timeout_ms, total_budget_s, dedupe,
+                           plan_cache, refresh_plans, repeat, warmup, cold)
+    try:
+        # Загружаем запросы и сохраняем результаты потоково
+        count = write_records(runner.run(read_records(input_path)), output_path)
+    finally:
+        runner.close()
+
+    print(f"Analyzed {count} queries. Results saved to {output_path}")
+    if dedupe:
+        print(f"Deduplicated by fingerprint: {runner.saved_calls} EXPLAIN calls saved")
+    if plan_cache:
+        stats = plan_cache.stats()
+        print(f"Plan cache (schema {runner.schema_version}): {stats['hits']} hits, "
+              f"{stats['misses']} misses, {stats['evicted']} evicted")
 
 
 if __name__ == "__main__":
-    run_explain_analyze()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='EXPLAIN ANALYZE для разобранных запросов')
+    parser.add_argument('--input', default='parsed_queries.json', help='Файл с запросами (.json или .jsonl)')
+    parser.add_argument('--output', default='explain_results.json', help='Файл результатов (.json или .jsonl)')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='Число параллельных соединений с БД')
+    parser.add_argument('--serialize-writes', action='store_true',
+                        help='Выполнять DML/DDL последовательно в отдельном соединении')
+    parser.add_argument('--query-timeout', type=int, default=None,
+                        help='Лимит на один EXPLAIN ANALYZE, мс (затем — план без ANALYZE)')
+    parser.add_argument('--total-budget', type=float, default=None,
+                        help='Общий бюджет времени на все запросы, с')
+    parser.add_argument('--no-dedupe', action='store_true',
+                        help='Выполнять EXPLAIN для каждой копии запроса, а не одного представителя')
+    parser.add_argument('--plan-cache', default='.plan_cache.db',
+                        help='Кэш планов по отпечатку и версии схемы (SQLite)')
+    parser.add_argument('--no-plan-cache', action='store_true', help='Не использовать кэш планов')
+    parser.add_argument('--refresh-plans', action='store_true', help='Переснять все планы и обновить кэш')
+    parser.add_argument('--plan-cache-ttl', type=float, default=7 * 24,
+                        help='Время жизни записи в кэше планов, ч')
+    parser.add_argument('--plan-cache-size', type=int, default=50000,
+                        help='Максимум записей в кэше планов (вытесняются давно неиспользуемые)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Режим замеров: прогонов EXPLAIN ANALYZE на запрос (в результате — p50/p95)')
+    parser.add_argument('--warmup', type=int, default=0, help='Прогревочных прогонов перед замерами')
+    parser.add_argument('--cold', action='store_true',
+                        help='Учитывать самый первый прогон (до прогрева) отдельно как холодный')
+    parser.add_argument('--trace', default=None, help='JSON-трасса спанов стадии')
+    parser.add_argument('--metrics', default=None, help='Textfile Prometheus с метриками стадии')
+    args = parser.parse_args()
+
+    plan_cache = None
+    if not args.no_plan_cache:
+        plan_cache = KeyValueCache(args.plan_cache, args.plan_cache_size, args.plan_cache_ttl * 3600)
+    try:
+        run_explain_analyze(args.input, args.output, args.workers, args.serialize_writes,
+                            args.query_timeout, args.total_budget, not args.no_dedupe,
+                            plan_cache, args.refresh_plans, args.repeat, args.warmup, args.cold)
+    finally:
+        if plan_cache:
+            plan_cache.close()
+    metrics.export(args.trace, args.metrics)
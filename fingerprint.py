@@ -0,0 +1,53 @@
+import re
+import hashlib
+
+_TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>[eE]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*')
+  | (?P<dollar>\$(?P<tag>[A-Za-z_][A-Za-z0-9_]*|)\$.*?\$(?P=tag)\$)
+  | (?P<ident>"(?:[^"]|"")*")
+  | (?P<param>\$\d+)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<op>::|<=|>=|<>|!=|\|\||.)
+""", re.VERBOSE | re.DOTALL)
+
+# Список из одних плейсхолдеров после IN или ARRAY: IN (1, 2, 3), ARRAY[1, 2].
+# Аргументы функций (generate_series(?, ?), round(?, ?)) не трогаем — это разные запросы
+_PLACEHOLDER_LIST = re.compile(r'\b(in|array) ([(\[]) \?(?: , \?)* ([)\]])')
+# VALUES (...), (...) из одних плейсхолдеров — та же форма, что и с одной строкой
+_VALUES_TUPLES = re.compile(r'\bvalues \( \?(?: , \?)* \)(?: , \( \?(?: , \?)* \))*')
+
+
+def normalize_query(query):
+    """Нормализует запрос: литералы -> ?, списки литералов схлопываются, пробелы и регистр канонизируются"""
+    tokens = []
+    for m in _TOKEN.finditer(query):
+        kind = m.lastgroup
+        if kind in ('space', 'comment'):
+            continue
+        if kind in ('string', 'dollar', 'number', 'param'):
+            tokens.append('?')
+        elif kind == 'word':
+            tokens.append(m.group().lower())
+        else:
+            tokens.append(m.group())
+
+    while tokens and tokens[-1] == ';':
+        tokens.pop()
+
+    normalized = ' '.join(tokens)
+    normalized = _PLACEHOLDER_LIST.sub(r'\1 \2 ?... \3', normalized)
+    normalized = _VALUES_TUPLES.sub('values ( ?... )', normalized)
+    return normalized
+
+
+def has_parameters(query):
+    """Есть ли в запросе параметры $n; $n в строках, идентификаторах, комментариях и $$-телах не в счёт"""
+    return any(m.lastgroup == 'param' for m in _TOKEN.finditer(query))
+
+
+def fingerprint(query):
+    """Стабильный отпечаток формы запроса: одинаков для копий с разными литералами"""
+    return hashlib.sha1(normalize_query(query).encode('utf-8')).hexdigest()[:16]
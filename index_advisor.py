@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+
+import re
+import json
+import argparse
+import collections
+
+import psycopg2
+from psycopg2 import sql
+
+from artifacts import read_records
+from catalog import index_columns
+from explainRunner import get_connection_params
+from fingerprint import fingerprint
+from plan_model import Plan, format_ms
+
+# Типы запросов, планы которых имеет смысл переснимать с новым индексом (MERGE — PostgreSQL 15+)
+ADVISABLE_TYPES = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "MERGE")
+# Узлы, условия которых говорят о нужных индексах
+_JOIN_CONDITIONS = ("Hash Cond", "Merge Cond", "Join Filter")
+MAX_INDEX_COLUMNS = 3
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_COLUMN_REF = re.compile(r'(?:"([^"]+)"|\b([A-Za-z_][\w$]*))\.(?:"([^"]+)"|([A-Za-z_][\w$]*)\b)')
+# Оператор после ссылки на столбец: пропускаем закрывающие скобки и приведения типов вида ::text
+_OPERATOR = re.compile(r'\)*(?:::[\w ]+(?:\[\])?\)*)*\s*(=|<=|>=|<>|!=|<|>|IS\b)')
+
+
+def column_refs(expression):
+    """Ссылки на столбцы в условии плана: [(алиас, столбец, "eq" | "range" | None)]"""
+    expression = _STRING_LITERAL.sub("''", expression)
+    refs = []
+    for match in _COLUMN_REF.finditer(expression):
+        alias = match.group(1) or match.group(2)
+        column = match.group(3) or match.group(4)
+        operator = _OPERATOR.match(expression, match.end())
+        kind = None
+        if operator:
+            kind = "eq" if operator.group(1) in ("=", "IS") else \
+                "range" if operator.group(1) in ("<", ">", "<=", ">=") else None
+        refs.append((alias, column, kind))
+    return refs
+
+
+def scanned_relations(plan):
+    """Алиасы таблиц плана: {алиас: (схема, таблица)}"""
+    aliases = {}
+    for _, node in plan.iter_nodes():
+        if node.relation:
+            aliases[node.alias or node.relation] = (node.schema or "public", node.relation)
+    return aliases
+
+
+def plan_candidates(plan):
+    """Индексы-кандидаты по условиям плана: {(схема, таблица, столбцы): вес}.
+
+    Фильтры сканирований дают составной индекс: сначала столбцы равенства, затем
+    один столбец диапазона; условия соединений — индекс по столбцу соединения,
+    Sort Key одной таблицы — индекс в порядке сортировки. Вес — стоимость узла,
+    в котором найдено условие: чем дороже узел, тем раньше кандидат проверяется.
+    """
+    aliases = scanned_relations(plan)
+    candidates = collections.Counter()
+
+    def add(alias, columns, weight):
+        if alias in aliases and columns:
+            schema, table = aliases[alias]
+            candidates[(schema, table, tuple(columns[:MAX_INDEX_COLUMNS]))] += weight
+
+    for _, node in plan.iter_nodes():
+        weight = node.total_cost or 0
+        if node.relation and "Filter" in node.details:
+            alias = node.alias or node.relation
+            refs = [(column, kind) for ref_alias, column, kind in column_refs(node.details["Filter"])
+                    if ref_alias == alias and kind]
+            equal = sorted({column for column, kind in refs if kind == "eq"})
+            ranges = [column for column, kind in refs if kind == "range" and column not in equal]
+            add(alias, equal + ranges[:1], weight)
+            for column in equal[1:] + ranges[:1]:
+                add(alias, [column], weight)
+        for key in _JOIN_CONDITIONS:
+            if key in node.details:
+                for alias, column, _ in column_refs(node.details[key]):
+                    add(alias, [column], weight)
+        if "Sort Key" in node.details:
+            refs = [column_refs(key) for key in node.details["Sort Key"]]
+            if refs and all(len(ref) == 1 for ref in refs) and len({ref[0][0] for ref in refs}) == 1:
+                add(refs[0][0][0], [ref[0][1] for ref in refs], weight)
+    return candidates
+
+
+def _covered(columns, existing):
+    """Кандидат не нужен, если существующий индекс начинается с тех же столбцов"""
+    return any(index[:len(columns)] == columns for index in existing)
+
+
+class IndexAdvisor:
+    """Проверяет индексы-кандидаты в транзакциях, которые откатываются.
+
+    Для каждого кандидата индекс действительно создаётся, планы затронутых запросов
+    переснимаются (с ANALYZE — и время), после чего транзакция откатывается:
+    в базе ничего не остаётся. CREATE INDEX на время проверки блокирует запись
+    в таблицу, поэтому запускать стоит на тестовой БД.
+    """
+
+    def __init__(self, analyze=True, query_timeout_ms=30000, index_timeout_ms=600000):
+        self.analyze = analyze
+        self.options = "ANALYZE, COSTS, FORMAT JSON" if analyze else "COSTS, FORMAT JSON"
+        self.query_timeout_ms = query_timeout_ms
+        self.index_timeout_ms = index_timeout_ms
+        self.conn = psycopg2.connect(**get_connection_params())
+        self.conn.autocommit = False
+
+    def definition(self, candidate):
+        schema, table, columns = candidate
+        return sql.SQL("CREATE INDEX ON {} ({})").format(
+            sql.Identifier(schema, table), sql.SQL(", ").join(map(sql.Identifier, columns)))
+
+    def _set_timeout(self, cursor, timeout_ms):
+        cursor.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms or 0),))
+
+    def _explain(self, cursor, query):
+        """(стоимость, время мс) плана запроса; изменения DML откатываются до точки сохранения"""
+        cursor.execute("SAVEPOINT advisor_query")
+        try:
+            self._set_timeout(cursor, self.query_timeout_ms)
+            cursor.execute(sql.SQL("EXPLAIN ({}) {}").format(sql.SQL(self.options), sql.SQL(query)))
+            raw_plan = cursor.fetchone()[0]
+            plan = Plan.from_explain(raw_plan)
+            return plan.root.total_cost, plan.total_time
+        except psycopg2.Error:
+            return None
+        finally:
+            cursor.execute("ROLLBACK TO SAVEPOINT advisor_query")
+
+    def measure(self, queries, candidates=()):
+        """Планы запросов с временно созданными индексами: ({отпечаток: (стоимость, время)}, размер индексов)"""
+        cursor = self.conn.cursor()
+        try:
+            size = 0
+            for number, candidate in enumerate(candidates):
+                name = f"advisor_candidate_{number}"
+                self._set_timeout(cursor, self.index_timeout_ms)
+                schema, table, columns = candidate
+                cursor.execute(sql.SQL("CREATE INDEX {} ON {} ({})").format(
+                    sql.Identifier(name), sql.Identifier(schema, table),
+                    sql.SQL(", ").join(map(sql.Identifier, columns))))
+                cursor.execute("SELECT pg_relation_size(%s::regclass)",
+                               (sql.Identifier(schema, name).as_string(self.conn),))
+                size += cursor.fetchone()[0]
+            return {fp: self._explain(cursor, query) for fp, query in queries.items()}, size
+        finally:
+            cursor.close()
+            self.conn.rollback()
+
+    def advise(self, records, max_candidates=30, max_indexes=5, min_gain=0.1):
+        """Замеры по каждому кандидату и лучший набор индексов для всего набора запросов"""
+        queries, relations, weights, sources = {}, collections.defaultdict(set), collections.Counter(), {}
+        for record in records:
+            if record.get('error') or not record.get('plan') or record.get('type') not in ADVISABLE_TYPES:
+                continue
+            fp = record.get('fingerprint') or fingerprint(record['query'])
+            if fp in queries:
+                continue
+            plan = Plan.from_explain(record['plan'])
+            queries[fp] = record['query']
+            sources[fp] = record.get('file_path', 'unknown')
+            for relation in scanned_relations(plan).values():
+                relations[relation].add(fp)
+            weights.update(plan_candidates(plan))
+
+        existing = index_columns(self.conn)
+        candidates = [candidate for candidate, _ in weights.most_common()
+                      if not _covered(candidate[2], existing.get(candidate[:2], []))][:max_candidates]
+        print(f"Index advisor: {len(queries)} queries, {len(candidates)} candidate indexes")
+
+        baseline, _ = self.measure(queries)
+        results = []
+        for candidate in candidates:
+            affected = {fp: queries[fp] for fp in relations[candidate[:2]] if baseline.get(fp)}
+            try:
+                measured, size = self.measure(affected, [candidate])
+            except psycopg2.Error as e:
+                print(f"  Skipping {self.definition(candidate).as_string(self.conn)}: {e}".rstrip())
+                continue
+            per_query = []
+            for fp, after in measured.items():
+                if after is None:
+                    continue
+                (cost_before, time_before), (cost_after, time_after) = baseline[fp], after
+                per_query.append({
+                    "fingerprint": fp,
+                    "file_path": sources[fp],
+                    "query": queries[fp],
+                    "cost_before": cost_before,
+                    "cost_after": cost_after,
+                    "time_before_ms": time_before,
+                    "time_after_ms": time_after,
+                })
+            improved = [q for q in per_query if q["cost_after"] < q["cost_before"]]
+            results.append({
+                "candidate": candidate,
+                "table": f"{candidate[0]}.{candidate[1]}",
+                "columns": list(candidate[2]),
+                "definition": self.definition(candidate).as_string(self.conn),
+                "size_bytes": size,
+                "improved_queries": len(improved),
+                "cost_gain": round(sum(q["cost_before"] - q["cost_after"] for q in improved), 2),
+                "time_gain_ms": round(sum((q["time_before_ms"] or 0) - (q["time_after_ms"] or 0)
+                                          for q in improved), 3) if self.analyze else None,
+                "queries": per_query,
+            })
+            print(f"  {results[-1]['definition']}: {len(improved)} queries improved, "
+                  f"cost gain {results[-1]['cost_gain']}")
+
+        chosen = self._choose(results, baseline, max_indexes, min_gain)
+        recommended = {"indexes": [result["definition"] for result in chosen]}
+        if chosen:
+            # Набор проверяется целиком: индексы могут мешать друг другу или дублировать выигрыш
+            affected = {fp: queries[fp] for result in chosen for fp in relations[result["candidate"][:2]]
+                        if baseline.get(fp)}
+            combined, size = self.measure(affected, [result["candidate"] for result in chosen])
+            measured = [(baseline[fp], after) for fp, after in combined.items() if after is not None]
+            recommended.update({
+                "size_bytes": size,
+                "queries": len(measured),
+                "improved_queries": sum(1 for before, after in measured if after[0] < before[0]),
+                "cost_before": round(sum(before[0] for before, _ in measured), 2),
+                "cost_after": round(sum(after[0] for _, after in measured), 2),
+            })
+            if self.analyze:
+                recommended["time_before_ms"] = round(sum(before[1] or 0 for before, _ in measured), 3)
+                recommended["time_after_ms"] = round(sum(after[1] or 0 for _, after in measured), 3)
+
+        for result in results:
+            del result["candidate"]
+        results.sort(key=lambda result: result["cost_gain"], reverse=True)
+        return {"candidates": results, "recommended": recommended}
+
+    @staticmethod
+    def _choose(results, baseline, max_indexes, min_gain):
+        """Жадный выбор: на каждом шаге индекс с наибольшим выигрышем сверх уже выбранных.
+
+        Выигрыш суммируется по всем запросам, поэтому индекс, ускоряющий многие запросы,
+        выбирается раньше узких; кандидат, чей выигрыш уже покрыт выбранными, не добавляется.
+        Считается, что запрос использует лучший из выбранных индексов.
+        """
+        best = {fp: measured[0] for fp, measured in baseline.items() if measured}
+        chosen = []
+        remaining = list(results)
+        while remaining and len(chosen) < max_indexes:
+            def gain(result):
+                return sum(max(0.0, best[q["fingerprint"]] - q["cost_after"]) for q in result["queries"])
+
+            result = max(remaining, key=lambda r: (gain(r), -len(r["columns"]), -r["size_bytes"]))
+            affected_cost = sum(best[q["fingerprint"]] for q in result["queries"])
+            if gain(result) <= 0 or gain(result) < min_gain * affected_cost:
+                break
+            chosen.append(result)
+            remaining.remove(result)
+            for q in result["queries"]:
+                best[q["fingerprint"]] = min(best[q["fingerprint"]], q["cost_after"])
+        return chosen
+
+    def close(self):
+        self.conn.close()
+
+
+def print_advice(advice):
+    recommended = advice["recommended"]
+    if not recommended["indexes"]:
+        print("No index improves the suite enough to recommend")
+        return
+    print("Recommended indexes:")
+    for definition in recommended["indexes"]:
+        print(f"  {definition};")
+    line = (f"Together: {recommended['improved_queries']} of {recommended['queries']} queries improved, "
+            f"cost {recommended['cost_before']} -> {recommended['cost_after']}, "
+            f"size {recommended['size_bytes'] / 1024 / 1024:.1f} MB")
+    if "time_before_ms" in recommended:
+        line += f", time {format_ms(recommended['time_before_ms'])} -> {format_ms(recommended['time_after_ms'])}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Подбор индексов: замер кандидатов в откатываемых транзакциях')
+    parser.add_argument('results', nargs='?', default='explain_results.json', help='Результаты EXPLAIN (.json/.jsonl)')
+    parser.add_argument('-o', '--output', default='index_advice.json', help='Замеры кандидатов и рекомендуемый набор')
+    parser.add_argument('--max-candidates', type=int, default=30, help='Сколько кандидатов проверять')
+    parser.add_argument('--max-indexes', type=int, default=5, help='Максимум индексов в рекомендуемом наборе')
+    parser.add_argument('--min-gain', type=float, default=0.1,
+                        help='Минимальный выигрыш индекса: доля стоимости затронутых запросов')
+    parser.add_argument('--cost-only', action='store_true', help='Сравнивать только стоимость, без EXPLAIN ANALYZE')
+    parser.add_argument('--query-timeout', type=int, default=30000, help='Лимит на один EXPLAIN, мс')
+    parser.add_argument('--index-timeout', type=int, default=600000, help='Лимит на создание индекса, мс')
+    args = parser.parse_args()
+
+    advisor = IndexAdvisor(not args.cost_only, args.query_timeout, args.index_timeout)
+    try:
+        advice = advisor.advise(read_records(args.results), args.max_candidates, args.max_indexes, args.min_gain)
+    finally:
+        advisor.close()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(advice, f, ensure_ascii=False, indent=2)
+    print_advice(advice)
+    print(f"Index advice saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import threading
+import collections
+from array import array
+from contextlib import contextmanager
+
+from stats import percentile
+
+# Сколько событий держать для трассы; агрегаты по спанам считаются по всем событиям
+MAX_TRACE_EVENTS = 200000
+# Префикс метрик в textfile Prometheus
+METRIC_PREFIX = "sql_analyzer"
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Instrumentation:
+    """Спаны и счётчики стадий: JSON-трасса, textfile Prometheus и сводка для отчёта.
+
+    Трасса пишется в формате Chrome trace (открывается в chrome://tracing и Perfetto).
+    Потокобезопасен; на процесс используется один общий экземпляр — metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._origin = time.perf_counter()
+            self._started_at = time.time()
+            self._events = []
+            self._dropped = 0
+            self._threads = {}
+            self._durations = collections.defaultdict(lambda: array('d'))
+            self._counters = collections.Counter()
+
+    def record(self, name, duration, start=None, **attrs):
+        """Завершённый спан длительностью duration секунд; start — time.perf_counter() начала"""
+        if start is None:
+            start = time.perf_counter() - duration
+        tid = threading.get_native_id()
+        event = {"name": name, "ph": "X", "ts": round((start - self._origin) * 1e6),
+                 "dur": round(duration * 1e6), "pid": os.getpid(), "tid": tid}
+        if attrs:
+            event["args"] = attrs
+        with self._lock:
+            self._durations[name].append(duration)
+            self._threads.setdefault(tid, threading.current_thread().name)
+            if len(self._events) < MAX_TRACE_EVENTS:
+                self._events.append(event)
+            else:
+                self._dropped += 1
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Спан вокруг блока; в отдаваемый словарь атрибутов можно дописывать результат"""
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.record(name, time.perf_counter() - start, start, **attrs)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def summary(self):
+        """Агрегаты: по спанам — число, сумма, p50/p95/max в секундах; счётчики"""
+        with self._lock:
+            spans = {
+                name: {
+                    "count": len(durations),
+                    "total_s": round(sum(durations), 6),
+                    "p50_s": round(percentile(durations, 50), 6),
+                    "p95_s": round(percentile(durations, 95), 6),
+                    "max_s": round(max(durations), 6),
+                }
+                for name, durations in sorted(self._durations.items())
+            }
+            return {
+                "started_at": self._started_at,
+                "wall_s": round(time.perf_counter() - self._origin, 3),
+                "spans": spans,
+                "counters": dict(sorted(self._counters.items())),
+                "dropped_events": self._dropped,
+            }
+
+    def write_trace(self, path):
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        names = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                 for tid, name in threads.items()]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": names + events, "summary": self.summary()}, f, ensure_ascii=False)
+
+    def prometheus_lines(self):
+        summary = self.summary()
+        prefix = METRIC_PREFIX
+        lines = [f"# HELP {prefix}_span_seconds Duration of pipeline operations",
+                 f"# TYPE {prefix}_span_seconds summary"]
+        for name, span in summary["spans"].items():
+            label = f'span="{_label(name)}"'
+            lines.append(f'{prefix}_span_seconds{{{label},quantile="0.5"}} {span["p50_s"]}')
+            lines.append(f'{prefix}_span_seconds{{{label},quantile="0.95"}} {span["p95_s"]}')
+            lines.append(f'{prefix}_span_seconds_sum{{{label}}} {span["total_s"]}')
+            lines.append(f'{prefix}_span_seconds_count{{{label}}} {span["count"]}')
+        lines += [f"# HELP {prefix}_events_total Pipeline event counters",
+                  f"# TYPE {prefix}_events_total counter"]
+        for name, value in summary["counters"].items():
+            lines.append(f'{prefix}_events_total{{event="{_label(name)}"}} {value}')
+        lines += [f"# HELP {prefix}_run_seconds Wall time of the last run",
+                  f"# TYPE {prefix}_run_seconds gauge",
+                  f"{prefix}_run_seconds {summary['wall_s']}",
+                  f"# HELP {prefix}_last_run_timestamp_seconds Start time of the last run",
+                  f"# TYPE {prefix}_last_run_timestamp_seconds gauge",
+                  f"{prefix}_last_run_timestamp_seconds {summary['started_at']:.0f}"]
+        return lines
+
+    def write_prometheus(self, path):
+        """Textfile для node_exporter: пишется рядом и атомарно подменяется, чтобы не прочитали половину"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(self.prometheus_lines()) + "\n")
+        os.replace(tmp_path, path)
+
+    def export(self, trace_path=None, prometheus_path=None):
+        """Записывает трассу и метрики, если пути заданы"""
+        if trace_path:
+            self.write_trace(trace_path)
+            print(f"Trace saved to {trace_path}")
+        if prometheus_path:
+            self.write_prometheus(prometheus_path)
+            print(f"Metrics saved to {prometheus_path}")
+
+
+def load_summary(paths):
+    """Сводки из нескольких трасс (отдельные запуски стадий): спаны и счётчики объединяются"""
+    merged = {"wall_s": 0.0, "spans": {}, "counters": collections.Counter(), "dropped_events": 0}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            summary = json.load(f)["summary"]
+        merged["wall_s"] += summary["wall_s"]
+        merged["dropped_events"] += summary.get("dropped_events", 0)
+        merged["counters"].update(summary["counters"])
+        for name, span in summary["spans"].items():
+            # Одно имя спана в нескольких трассах бывает редко — оставляем более полную выборку
+            if name not in merged["spans"] or merged["spans"][name]["count"] < span["count"]:
+                merged["spans"][name] = span
+    merged["counters"] = dict(sorted(merged["counters"].items()))
+    return merged
+
+
+metrics = Instrumentation()
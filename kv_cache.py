@@ -0,0 +1,78 @@
+import json
+import time
+import sqlite3
+import threading
+
+
+class KeyValueCache:
+    """Персистентный кэш ключ -> JSON-значение в SQLite с вытеснением по LRU и TTL.
+
+    Потокобезопасен: одним экземпляром могут пользоваться потоки пула.
+    """
+
+    def __init__(self, path, max_entries=50000, ttl_s=None):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def get(self, key):
+        """Возвращает значение или None, если ключа нет или запись устарела"""
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_s is not None and now - row[1] > self.ttl_s:
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.evicted += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """Удаляет устаревшие по TTL и самые давно использованные записи сверх лимита"""
+        if self.ttl_s is not None:
+            cursor = self.conn.execute("DELETE FROM entries WHERE created_at < ?", (time.time() - self.ttl_s,))
+            self.evicted += cursor.rowcount
+        count = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count > self.max_entries:
+            cursor = self.conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,)
+            )
+            self.evicted += cursor.rowcount
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted}
+
+    def close(self):
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
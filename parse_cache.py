@@ -0,0 +1,99 @@
+import os
+import json
+import sqlite3
+
+# Формат ключей кэша: 2 — абсолютные нормализованные пути
+LAYOUT_VERSION = 2
+
+
+def _key(filepath):
+    """Один файл — один ключ, как бы ни был записан путь (".", "./sql", абсолютный)"""
+    return os.path.abspath(filepath)
+
+
+class ParseCache:
+    """Кэш результатов разбора .sql файлов: путь + хэш содержимого -> список запросов"""
+
+    def __init__(self, path, version):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                queries TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+        # Смена версии парсера или формата ключей делает все записи недействительными
+        version = f"{version}:{LAYOUT_VERSION}"
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != version:
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (version,))
+        self.conn.commit()
+
+        # Метаданные держим в памяти: lookup вызывается из потока, подающего задачи в пул,
+        # а соединение SQLite можно использовать только в создавшем его потоке
+        self._index = {
+            path: (mtime, size, content_hash)
+            for path, mtime, size, content_hash in self.conn.execute(
+                "SELECT path, mtime, size, content_hash FROM files"
+            )
+        }
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._seen = set()
+
+    def lookup(self, filepath):
+        """Возвращает (mtime, size, content_hash) закэшированного файла или None"""
+        key = _key(filepath)
+        self._seen.add(key)
+        return self._index.get(key)
+
+    def get_queries(self, filepath, mtime, size):
+        """Отдаёт закэшированные запросы и обновляет mtime/size для быстрой проверки.
+
+        Путь в записях — как он задан в этом запуске, а не в том, который заполнил кэш.
+        """
+        self.hits += 1
+        key = _key(filepath)
+        self.conn.execute("UPDATE files SET mtime = ?, size = ? WHERE path = ?", (mtime, size, key))
+        row = self.conn.execute("SELECT queries FROM files WHERE path = ?", (key,)).fetchone()
+        return [dict(query, file_path=filepath) for query in json.loads(row[0])]
+
+    def store(self, filepath, mtime, size, content_hash, queries):
+        self.misses += 1
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, mtime, size, content_hash, queries) VALUES (?, ?, ?, ?, ?)",
+            (_key(filepath), mtime, size, content_hash, json.dumps(queries, ensure_ascii=False))
+        )
+
+    def evict_missing(self, root):
+        """Удаляет записи о файлах под root, которые не встретились при обходе (удалены или переименованы).
+
+        Записи вне root не трогаются: разбор одного файла или подкаталога не стирает кэш остального дерева.
+        """
+        root = _key(root)
+        prefix = root if root.endswith(os.sep) else root + os.sep
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen (path TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM seen")
+        self.conn.executemany("INSERT OR IGNORE INTO seen (path) VALUES (?)", ((p,) for p in self._seen))
+        cursor = self.conn.execute(
+            "DELETE FROM files WHERE (path = ? OR substr(path, 1, length(?)) = ?) "
+            "AND path NOT IN (SELECT path FROM seen)",
+            (root, prefix, prefix)
+        )
+        self.evicted += cursor.rowcount
+        self.conn.commit()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted}
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
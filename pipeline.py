@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import time
+import argparse
+from functools import partial
+
+from artifacts import read_records, tee_records
+from concurrency import prefetch
+from kv_cache import KeyValueCache
+from parse_cache import ParseCache
+from sqlParse import iter_parsed_queries, PARSE_CACHE_VERSION
+from explainRunner import ExplainRunner
+from LLM_aggregator import OpenRouterAnalyzer, analyze_results, check_deployment_criteria
+from report_converter import write_html_report
+from run_store import RunStore
+from baseline import BaselineStore
+from index_advisor import IndexAdvisor, print_advice
+from instrumentation import metrics
+from workload import iter_workload_queries, ORDER_KEYS
+from sql_diff import SqlDiff, load_previous_report, mark_carried_over, carried_explain, carried_analysis
+
+
+def parse_stage(directory, workers, cache_path):
+    """Разбор .sql файлов; кэш открывается внутри, т.к. стадия работает в своём потоке"""
+    cache = ParseCache(cache_path, PARSE_CACHE_VERSION) if cache_path else None
+    try:
+        yield from iter_parsed_queries(directory, workers, cache=cache)
+    finally:
+        if cache:
+            cache.close()
+
+
+def is_final_analysis(entry):
+    """Фоллбэки после ошибок API и нераспарсенных ответов при --resume запрашиваем заново"""
+    return entry["analysis"].get("source") != "fallback"
+
+
+def first_stored(*lookups):
+    """Объединяет функции stored стадии: берётся первый найденный результат"""
+    def lookup(record):
+        for stored in lookups:
+            value = stored(record)
+            if value is not None:
+                return value
+        return None
+    return lookup
+
+
+def run_pipeline(args):
+    """parse -> EXPLAIN -> LLM одним потоком записей через ограниченные очереди.
+
+    Каждая стадия работает в своём потоке и опережает следующую не более чем на
+    queue_size записей, поэтому память не растёт с числом запросов, а общее время
+    определяется самой медленной стадией. Артефакты пишутся по мере прохождения записей.
+    """
+    plan_cache = None
+    if not args.no_plan_cache:
+        plan_cache = KeyValueCache(args.plan_cache, args.plan_cache_size, args.plan_cache_ttl * 3600)
+    llm_cache = None
+    if not args.no_llm_cache:
+        llm_cache = KeyValueCache(args.llm_cache, args.llm_cache_size, args.llm_cache_ttl * 3600)
+
+    # Каждая стадия сохраняет результаты по query_id; при --resume готовые не пересчитываются
+    store = RunStore(args.run_db, resume=args.resume)
+    source = args.workload or args.directory
+    previous_directory = store.get_meta("directory")
+    if args.resume and previous_directory not in (None, source):
+        print(f"Warning: resuming a run over {previous_directory}, now given {source}")
+    store.set_meta("directory", source)
+
+    baseline = BaselineStore(args.baseline, args.update_baseline) if args.baseline else None
+
+    # --since: выполняются только новые и изменённые запросы, остальное берётся из прошлого отчёта
+    diff, previous = None, {}
+    if args.since:
+        diff = SqlDiff(args.since, args.directory)
+        # Прошлый отчёт читается целиком до запуска: по ходу запуска --report перезаписывается
+        previous = load_previous_report(args.previous_report or args.report)
+        print(f"Changed since {args.since}: {len(diff.changed)} .sql files; "
+              f"{len(previous)} analyses available from the previous report")
+        if not previous:
+            print("Warning: no previous report, all statements will be analyzed")
+
+    analyzer = OpenRouterAnalyzer(llm_cache, args.rpm, args.max_retries, args.plan_tokens)
+    runner = ExplainRunner(args.explain_workers, args.serialize_writes, args.query_timeout,
+                           args.total_budget, not args.no_dedupe, plan_cache, args.refresh_plans,
+                           args.repeat, args.warmup, args.cold)
+    started = time.monotonic()
+    try:
+        # Стадии работают одновременно, поэтому отдельно меряем весь потоковый участок
+        with metrics.span("pipeline.stream"):
+            parse_complete = store.is_complete("parsed")
+            if parse_complete:
+                # Разбор прошлого запуска завершён — берём ровно те же запросы с теми же id
+                parsed = store.records("parsed")
+            elif args.workload:
+                # Реальная нагрузка вместо .sql файлов: самые дорогие запросы идут первыми
+                parsed = iter_workload_queries(args.workload, args.top, args.order_by, args.min_calls)
+            else:
+                parsed = parse_stage(args.directory, args.parse_workers,
+                                     None if args.no_parse_cache else args.parse_cache)
+            if not parse_complete:
+                if diff is not None:
+                    parsed = mark_carried_over(parsed, diff, previous)
+                # Оба источника получают query_id: по нему сохраняются результаты стадий и работает --resume
+                parsed = store.record_stage("parsed", (dict(record, query_id=query_id)
+                                                       for query_id, record in enumerate(parsed)))
+            parsed = prefetch(tee_records(parsed, args.parsed), args.queue_size)
+
+            # Результат EXPLAIN сохраняется сразу по готовности, а не в порядке выдачи
+            explained = runner.run(parsed, first_stored(store.stored("explained"), carried_explain),
+                                   partial(store.save, "explained"))
+            explained = prefetch(tee_records(explained, args.explained), args.queue_size)
+
+            stored = store.stored("analyzed", is_final_analysis)
+            if previous:
+                stored = first_stored(stored, carried_analysis(previous))
+            report = analyze_results(explained, analyzer, args.concurrency, args.batch_tokens,
+                                     args.batch_size, not args.no_rules, stored, baseline)
+            report = tee_records(store.record_stage("analyzed", report), args.report)
+            deploy_ok = check_deployment_criteria(report, args.fail_on_regression)
+    finally:
+        runner.close()
+        for cache in (plan_cache, llm_cache, baseline):
+            if cache:
+                cache.close()
+        restored = store.restored
+        store.close()
+
+    print(f"Pipeline finished in {time.monotonic() - started:.1f}s. "
+          f"Artifacts: {args.parsed}, {args.explained}, {args.report}")
+    if args.resume:
+        print(f"Resumed run {args.run_db}: {restored['explained']} EXPLAIN results and "
+              f"{restored['analyzed']} analyses reused")
+    if args.html:
+        write_html_report(read_records(args.report), args.html, metrics.summary())
+        print(f"HTML report saved to {args.html}")
+    if args.index_advice:
+        advisor = IndexAdvisor()
+        try:
+            with metrics.span("index_advisor"):
+                advice = advisor.advise(read_records(args.explained))
+        finally:
+            advisor.close()
+        with open(args.index_advice, "w", encoding="utf-8") as f:
+            json.dump(advice, f, ensure_ascii=False, indent=2)
+        print_advice(advice)
+        print(f"Index advice saved to {args.index_advice}")
+    metrics.export(args.trace, args.metrics)
+    return deploy_ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Потоковый конвейер: разбор SQL -> EXPLAIN ANALYZE -> LLM')
+    parser.add_argument('directory', nargs='?', default='.', help='Каталог (или файл) с .sql')
+    parser.add_argument('--parsed', default='parsed_queries.jsonl', help='Артефакт разбора')
+    parser.add_argument('--explained', default='explain_results.jsonl', help='Артефакт EXPLAIN')
+    parser.add_argument('--report', default='llm_report.jsonl', help='Артефакт отчёта LLM')
+    parser.add_argument('--html', default='final_result.html', help='HTML-отчёт (пустая строка — не строить)')
+    parser.add_argument('--queue-size', type=int, default=100,
+                        help='На сколько записей стадия может опережать следующую')
+    parser.add_argument('--run-db', default='.run.db', help='База запуска: результаты стадий по query_id')
+    parser.add_argument('--resume', action='store_true',
+                        help='Продолжить прерванный запуск из --run-db, не повторяя EXPLAIN и LLM')
+
+    parser.add_argument('--since', default=None,
+                        help='Git-ревизия (базовая ветка): анализировать только новые и изменённые запросы; '
+                             'неизменённые не выполняются — для них нет статистики таблиц и сравнения с --baseline')
+    parser.add_argument('--previous-report', default=None,
+                        help='Отчёт прошлого запуска для --since (по умолчанию — текущий --report)')
+
+    parser.add_argument('--workload', default=None,
+                        help='Брать запросы не из .sql, а из pg_stat_statements (или его CSV-снимка)')
+    parser.add_argument('--top', type=int, default=50, help='--workload: сколько самых дорогих запросов взять')
+    parser.add_argument('--order-by', choices=sorted(ORDER_KEYS), default='total',
+                        help='--workload: сортировка по суммарному или среднему времени')
+    parser.add_argument('--min-calls', type=int, default=1, help='--workload: минимум вызовов запроса')
+
+    parser.add_argument('--parse-workers', type=int, default=1, help='Процессов для разбора (0 — по числу ядер)')
+    parser.add_argument('--parse-cache', default='.sqlparse_cache.db', help='Кэш разбора .sql файлов')
+    parser.add_argument('--no-parse-cache', action='store_true', help='Разбирать все файлы заново')
+
+    parser.add_argument('--explain-workers', type=int, default=1, help='Число параллельных соединений с БД')
+    parser.add_argument('--serialize-writes', action='store_true',
+                        help='Выполнять DML/DDL последовательно в отдельном соединении')
+    parser.add_argument('--query-timeout', type=int, default=None,
+                        help='Лимит на один EXPLAIN ANALYZE, мс (затем — план без ANALYZE)')
+    parser.add_argument('--total-budget', type=float, default=None, help='Общий бюджет времени на EXPLAIN, с')
+    parser.add_argument('--no-dedupe', action='store_true', help='Не дедуплицировать EXPLAIN по отпечаткам')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Режим замеров: прогонов EXPLAIN ANALYZE на запрос (в результате — p50/p95)')
+    parser.add_argument('--warmup', type=int, default=0, help='Прогревочных прогонов перед замерами')
+    parser.add_argument('--cold', action='store_true',
+                        help='Учитывать самый первый прогон (до прогрева) отдельно как холодный')
+    parser.add_argument('--plan-cache', default='.plan_cache.db', help='Кэш планов (SQLite)')
+    parser.add_argument('--no-plan-cache', action='store_true', help='Не использовать кэш планов')
+    parser.add_argument('--refresh-plans', action='store_true', help='Переснять все планы и обновить кэш')
+    parser.add_argument('--plan-cache-ttl', type=float, default=7 * 24, help='Время жизни плана в кэше, ч')
+    parser.add_argument('--plan-cache-size', type=int, default=50000, help='Максимум записей в кэше планов')
+
+    parser.add_argument('--llm-cache', default='.llm_cache.db', help='Кэш ответов LLM (SQLite)')
+    parser.add_argument('--no-llm-cache', action='store_true', help='Не использовать кэш ответов LLM')
+    parser.add_argument('--llm-cache-ttl', type=float, default=7 * 24, help='Время жизни ответа в кэше, ч')
+    parser.add_argument('--llm-cache-size', type=int, default=20000, help='Максимум ответов в кэше')
+    parser.add_argument('--concurrency', type=int, default=1, help='Число параллельных запросов к LLM')
+    parser.add_argument('--rpm', type=float, default=20, help='Лимит провайдера: запросов в минуту')
+    parser.add_argument('--max-retries', type=int, default=5, help='Повторов запроса при 429/5xx/сетевых ошибках')
+    parser.add_argument('--batch-tokens', type=int, default=0,
+                        help='Пакетный режим: бюджет токенов промпта на пакет запросов (0 — по одному)')
+    parser.add_argument('--batch-size', type=int, default=10, help='Максимум запросов в одном пакете')
+    parser.add_argument('--plan-tokens', type=int, default=1500, help='Бюджет токенов на план в промпте')
+    parser.add_argument('--no-rules', action='store_true', help='Отправлять в LLM все запросы')
+    parser.add_argument('--baseline', default=None, help='Эталонные измерения (SQLite) для поиска регрессий')
+    parser.add_argument('--update-baseline', action='store_true', help='Добавить измерения запуска в эталон')
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help='Запрещать деплой при регрессиях относительно эталона')
+    parser.add_argument('--index-advice', default=None,
+                        help='После запуска подобрать индексы по планам и сохранить замеры в этот файл')
+    parser.add_argument('--trace', default=None, help='JSON-трасса спанов всех стадий (chrome://tracing, Perfetto)')
+    parser.add_argument('--metrics', default=None, help='Textfile Prometheus с метриками запуска')
+    args = parser.parse_args()
+    if args.workload and args.since:
+        parser.error("--since compares .sql files and cannot be combined with --workload")
+
+    if not run_pipeline(args):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
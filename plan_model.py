@@ -0,0 +1,227 @@
+import json
+
+# Ключи EXPLAIN (FORMAT JSON), которые разбираются в отдельные поля узла
+_NODE_FIELDS = {
+    "Node Type": "node_type",
+    "Relation Name": "relation",
+    "Schema": "schema",
+    "Alias": "alias",
+    "Index Name": "index_name",
+    "Startup Cost": "startup_cost",
+    "Total Cost": "total_cost",
+    "Plan Rows": "plan_rows",
+    "Plan Width": "plan_width",
+    "Actual Startup Time": "actual_startup_time",
+    "Actual Total Time": "actual_total_time",
+    "Actual Rows": "actual_rows",
+    "Actual Loops": "actual_loops",
+    "Shared Hit Blocks": "shared_hit",
+    "Shared Read Blocks": "shared_read",
+    "Shared Dirtied Blocks": "shared_dirtied",
+    "Shared Written Blocks": "shared_written",
+    "Temp Read Blocks": "temp_read",
+    "Temp Written Blocks": "temp_written",
+}
+
+# Ключи, которые выводим в текстовом представлении под узлом
+_DETAIL_KEYS = (
+    "Index Cond", "Recheck Cond", "Filter", "Rows Removed by Filter", "Join Filter",
+    "Hash Cond", "Merge Cond", "Sort Key", "Sort Method", "Sort Space Used",
+    "Sort Space Type", "Group Key", "Output",
+)
+
+
+def format_ms(value):
+    """Форматирует время в миллисекундах для отчёта и промпта"""
+    if value is None:
+        return "unknown"
+    return f"{value:.3f}ms"
+
+
+def format_bytes(value):
+    """Размер в байтах в единицах, удобных для чтения"""
+    if value is None:
+        return "unknown"
+    for unit in ("B", "kB", "MB", "GB"):
+        if value < 1024:
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} TB"
+
+
+def text_indent(depth):
+    """Отступ и префикс строки узла на глубине depth, как в текстовом EXPLAIN PostgreSQL"""
+    if not depth:
+        return "", ""
+    return " " * (6 * depth - 4), "->  "
+
+
+class PlanNode:
+    """Узел плана выполнения с фактическими и оценочными показателями"""
+
+    __slots__ = tuple(_NODE_FIELDS.values()) + ("details", "children")
+
+    def __init__(self, data):
+        for key, attr in _NODE_FIELDS.items():
+            setattr(self, attr, data.get(key))
+        self.details = {k: v for k, v in data.items() if k not in _NODE_FIELDS and k != "Plans"}
+        self.children = [PlanNode(child) for child in data.get("Plans", [])]
+
+    @property
+    def analyzed(self):
+        """Есть ли фактические показатели (EXPLAIN с ANALYZE и узел выполнялся)"""
+        return self.actual_total_time is not None
+
+    @property
+    def inclusive_time(self):
+        """Полное время узла вместе с потомками за все циклы, мс"""
+        if not self.analyzed:
+            return None
+        return self.actual_total_time * (self.actual_loops or 1)
+
+    @property
+    def self_time(self):
+        """Собственное время узла без учёта потомков, мс"""
+        if not self.analyzed:
+            return None
+        children_time = sum(child.inclusive_time or 0 for child in self.children)
+        return max(0.0, self.inclusive_time - children_time)
+
+    @property
+    def self_cost(self):
+        """Собственная оценочная стоимость узла без учёта потомков"""
+        children_cost = sum(child.total_cost or 0 for child in self.children)
+        return max(0.0, (self.total_cost or 0) - children_cost)
+
+    @property
+    def estimate_error(self):
+        """Во сколько раз планировщик ошибся в числе строк (>= 1), None без ANALYZE"""
+        if not self.analyzed or self.plan_rows is None or self.actual_rows is None:
+            return None
+        actual = max(self.actual_rows, 1)
+        estimated = max(self.plan_rows, 1)
+        return max(actual, estimated) / min(actual, estimated)
+
+    def label(self):
+        parts = [self.node_type or "?"]
+        if self.index_name:
+            parts.append(f"using {self.index_name}")
+        if self.relation:
+            target = f"{self.schema}.{self.relation}" if self.schema else self.relation
+            parts.append(f"on {target}")
+            if self.alias and self.alias != self.relation:
+                parts.append(self.alias)
+        return " ".join(parts)
+
+    def iter_nodes(self, depth=0):
+        """Обход поддерева в глубину: пары (глубина, узел)"""
+        yield depth, self
+        for child in self.children:
+            yield from child.iter_nodes(depth + 1)
+
+    def text_lines(self, depth=0, verbose=True):
+        """Строки в стиле текстового EXPLAIN для узла и его потомков"""
+        lines = self.node_lines(depth, verbose)
+        for child in self.children:
+            lines.extend(child.text_lines(depth + 1, verbose))
+        return lines
+
+    def node_lines(self, depth=0, verbose=True, details=True):
+        """Строки текстового EXPLAIN только для самого узла, без потомков"""
+        indent, prefix = text_indent(depth)
+        line = f"{indent}{prefix}{self.label()}  (cost={self.startup_cost:.2f}..{self.total_cost:.2f} " \
+               f"rows={self.plan_rows} width={self.plan_width})"
+        if self.analyzed:
+            line += f" (actual time={self.actual_startup_time:.3f}..{self.actual_total_time:.3f} " \
+                    f"rows={self.actual_rows} loops={self.actual_loops})"
+        elif self.actual_loops == 0:
+            line += " (never executed)"
+        lines = [line]
+        if not details:
+            return lines
+
+        detail_indent = indent + ("      " if depth else "  ")
+        for key in _DETAIL_KEYS:
+            if key not in self.details or (key == "Output" and not verbose):
+                continue
+            value = self.details[key]
+            if isinstance(value, list):
+                value = ", ".join(str(v) for v in value)
+            lines.append(f"{detail_indent}{key}: {value}")
+
+        buffers = [(name, getattr(self, attr)) for name, attr in
+                   (("shared hit", "shared_hit"), ("read", "shared_read"), ("dirtied", "shared_dirtied"),
+                    ("written", "shared_written"), ("temp read", "temp_read"), ("temp written", "temp_written"))]
+        buffers = [f"{name}={value}" for name, value in buffers if value]
+        if buffers:
+            lines.append(f"{detail_indent}Buffers: {' '.join(buffers)}")
+        return lines
+
+
+class Plan:
+    """План запроса из EXPLAIN (FORMAT JSON)"""
+
+    __slots__ = ("root", "planning_time", "execution_time")
+
+    def __init__(self, root, planning_time=None, execution_time=None):
+        self.root = root
+        self.planning_time = planning_time
+        self.execution_time = execution_time
+
+    @classmethod
+    def from_explain(cls, data):
+        """Строит план из результата EXPLAIN (FORMAT JSON): строки JSON, списка или словаря"""
+        if isinstance(data, str):
+            data = json.loads(data)
+        if isinstance(data, list):
+            data = data[0]
+        return cls(PlanNode(data["Plan"]), data.get("Planning Time"), data.get("Execution Time"))
+
+    @property
+    def analyzed(self):
+        return self.root.analyzed
+
+    @property
+    def total_time(self):
+        """Измеренное время выполнения, мс (None для плана без ANALYZE)"""
+        if self.execution_time is not None:
+            return self.execution_time
+        return self.root.inclusive_time
+
+    def iter_nodes(self):
+        return self.root.iter_nodes()
+
+    def relations(self):
+        """Таблицы плана в порядке обхода, без повторов: ["public.trip", ...]"""
+        names = (f"{node.schema or 'public'}.{node.relation}" for _, node in self.iter_nodes() if node.relation)
+        return list(dict.fromkeys(names))
+
+    def top_nodes(self, k=5):
+        """k самых дорогих узлов по собственному времени (или по стоимости без ANALYZE)"""
+        nodes = [node for _, node in self.iter_nodes()]
+        if self.analyzed:
+            return sorted(nodes, key=lambda n: n.self_time or 0, reverse=True)[:k]
+        return sorted(nodes, key=lambda n: n.total_cost or 0, reverse=True)[:k]
+
+    def estimate_errors(self, min_ratio=10):
+        """Узлы с ошибкой оценки числа строк не меньше min_ratio, по убыванию ошибки"""
+        errors = [(node, node.estimate_error) for _, node in self.iter_nodes()
+                  if node.estimate_error is not None and node.estimate_error >= min_ratio]
+        return sorted(errors, key=lambda pair: pair[1], reverse=True)
+
+    def buffers(self):
+        """Суммарные показатели буферов (в корне PostgreSQL уже суммирует потомков)"""
+        return {
+            "shared_hit": self.root.shared_hit or 0,
+            "shared_read": self.root.shared_read or 0,
+            "temp_read": self.root.temp_read or 0,
+            "temp_written": self.root.temp_written or 0,
+        }
+
+    def text_lines(self, verbose=True):
+        lines = self.root.text_lines(verbose=verbose)
+        if self.planning_time is not None:
+            lines.append(f"Planning Time: {self.planning_time:.3f} ms")
+        if self.execution_time is not None:
+            lines.append(f"Execution Time: {self.execution_time:.3f} ms")
+        return lines
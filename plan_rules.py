@@ -0,0 +1,137 @@
+import re
+
+from fingerprint import normalize_query
+from plan_model import Plan, format_ms
+
+# Пороги времени строже критериев промпта LLM (GOOD < 50ms, NEEDS_IMPROVEMENT > 500ms,
+# CRITICAL > 2s): правила решают только однозначные случаи, всё между порогами уходит модели.
+# GOOD — лишь выполненные за миллисекунду запросы без замечаний и без Seq Scan, а не всё быстрее 50ms
+GOOD_TIME_MS = 1.0
+# Граница NEEDS_IMPROVEMENT из промпта; применяется только к лимиту времени недовыполненного
+# запроса — измеренные 500ms–2s правила не оценивают, там решает модель
+SLOW_TIME_MS = 500.0
+# Совпадает с CRITICAL из промпта
+CRITICAL_TIME_MS = 2000.0
+# С какого числа строк последовательное чтение с фильтром считаем проблемой
+LARGE_SCAN_ROWS = 100000
+# Ошибка оценки строк под Nested Loop, после которой план заведомо неудачный
+NESTED_LOOP_ESTIMATE_ERROR = 1000
+
+_SEVERITY = {"GOOD": "LOW", "ACCEPTABLE": "LOW", "NEEDS_IMPROVEMENT": "MEDIUM", "CRITICAL": "CRITICAL"}
+_RANK = {"GOOD": 0, "ACCEPTABLE": 1, "NEEDS_IMPROVEMENT": 2, "CRITICAL": 3}
+
+_WHERE = re.compile(r'\bwhere\b')
+
+
+def _query_findings(query_data):
+    """Замечания (оценка, проблема, рекомендация) по тексту запроса: разрушительные операции без условия"""
+    query_type = query_data.get('type')
+    if query_type in ('DROP', 'TRUNCATE'):
+        yield ("CRITICAL", f"{query_type} удаляет объект или все данные таблицы",
+               "Вынесите операцию в отдельную миграцию с ручным подтверждением")
+    elif query_type in ('DELETE', 'UPDATE') and not _WHERE.search(normalize_query(query_data['query'])):
+        yield ("CRITICAL", f"{query_type} без WHERE затрагивает все строки таблицы",
+               "Добавьте условие WHERE или подтвердите, что нужна обработка всей таблицы")
+
+
+def _scanned_rows(node, table_rows):
+    """Сколько строк прочитал узел за все циклы.
+
+    Без ANALYZE plan_rows — оценка строк уже после фильтра, поэтому для сканирования
+    берём оценку размера таблицы из каталога (table_rows: {"public.trip": строк}).
+    """
+    if not node.analyzed:
+        rows = table_rows.get(f"{node.schema or 'public'}.{node.relation}") if node.relation else None
+        return rows if rows is not None else node.plan_rows or 0
+    removed = node.details.get("Rows Removed by Filter") or 0
+    return ((node.actual_rows or 0) + removed) * (node.actual_loops or 1)
+
+
+def _plan_findings(plan, table_rows):
+    """Правила по узлам плана"""
+    for _, node in plan.iter_nodes():
+        scanned = _scanned_rows(node, table_rows) if node.node_type == "Seq Scan" else 0
+        if node.details.get("Filter") and scanned >= LARGE_SCAN_ROWS:
+            yield ("NEEDS_IMPROVEMENT",
+                   f"Последовательное чтение {node.label()} с фильтром: "
+                   f"просмотрено ~{scanned} строк",
+                   f"Создайте индекс по столбцам условия: {node.details['Filter']}")
+        if node.node_type == "Sort" and (node.details.get("Sort Space Type") == "Disk" or node.temp_written):
+            yield ("NEEDS_IMPROVEMENT", "Сортировка не помещается в память и выполняется на диске",
+                   "Увеличьте work_mem для запроса или используйте индекс с нужным порядком")
+        if node.node_type == "Nested Loop":
+            errors = [child.estimate_error for child in node.children if child.estimate_error is not None]
+            if errors and max(errors) >= NESTED_LOOP_ESTIMATE_ERROR:
+                yield ("NEEDS_IMPROVEMENT",
+                       f"Nested Loop выбран при ошибке оценки строк x{max(errors):.0f}",
+                       "Выполните ANALYZE по таблицам запроса или создайте расширенную статистику")
+
+
+def _time_findings(query_data, plan):
+    """Правила по времени выполнения (или по превышенному лимиту времени)"""
+    if query_data.get('generic_plan'):
+        # Общий план без выполнения: время — среднее по вызовам из pg_stat_statements
+        total = (query_data.get('workload') or {}).get('mean_ms')
+        if total is not None and total > CRITICAL_TIME_MS:
+            yield ("CRITICAL", f"Очень медленное выполнение в среднем по нагрузке: {format_ms(total)}",
+                   "Оптимизируйте самые дорогие узлы плана")
+        return
+    if query_data.get('estimated_only'):
+        budget = query_data.get('time_budget_ms')
+        if budget is not None and budget >= CRITICAL_TIME_MS:
+            yield ("CRITICAL", f"Запрос не уложился в {format_ms(budget)}",
+                   "Проверьте план: вероятно, нужен индекс или переписывание запроса")
+        elif budget is not None and budget >= SLOW_TIME_MS:
+            yield ("NEEDS_IMPROVEMENT", f"Запрос не уложился в {format_ms(budget)}",
+                   "Проверьте план: вероятно, нужен индекс или переписывание запроса")
+        return
+    total = plan.total_time
+    if total is not None and total > CRITICAL_TIME_MS:
+        yield ("CRITICAL", f"Очень медленное выполнение: {format_ms(total)}",
+               "Оптимизируйте самые дорогие узлы плана")
+
+
+def _index_access_only(plan):
+    """Таблицы читаются только по индексам (Index/Index Only/Bitmap Scan) или не читаются вовсе.
+
+    Seq Scan быстр на маленькой таблице, но замедляется с её ростом — такой план оценивает модель.
+    """
+    return not any(node.node_type == "Seq Scan" for _, node in plan.iter_nodes())
+
+
+def evaluate_query(query_data):
+    """Детерминированная оценка запроса по его плану.
+
+    Возвращает анализ в формате LLM (с "source": "rules") или None, если случай
+    неоднозначный и его нужно отдать модели.
+    """
+    findings = list(_query_findings(query_data))
+    plan = Plan.from_explain(query_data['plan']) if query_data.get('plan') else None
+    if plan is not None:
+        findings.extend(_time_findings(query_data, plan))
+        table_rows = {name: info["rows"] for name, info in (query_data.get('table_stats') or {}).items()}
+        findings.extend(_plan_findings(plan, table_rows))
+
+    if findings:
+        evaluation = max((finding[0] for finding in findings), key=_RANK.get)
+        return {
+            "evaluation": evaluation,
+            "severity": _SEVERITY[evaluation],
+            "execution_time": format_ms(plan.total_time) if plan is not None else "unknown",
+            "issues": [finding[1] for finding in findings],
+            "recommendations": list(dict.fromkeys(finding[2] for finding in findings)),
+            "source": "rules",
+        }
+
+    # Быстрый выполненный запрос по индексам без замечаний обсуждать с моделью незачем
+    if plan is not None and plan.analyzed and not query_data.get('estimated_only') \
+            and plan.total_time is not None and plan.total_time < GOOD_TIME_MS and _index_access_only(plan):
+        return {
+            "evaluation": "GOOD",
+            "severity": "LOW",
+            "execution_time": format_ms(plan.total_time),
+            "issues": ["No performance issues detected"],
+            "recommendations": ["Query is well-optimized for current data size"],
+            "source": "rules",
+        }
+    return None
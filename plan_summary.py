@@ -0,0 +1,126 @@
+import collections
+
+from plan_model import text_indent, format_ms
+
+# Узлы легче этой доли суммарного веса плана не показываем, даже если бюджет позволяет
+TRIVIAL_SHARE = 0.01
+
+
+def estimate_tokens(text):
+    """Грубая оценка числа токенов (кириллица в среднем дороже латиницы)"""
+    return len(text) // 3 + 1
+
+
+def _lines_tokens(lines):
+    return estimate_tokens('\n'.join(lines))
+
+
+def _weight(node):
+    """Насколько узел «горячий»: собственное время, а без ANALYZE — собственная стоимость"""
+    return node.self_time if node.analyzed else node.self_cost
+
+
+def _subtree(node):
+    return [n for _, n in node.iter_nodes()]
+
+
+def _hidden_line(depth, nodes, analyzed):
+    """Одна строка вместо скрытых поддеревьев: сколько узлов каких типов и сколько времени"""
+    indent, prefix = text_indent(depth)
+    counts = collections.Counter(node.node_type for node in nodes)
+    kinds = ", ".join(f"{kind} x{count}" if count > 1 else kind for kind, count in counts.most_common())
+    line = f"{indent}{prefix}... скрыто узлов: {len(nodes)} ({kinds})"
+    if analyzed:
+        line += f", собственное время {format_ms(sum(node.self_time or 0 for node in nodes))}"
+    return line
+
+
+def _render(node, keep, depth, details):
+    lines = node.node_lines(depth, verbose=False, details=details)
+    hidden = []
+    for child in node.children:
+        if child in keep:
+            if hidden:
+                lines.append(_hidden_line(depth + 1, hidden, node.analyzed))
+                hidden = []
+            lines.extend(_render(child, keep, depth + 1, details))
+        else:
+            hidden.extend(_subtree(child))
+    if hidden:
+        lines.append(_hidden_line(depth + 1, hidden, node.analyzed))
+    return lines
+
+
+def _with_footer(plan, lines):
+    if plan.planning_time is not None:
+        lines.append(f"Planning Time: {plan.planning_time:.3f} ms")
+    if plan.execution_time is not None:
+        lines.append(f"Execution Time: {plan.execution_time:.3f} ms")
+    return lines
+
+
+def summarize_plan(plan, max_tokens):
+    """Текст плана, уложенный в бюджет токенов, и описание того, что из него убрано.
+
+    Списки Output убираются всегда. Если план всё равно не помещается, оставляются
+    самые горячие по собственному времени узлы вместе с путём до корня, а остальные
+    поддеревья (и все узлы легче TRIVIAL_SHARE) сворачиваются в строку
+    «скрыто узлов: N (типы)». В крайнем случае убираются и детали узлов.
+    """
+    nodes = _subtree(plan.root)
+    elided = {}
+    output_lists = sum(1 for node in nodes if "Output" in node.details)
+    if output_lists:
+        elided["output_lists"] = output_lists
+
+    lines = _with_footer(plan, plan.text_lines(verbose=False))
+    if _lines_tokens(lines) <= max_tokens:
+        return lines, elided
+
+    parents = {}
+    for node in nodes:
+        for child in node.children:
+            parents[child] = node
+
+    details = _lines_tokens(_with_footer(plan, _render(plan.root, {plan.root}, 0, True))) <= max_tokens
+    keep = {plan.root}
+    threshold = sum(_weight(node) or 0 for node in nodes) * TRIVIAL_SHARE
+    for node in sorted(nodes, key=_weight, reverse=True):
+        if (_weight(node) or 0) < threshold:
+            break
+        path = []
+        while node is not None and node not in keep:
+            path.append(node)
+            node = parents.get(node)
+        if not path:
+            continue
+        candidate = keep.union(path)
+        if _lines_tokens(_with_footer(plan, _render(plan.root, candidate, 0, details))) > max_tokens:
+            break
+        keep = candidate
+
+    hidden = [node for node in nodes if node not in keep]
+    if hidden:
+        elided["nodes"] = len(hidden)
+        if plan.analyzed:
+            elided["self_time_ms"] = round(sum(node.self_time or 0 for node in hidden), 3)
+    if not details:
+        elided["node_details"] = True
+    elided["original_lines"] = len(lines)
+    return _with_footer(plan, _render(plan.root, keep, 0, details)), elided
+
+
+def summarize_text(lines, max_tokens):
+    """То же для плана, у которого есть только текстовый EXPLAIN: без Output и с обрезкой хвоста"""
+    elided = {}
+    kept = [line for line in lines if not line.lstrip().startswith("Output:")]
+    if len(kept) < len(lines):
+        elided["output_lists"] = len(lines) - len(kept)
+    if _lines_tokens(kept) <= max_tokens:
+        return kept, elided
+
+    total = len(kept)
+    while kept and _lines_tokens(kept + [f"... скрыто строк: {total - len(kept)}"]) > max_tokens:
+        kept.pop()
+    elided["lines"] = total - len(kept)
+    return kept + [f"... скрыто строк: {total - len(kept)}"], elided
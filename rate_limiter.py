@@ -0,0 +1,57 @@
+import time
+import asyncio
+import threading
+
+
+class AsyncTokenBucket:
+    """Ограничитель частоты запросов «ведро токенов» для asyncio.
+
+    rate — токенов в секунду, capacity — допустимый всплеск.
+    pause() задерживает всех ожидающих, например по заголовку Retry-After.
+    acquire_sync() — блокирующий вариант acquire() для кода без цикла событий.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = None
+        self._sync_lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        if self._lock is None:
+            # Lock создаём внутри работающего цикла событий
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def acquire_sync(self):
+        with self._sync_lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    time.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                time.sleep((1 - self._tokens) / self.rate)
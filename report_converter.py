@@ -2,18 +2,20 @@
 # -*- coding: utf-8 -*-
 
 import json
-import sys
+import argparse
 from html import escape
 
-def load_json(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+from artifacts import read_records
+from baseline import describe
+from instrumentation import metrics, load_summary
 
 def flatten_record(item):
     """Превращает один объект JSON в плоский словарь"""
     flat = {}
     flat["query"] = item.get("query", "")
     flat["file_path"] = item.get("file_path", "")
+    # --since: результат неизменённого запроса взят из прошлого запуска
+    flat["carried_over"] = "перенесён" if item.get("carried_over") else ""
 
     analysis = item.get("analysis", {})
     flat["evaluation"] = analysis.get("evaluation", "")
@@ -25,39 +27,66 @@ def flatten_record(item):
 
     flat["issues"] = "; ".join(issues) if isinstance(issues, list) else str(issues)
     flat["recommendations"] = "; ".join(recs) if isinstance(recs, list) else str(recs)
+    flat["baseline"] = describe(item["baseline"]) if item.get("baseline") else ""
 
     return flat
 
+# Столбцы отчёта в порядке вывода (ключи flatten_record)
+COLUMNS = ("query", "file_path", "carried_over", "evaluation", "severity", "execution_time", "baseline",
+           "issues", "recommendations")
+
+EVALUATION_CLASSES = {
+    "GOOD": "row-good",
+    "ACCEPTABLE": "row-acceptable",
+    "NEEDS_IMPROVEMENT": "row-needs",
+    "CRITICAL": "row-critical"
+}
+
+# Высота строки таблицы в пикселях: при виртуальной прокрутке она должна быть фиксированной
+ROW_HEIGHT = 66
+
 def evaluation_class(value):
     """Возвращает CSS-класс по значению evaluation"""
-    mapping = {
-        "GOOD": "row-good",
-        "ACCEPTABLE": "row-acceptable",
-        "NEEDS_IMPROVEMENT": "row-needs",
-        "CRITICAL": "row-critical"
-    }
-    return mapping.get(value.upper(), "")
+    return EVALUATION_CLASSES.get(value.upper(), "")
+
+def script_json(value):
+    """Компактный JSON, безопасный внутри <script>"""
+    text = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    return text.replace("</", "<\\/").replace("\u2028", "\\u2028").replace("\u2029", "\\u2029")
 
-def generate_table_html(data):
-    keys = []
-    seen = set()
-    for item in data:
-        for k in item.keys():
-            if k not in seen:
-                seen.add(k)
-                keys.append(k)
+def generate_metrics_html(summary):
+    """Сводка метрик запуска: спаны по убыванию суммарного времени (горячие пути сверху) и счётчики"""
+    html = ['<details class="run-metrics">']
+    html.append(f'<summary>Метрики запуска: {summary["wall_s"]:.1f} с</summary>')
+    html.append('<table><thead><tr><th>span</th><th>count</th><th>total, s</th><th>% времени</th>'
+                '<th>p50, ms</th><th>p95, ms</th><th>max, ms</th></tr></thead><tbody>')
+    spans = sorted(summary["spans"].items(), key=lambda item: item[1]["total_s"], reverse=True)
+    for name, span in spans:
+        share = span["total_s"] / summary["wall_s"] * 100 if summary["wall_s"] else 0
+        html.append(f'<tr><td>{escape(name)}</td><td>{span["count"]}</td><td>{span["total_s"]:.3f}</td>'
+                    f'<td>{share:.1f}</td><td>{span["p50_s"] * 1000:.1f}</td><td>{span["p95_s"] * 1000:.1f}</td>'
+                    f'<td>{span["max_s"] * 1000:.1f}</td></tr>')
+    html.append('</tbody></table>')
+    if summary["counters"]:
+        counters = ", ".join(f"{escape(name)}={value}" for name, value in summary["counters"].items())
+        html.append(f'<p class="counters">{counters}</p>')
+    html.append('</details>')
+    return "\n".join(html)
 
+def generate_table_html(run_metrics=None):
+    """Каркас страницы: заголовок, фильтр, легенда и пустая таблица — строки рисует скрипт"""
     html = []
     html.append('<div class="container">')
-    
+
     # flex-контейнер для заголовка + фильтра + легенды
     html.append('<div class="header-row">')
-    
+
     # Левая часть: заголовок + фильтр
     html.append('<div class="header-left">')
     html.append('<h1>Отчёт по SQL-запросам</h1>')
     html.append('<div class="controls">')
     html.append('<input id="filter" placeholder="Фильтр (по любому полю)..." oninput="filterTable()" />')
+    html.append('<span id="counter"></span>')
     html.append('</div>')  # .controls
     html.append('</div>')  # .header-left
 
@@ -71,35 +100,23 @@ def generate_table_html(data):
 
     html.append('</div>')  # .header-row
 
-    # Таблица
+    # Таблица: видимые строки рисуются при прокрутке, клик по заголовку — сортировка
     html.append('<div class="table-wrapper">')
     html.append('<table id="jsonTable">')
     html.append('<thead><tr>')
-    for k in keys:
-        html.append(f"<th class='{k}'>{escape(str(k))}</th>")
-    html.append('</tr></thead><tbody>')
-
-    for item in data:
-        row_class = evaluation_class(item.get("evaluation", ""))
-        html.append(f'<tr class="{row_class}">')
-        for k in keys:
-            v = item.get(k, "")
-            if isinstance(v, (dict, list)):
-                text = json.dumps(v, ensure_ascii=False, indent=2)
-            else:
-                text = str(v)
-            text = escape(text)
-
-            if len(text) > 200 or "\n" in text:
-                cell = f'<div class="cell collapsed"><pre>{text}</pre><button class="toggle">Показать ещё</button></div>'
-            else:
-                cell = f"<div class='cell'><pre>{text}</pre></div>"
-            html.append(f"<td class='{k}'>{cell}</td>")
-        html.append('</tr>')
-    html.append('</tbody></table></div></div>')  # .table-wrapper и .container
+    for k in COLUMNS:
+        html.append(f"<th class='{k}' data-column='{k}'>{escape(k)}</th>")
+    html.append('</tr></thead><tbody></tbody>')
+    html.append('</table></div>')  # .table-wrapper
+
+    # Полный текст выбранной строки
+    html.append('<div id="details" hidden></div>')
+    if run_metrics:
+        html.append(generate_metrics_html(run_metrics))
+    html.append('</div>')  # .container
     return "\n".join(html)
 
-def generate_full_html(body_html):
+def generate_full_html(body_html, data_html=""):
     css = """
     body { font-family: Inter, Arial, sans-serif; margin: 18px; background: #f7f8fb; color:#111; }
     .row-good { background: #eaf7ea; }
@@ -111,22 +128,37 @@ def generate_full_html(body_html):
     .header-left { display: flex; flex-direction: column; }
     .controls { margin-top: 6px; }
     input { padding:6px 10px; border-radius:6px; border:1px solid #ccc; min-width:220px; }
-    .table-wrapper { max-height:600px; overflow-y:auto; border:1px solid #eee; border-radius:6px; }
+    #counter { margin-left: 10px; font-size: 12px; color: #666; }
+    .table-wrapper { height:600px; overflow-y:auto; border:1px solid #eee; border-radius:6px; }
     table { border-collapse:collapse; width:100%; font-size:14px; table-layout: fixed; }
     th, td { padding:6px 8px; border-bottom:1px solid #eee; vertical-align:top; word-wrap: break-word; }
-    th { background:#fafafa; position:sticky; top:0; }
+    th { background:#fafafa; position:sticky; top:0; cursor:pointer; user-select:none; }
+    th.sorted-asc::after { content: " ▲"; }
+    th.sorted-desc::after { content: " ▼"; }
+    tr.row { height: ROW_HEIGHTpx; cursor: pointer; }
+    tr.row:hover { outline: 1px solid #bbb; }
+    tr.spacer td { padding: 0; border: 0; }
+    .cell { max-height: calc(ROW_HEIGHTpx - 13px); line-height: 1.25; overflow: hidden; white-space: pre-wrap; word-break: break-word; }
     pre { margin:0; white-space:pre-wrap; word-break:break-word; }
-    .cell.collapsed pre { max-height:3.6em; overflow:hidden; }
-    .cell button.toggle { margin-top:4px; font-size:12px; background:#f0f0f0; border:1px solid #ccc; border-radius:4px; padding:2px 6px; cursor:pointer; }
+    #details { margin-top: 12px; border: 1px solid #ddd; border-radius: 6px; padding: 10px 12px; background: #fcfcfc; }
+    #details h3 { margin: 8px 0 4px; font-size: 13px; color: #555; }
+    .run-metrics { margin-top: 12px; font-size: 13px; }
+    .run-metrics summary { cursor: pointer; color: #555; }
+    .run-metrics th, .run-metrics td { text-align: right; }
+    .run-metrics th:first-child, .run-metrics td:first-child { text-align: left; width: 30%; }
+    .run-metrics .counters { color: #555; word-break: break-word; }
 
     /* Ширина столбцов и центрирование */
-    #jsonTable th.query, #jsonTable td.query { width: 20%; }
+    #jsonTable th.query, #jsonTable td.query { width: 17%; }
     #jsonTable th.file_path, #jsonTable td.file_path { width: 10%; text-align: center;}
+    #jsonTable th.carried_over, #jsonTable td.carried_over { width: 6%; text-align: center; color: #777; }
     #jsonTable th.evaluation, #jsonTable td.evaluation { width: 7%; text-align: center;}
     #jsonTable th.severity, #jsonTable td.severity { width: 7%; text-align: center;}
     #jsonTable th.execution_time, #jsonTable td.execution_time { width: 7%; text-align: center;}
-    #jsonTable th.issues, #jsonTable td.issues { width: 23%; }
-    #jsonTable th.recommendations, #jsonTable td.recommendations { width: 26%; }
+    #jsonTable th.baseline, #jsonTable td.baseline { width: 12%; }
+    #jsonTable th.issues, #jsonTable td.issues { width: 17%; }
+    #jsonTable th.recommendations, #jsonTable td.recommendations { width: 17%; }
+    td.baseline .cell.regression { color: #b00020; font-weight: 600; }
 
     /* Легенда */
     .legend { background: #fff; border: 1px solid #ccc; border-radius: 8px; padding: 8px 12px; font-size: 12px; line-height: 1.4; max-width: 300px; }
@@ -135,28 +167,125 @@ def generate_full_html(body_html):
     .legend .ACCEPTABLE { background: #eaf2f7; }
     .legend .NEEDS_IMPROVEMENT { background: #fff9e6; }
     .legend .CRITICAL { background: #fceaea; }
-    """
+    """.replace("ROW_HEIGHT", str(ROW_HEIGHT))
     js = """
-    function filterTable(){
-      const q=document.getElementById('filter').value.toLowerCase();
-      const rows=document.querySelectorAll('#jsonTable tbody tr');
-      rows.forEach(r=>{
-        r.style.display = r.innerText.toLowerCase().includes(q) ? '' : 'none';
+    const COLUMNS = COLUMNS_JSON;
+    const ROW_CLASSES = ROW_CLASSES_JSON;
+    // Цвет строки — по оценке; индекс не зашит, чтобы не сбиваться при добавлении столбцов
+    const EVAL_INDEX = COLUMNS.indexOf('evaluation');
+    const ROW_HEIGHT = ROW_HEIGHT_VALUE;
+    const OVERSCAN = 10;
+    const RANKS = {
+      evaluation: {GOOD: 0, ACCEPTABLE: 1, NEEDS_IMPROVEMENT: 2, CRITICAL: 3},
+      severity: {LOW: 0, MEDIUM: 1, HIGH: 2, CRITICAL: 3}
+    };
+
+    // Данные встроены один раз: массив строк, каждая — массив значений в порядке COLUMNS
+    const rows = JSON.parse(document.getElementById('report-data').textContent);
+    // Поисковый индекс строится один раз, а не обходом DOM на каждое нажатие
+    const search = rows.map(r => r.join('\\u0001').toLowerCase());
+    let view = rows.map((_, i) => i);
+    let sortColumn = -1, sortDirection = 1;
+
+    const wrapper = document.querySelector('.table-wrapper');
+    const tbody = document.querySelector('#jsonTable tbody');
+    const counter = document.getElementById('counter');
+    const details = document.getElementById('details');
+
+    function esc(s) {
+      return String(s).replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c]));
+    }
+
+    function spacer(height) {
+      return `<tr class="spacer"><td colspan="${COLUMNS.length}" style="height:${height}px"></td></tr>`;
+    }
+
+    // Рисуем только строки в видимой области (плюс запас), остальное заменяют распорки
+    function render() {
+      const first = Math.max(0, Math.floor(wrapper.scrollTop / ROW_HEIGHT) - OVERSCAN);
+      const last = Math.min(view.length, Math.ceil((wrapper.scrollTop + wrapper.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+      const html = [spacer(first * ROW_HEIGHT)];
+      for (let i = first; i < last; i++) {
+        const index = view[i], row = rows[index];
+        const cls = ROW_CLASSES[String(row[EVAL_INDEX]).toUpperCase()] || '';
+        html.push(`<tr class="row ${cls}" data-index="${index}">`);
+        row.forEach((value, c) => {
+          const mark = COLUMNS[c] === 'baseline' && String(value).includes('РЕГРЕССИЯ') ? ' regression' : '';
+          html.push(`<td class="${COLUMNS[c]}"><div class="cell${mark}">${esc(value)}</div></td>`);
+        });
+        html.push('</tr>');
+      }
+      html.push(spacer((view.length - last) * ROW_HEIGHT));
+      tbody.innerHTML = html.join('');
+      counter.textContent = view.length === rows.length ? `Запросов: ${rows.length}` : `Показано ${view.length} из ${rows.length}`;
+    }
+
+    let scheduled = false;
+    wrapper.addEventListener('scroll', () => {
+      if (!scheduled) {
+        scheduled = true;
+        requestAnimationFrame(() => { scheduled = false; render(); });
+      }
+    });
+
+    function sortKey(column, value) {
+      if (RANKS[column]) return RANKS[column][String(value).toUpperCase()] ?? -1;
+      if (column === 'execution_time' || column === 'baseline') {
+        // Для baseline первое число — изменение в процентах со знаком
+        const m = String(value).match(/[-+]?[\\d.]+/);
+        return m ? parseFloat(m[0]) : -Infinity;
+      }
+      return String(value).toLowerCase();
+    }
+
+    function applySort() {
+      if (sortColumn < 0) return;
+      const column = COLUMNS[sortColumn];
+      const keys = new Map(view.map(i => [i, sortKey(column, rows[i][sortColumn])]));
+      view.sort((a, b) => {
+        const ka = keys.get(a), kb = keys.get(b);
+        return (ka < kb ? -1 : ka > kb ? 1 : a - b) * sortDirection;
       });
     }
-    document.addEventListener('click', e=>{
-      if(e.target.classList.contains('toggle')){
-        const cell=e.target.closest('.cell');
-        if(cell.classList.contains('collapsed')){
-          cell.classList.remove('collapsed');
-          e.target.textContent='Свернуть';
-        } else {
-          cell.classList.add('collapsed');
-          e.target.textContent='Показать ещё';
+
+    let filterTimer = null;
+    function filterTable() {
+      clearTimeout(filterTimer);
+      filterTimer = setTimeout(() => {
+        const q = document.getElementById('filter').value.toLowerCase();
+        view = [];
+        for (let i = 0; i < rows.length; i++) {
+          if (!q || search[i].includes(q)) view.push(i);
         }
-      }
+        applySort();
+        wrapper.scrollTop = 0;
+        render();
+      }, 150);
+    }
+
+    document.querySelectorAll('#jsonTable th').forEach((th, c) => {
+      th.addEventListener('click', () => {
+        sortDirection = sortColumn === c ? -sortDirection : 1;
+        sortColumn = c;
+        document.querySelectorAll('#jsonTable th').forEach(h => h.classList.remove('sorted-asc', 'sorted-desc'));
+        th.classList.add(sortDirection > 0 ? 'sorted-asc' : 'sorted-desc');
+        applySort();
+        render();
+      });
     });
-    """
+
+    tbody.addEventListener('click', e => {
+      const tr = e.target.closest('tr.row');
+      if (!tr) return;
+      const row = rows[Number(tr.dataset.index)];
+      details.innerHTML = COLUMNS.map((c, i) => `<h3>${esc(c)}</h3><pre>${esc(row[i])}</pre>`).join('');
+      details.hidden = false;
+    });
+
+    render();
+    """.replace("COLUMNS_JSON", script_json(COLUMNS)) \
+       .replace("ROW_CLASSES_JSON", script_json(EVALUATION_CLASSES)) \
+       .replace("ROW_HEIGHT_VALUE", str(ROW_HEIGHT))
     return f"""<!doctype html>
 <html lang="ru">
 <head>
@@ -166,29 +295,41 @@ def generate_full_html(body_html):
 </head>
 <body>
 {body_html}
+{data_html}
 <script>{js}</script>
 </body>
 </html>"""
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python report_converter.py input.json output.html")
-        sys.exit(1)
-
-    INPUT = sys.argv[1]
-    OUTPUT = sys.argv[2]
+def write_html_report(records, output, run_metrics=None):
+    """Пишет отчёт потоково: данные встраиваются одним компактным JSON-массивом по строке за раз.
 
-    data = load_json(INPUT)
+    run_metrics — сводка Instrumentation.summary(): выводится под таблицей.
+    """
+    placeholder = "<!--report-data-->"
+    head, tail = generate_full_html(generate_table_html(run_metrics), placeholder).split(placeholder)
 
-    if isinstance(data, list):
-        flat_data = [flatten_record(item) for item in data]
-    else:
-        flat_data = [flatten_record(data)]
+    count = 0
+    with metrics.span("report.html") as span, open(output, "w", encoding="utf-8") as f:
+        f.write(head)
+        f.write('<script id="report-data" type="application/json">[')
+        for item in records:
+            flat = flatten_record(item)
+            f.write("," if count else "")
+            f.write(script_json([flat[k] for k in COLUMNS]))
+            count += 1
+        f.write(']</script>')
+        f.write(tail)
+        span["rows"] = count
+    return count
 
-    body = generate_table_html(flat_data)
-    full_html = generate_full_html(body)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='HTML-отчёт по результатам анализа')
+    parser.add_argument('input', help='Отчёт LLM (.json или .jsonl)')
+    parser.add_argument('output', help='HTML-файл')
+    parser.add_argument('--trace', action='append', default=[],
+                        help='JSON-трасса стадии для сводки метрик (можно повторять)')
+    args = parser.parse_args()
 
-    with open(OUTPUT, "w", encoding="utf-8") as f:
-        f.write(full_html)
+    write_html_report(read_records(args.input), args.output, load_summary(args.trace) if args.trace else None)
 
-    print(f"✅ Отчёт сохранён в {OUTPUT}")
+    print(f"✅ Отчёт сохранён в {args.output}")
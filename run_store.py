@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+import json
+import sqlite3
+import argparse
+import threading
+
+from artifacts import write_records
+
+# Стадии в порядке конвейера; статус запроса — последняя пройденная стадия
+STAGES = ("parsed", "explained", "analyzed")
+_STATUS_RANK = "CASE status " + " ".join(f"WHEN '{stage}' THEN {i}" for i, stage in enumerate(STAGES)) + " END"
+
+
+class RunStore:
+    """База одного запуска конвейера: результат каждой стадии по query_id.
+
+    Записи сохраняются сразу после стадии, поэтому после падения (--resume)
+    дорогие EXPLAIN и вызовы LLM для уже обработанных запросов не повторяются.
+    Артефакты .json/.jsonl — выгрузки из этой базы (export).
+    Потокобезопасен: стадии конвейера пишут из своих потоков.
+    """
+
+    def __init__(self, path, resume=False):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS queries (
+                query_id INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,
+                parsed TEXT NOT NULL,
+                explained TEXT,
+                analyzed TEXT
+            )
+        """)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if not resume:
+            self.conn.execute("DELETE FROM queries")
+            self.conn.execute("DELETE FROM meta")
+        self.conn.commit()
+        self.restored = {stage: 0 for stage in STAGES}
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+            self.conn.commit()
+
+    def is_complete(self, stage):
+        return self.get_meta(f"{stage}_complete") == "1"
+
+    def save(self, stage, record):
+        """Сохраняет результат стадии для record["query_id"] и сразу фиксирует транзакцию"""
+        value = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            if stage == "parsed":
+                # Если запрос под этим id изменился, его дальнейшие стадии недействительны
+                self.conn.execute("""
+                    INSERT INTO queries (query_id, status, parsed) VALUES (?, 'parsed', ?)
+                    ON CONFLICT (query_id) DO UPDATE
+                    SET parsed = excluded.parsed, status = 'parsed', explained = NULL, analyzed = NULL
+                    WHERE queries.parsed <> excluded.parsed
+                """, (record["query_id"], value))
+            else:
+                # Статус только продвигается вперёд: результаты стадий могут сохраняться не по порядку
+                self.conn.execute(f"""
+                    UPDATE queries SET {stage} = ?,
+                        status = CASE WHEN {_STATUS_RANK} < ? THEN ? ELSE status END
+                    WHERE query_id = ?
+                """, (value, STAGES.index(stage), stage, record["query_id"]))
+            self.conn.commit()
+
+    def get(self, stage, query_id):
+        with self._lock:
+            row = self.conn.execute(f"SELECT {stage} FROM queries WHERE query_id = ?", (query_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def stored(self, stage, accept=None):
+        """Функция record -> сохранённый результат стадии (или None) для подстановки в стадию.
+
+        accept(value) отбрасывает результаты, которые стоит пересчитать (например, ошибки API).
+        """
+        def lookup(record):
+            if "query_id" not in record:
+                return None
+            value = self.get(stage, record["query_id"])
+            if value is None or (accept is not None and not accept(value)):
+                return None
+            self.restored[stage] += 1
+            return value
+        return lookup
+
+    def record_stage(self, stage, records):
+        """Пропускает записи дальше по конвейеру, сохраняя каждую; в конце отмечает стадию завершённой"""
+        count = 0
+        for record in records:
+            self.save(stage, record)
+            count += 1
+            yield record
+        if stage == "parsed":
+            # Запросы, исчезнувшие при повторном разборе, больше не относятся к запуску
+            with self._lock:
+                self.conn.execute("DELETE FROM queries WHERE query_id >= ?", (count,))
+                self.conn.commit()
+        self.set_meta(f"{stage}_complete", "1")
+
+    def records(self, stage, page_size=500):
+        """Результаты стадии в порядке query_id; читаются страницами, чтобы не держать курсор между записями"""
+        last_id = -1
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    f"SELECT query_id, {stage} FROM queries WHERE {stage} IS NOT NULL AND query_id > ? "
+                    f"ORDER BY query_id LIMIT ?", (last_id, page_size)
+                ).fetchall()
+            if not rows:
+                return
+            for last_id, value in rows:
+                yield json.loads(value)
+
+    def progress(self):
+        """Сколько запросов в каждом статусе"""
+        counts = dict(self.conn.execute("SELECT status, COUNT(*) FROM queries GROUP BY status").fetchall())
+        return {stage: counts.get(stage, 0) for stage in STAGES}
+
+    def export(self, stage, path):
+        """Выгружает результаты стадии в .json/.jsonl артефакт, возвращает число записей"""
+        return write_records(self.records(stage), path)
+
+    def close(self):
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Состояние и выгрузка базы запуска конвейера')
+    parser.add_argument('run_db', help='Файл базы запуска (SQLite)')
+    parser.add_argument('--export', choices=STAGES, help='Выгрузить результаты стадии')
+    parser.add_argument('-o', '--output', help='Файл выгрузки (.json или .jsonl)')
+    args = parser.parse_args()
+
+    store = RunStore(args.run_db, resume=True)
+    try:
+        progress = store.progress()
+        print("Run progress: " + ", ".join(f"{stage}={count}" for stage, count in progress.items()))
+        if args.export:
+            output = args.output or f"{args.export}.jsonl"
+            count = store.export(args.export, output)
+            print(f"Exported {count} {args.export} records to {output}")
+    finally:
+        store.close()
@@ -1,45 +1,155 @@
 import os
+import time
 import sqlparse
-import json
-import sys
+import argparse
+import codecs
+import hashlib
+import multiprocessing
 from sqlparse.tokens import Comment, Whitespace
 
+from artifacts import write_records
+from parse_cache import ParseCache
+from sql_lexer import split_statements, classify_query
+from fingerprint import fingerprint
+from instrumentation import metrics
 
-def parse_sql_files(directory):
-    queries = []
+# Версия логики разбора: при её изменении кэш разбора сбрасывается
+PARSER_VERSION = 5
+PARSE_CACHE_VERSION = f"{PARSER_VERSION}:{sqlparse.__version__}"
+
+# Сколько байт читаем для определения кодировки
+ENCODING_SAMPLE_SIZE = 64 * 1024
+FALLBACK_ENCODINGS = ('utf-8', 'cp1251', 'latin-1')
+
+
+def iter_sql_files(directory):
+    """Обходит каталог и отдаёт пути ко всем .sql файлам"""
+    if os.path.isfile(directory):
+        yield directory
+        return
     for root, _, files in os.walk(directory):
         for file in files:
             if file.endswith('.sql'):
-                filepath = os.path.join(root, file)
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        sql = f.read()
-                except UnicodeDecodeError:
-                    try:
-                        with open(filepath, 'r', encoding='cp1251') as f:
-                            sql = f.read()
-                    except UnicodeDecodeError:
-                        with open(filepath, 'r', encoding='latin-1') as f:
-                            sql = f.read()
-
-                statements = sqlparse.parse(sql)
-                for stmt in statements:
-                    # Получаем чистый текст запроса без комментариев
-                    clean_query = get_clean_query(stmt)
-
-                    # Проверяем, что это не пустая строка и не только комментарий
-                    if clean_query and not clean_query.isspace():
-                        # Определяем тип запроса
-                        stmt_type = get_query_type(stmt)
-
-                        queries.append({
-                            "query": clean_query,
-                            "type": stmt_type,
-                            "file_path": filepath
-                        })
+                yield os.path.join(root, file)
+
+
+def detect_encoding(sample):
+    """Определяет кодировку по первым байтам файла"""
+    for encoding in FALLBACK_ENCODINGS[:-1]:
+        try:
+            # final=False: многобайтовый символ мог оборваться на границе выборки
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return FALLBACK_ENCODINGS[-1]
+
+
+def decode_sql(raw):
+    """Декодирует содержимое файла в кодировке, определённой по выборке"""
+    encoding = detect_encoding(raw[:ENCODING_SAMPLE_SIZE])
+    candidates = FALLBACK_ENCODINGS[FALLBACK_ENCODINGS.index(encoding):]
+    for candidate in candidates:
+        try:
+            return raw.decode(candidate)
+        except UnicodeDecodeError:
+            # Выборка оказалась обманчивой — пробуем следующую кодировку уже из памяти
+            continue
+    return raw.decode(FALLBACK_ENCODINGS[-1], errors='replace')
+
+
+def parse_sql(sql, filepath):
+    """Разбирает текст SQL в список записей о запросах"""
+    # Быстрый путь: линейный лексер без построения дерева sqlparse
+    statements = split_statements(sql)
+    if statements is None:
+        # Неоднозначный ввод — полный разбор sqlparse
+        statements = [(get_clean_query(stmt), get_query_type(stmt)) for stmt in sqlparse.parse(sql)]
+
+    queries = []
+    for clean_query, stmt_type in statements:
+        # Проверяем, что это не пустая строка и не только комментарий
+        if clean_query and not clean_query.isspace():
+            queries.append({
+                "query": clean_query,
+                "type": stmt_type,
+                "fingerprint": fingerprint(clean_query),
+                "file_path": filepath
+            })
     return queries
 
 
+def parse_file_task(task):
+    """Задача для пула: разбирает файл, только если его содержимое изменилось.
+
+    Возвращает и длительность: в процессе пула спан записать некуда, его записывает родитель.
+    """
+    started = time.perf_counter()
+    filepath, mtime, size, cached_hash, unchanged = task
+    if unchanged:
+        # mtime и size совпали с кэшем — файл даже не читаем
+        return task, cached_hash, None, time.perf_counter() - started
+
+    with open(filepath, 'rb') as f:
+        raw = f.read()
+    content_hash = hashlib.sha256(raw).hexdigest()
+    if content_hash == cached_hash:
+        return task, content_hash, None, time.perf_counter() - started
+    return task, content_hash, parse_sql(decode_sql(raw), filepath), time.perf_counter() - started
+
+
+def iter_parse_tasks(directory, cache):
+    for filepath in iter_sql_files(directory):
+        st = os.stat(filepath)
+        entry = cache.lookup(filepath) if cache else None
+        if entry is None:
+            yield filepath, st.st_mtime, st.st_size, None, False
+        else:
+            cached_mtime, cached_size, cached_hash = entry
+            unchanged = cached_mtime == st.st_mtime and cached_size == st.st_size
+            yield filepath, st.st_mtime, st.st_size, cached_hash, unchanged
+
+
+def iter_parsed_queries(directory, workers=1, chunksize=16, cache=None):
+    """Отдаёт записи о запросах по мере разбора; при workers > 1 файлы делятся между процессами.
+
+    Если передан cache, неизменившиеся файлы берутся из кэша без вызова sqlparse,
+    а после полного обхода из кэша удаляются записи об исчезнувших файлах под directory.
+    """
+    if workers == 0:
+        workers = os.cpu_count() or 1
+
+    tasks = iter_parse_tasks(directory, cache)
+    if workers <= 1:
+        results = map(parse_file_task, tasks)
+        yield from _collect_parsed(results, cache)
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            # imap сохраняет порядок обхода, но не ждёт разбора всех файлов
+            yield from _collect_parsed(pool.imap(parse_file_task, tasks, chunksize), cache)
+
+    if cache:
+        cache.evict_missing(directory)
+
+
+def _collect_parsed(results, cache):
+    for task, content_hash, queries, duration in results:
+        filepath, mtime, size, _, _ = task
+        metrics.record("parse.file", duration, file=filepath, cached=queries is None)
+        if queries is None:
+            metrics.count("parse.cache_hits")
+            queries = cache.get_queries(filepath, mtime, size)
+        elif cache is not None:
+            cache.store(filepath, mtime, size, content_hash, queries)
+        metrics.count("parse.files")
+        metrics.count("parse.queries", len(queries))
+        yield from queries
+
+
+def parse_sql_files(directory, workers=1, cache=None):
+    return list(iter_parsed_queries(directory, workers, cache=cache))
+
+
 def get_clean_query(statement):
     """Возвращает SQL-запрос без комментариев"""
     clean_tokens = []
@@ -61,44 +171,36 @@ def get_query_type(statement):
                 token.value.strip() and
                 token.value.upper() in ['SELECT', 'INSERT', 'UPDATE', 'DELETE',
                                         'CREATE', 'DROP', 'ALTER', 'TRUNCATE', 'WITH',
-                                        'EXPLAIN', 'BEGIN', 'COMMIT', 'ROLLBACK']):
+                                        'EXPLAIN', 'BEGIN', 'COMMIT', 'ROLLBACK', 'MERGE']):
             return token.value.upper().strip()
 
-    # Если не нашли стандартное ключевое слово, анализируем содержимое
-    clean_query = get_clean_query(statement).upper()
-
-    # Проверяем различные паттерны SQL-запросов
-    if clean_query.startswith(('SELECT', 'WITH')):
-        return 'SELECT'
-    elif clean_query.startswith('INSERT'):
-        return 'INSERT'
-    elif clean_query.startswith('UPDATE'):
-        return 'UPDATE'
-    elif clean_query.startswith('DELETE'):
-        return 'DELETE'
-    elif clean_query.startswith('CREATE'):
-        return 'CREATE'
-    elif clean_query.startswith('DROP'):
-        return 'DROP'
-    elif clean_query.startswith('ALTER'):
-        return 'ALTER'
-    elif clean_query.startswith('TRUNCATE'):
-        return 'TRUNCATE'
-    elif clean_query.startswith(('BEGIN', 'START TRANSACTION')):
-        return 'BEGIN'
-    elif clean_query.startswith('COMMIT'):
-        return 'COMMIT'
-    elif clean_query.startswith('ROLLBACK'):
-        return 'ROLLBACK'
-
-    return 'UNKNOWN'
+    # Если не нашли стандартное ключевое слово, анализируем очищенный текст
+    return classify_query(get_clean_query(statement))
 
 
 if __name__ == "__main__":
-    project_dir = sys.argv[1] if len(sys.argv) > 1 else '.'
-    queries = parse_sql_files(project_dir)
-
-    with open('parsed_queries.json', 'w', encoding='utf-8') as f:
-        json.dump(queries, f, indent=2, ensure_ascii=False)
-
-    print(f"Found {len(queries)} SQL queries. Saved to parsed_queries.json")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Парсер SQL-файлов')
+    parser.add_argument('directory', nargs='?', default='.', help='Каталог (или файл) с .sql')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='Число процессов для разбора (0 — по числу ядер)')
+    parser.add_argument('-o', '--output', default='parsed_queries.json',
+                        help='Выходной файл: .json или .jsonl (записи пишутся по мере разбора)')
+    parser.add_argument('--cache', default='.sqlparse_cache.db',
+                        help='Файл кэша разбора (путь + хэш содержимого)')
+    parser.add_argument('--no-cache', action='store_true', help='Разбирать все файлы заново')
+    parser.add_argument('--trace', default=None, help='JSON-трасса спанов стадии')
+    parser.add_argument('--metrics', default=None, help='Textfile Prometheus с метриками стадии')
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else ParseCache(args.cache, PARSE_CACHE_VERSION)
+    try:
+        count = write_records(iter_parsed_queries(args.directory, args.workers, cache=cache), args.output)
+    finally:
+        if cache:
+            cache.close()
+
+    print(f"Found {count} SQL queries. Saved to {args.output}")
+    if cache:
+        stats = cache.stats()
+        print(f"Parse cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evicted']} evicted")
+    metrics.export(args.trace, args.metrics)
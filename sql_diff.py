@@ -0,0 +1,136 @@
+import os
+import subprocess
+
+from artifacts import read_records
+from sqlParse import parse_sql, decode_sql
+from instrumentation import metrics
+
+# Поля элемента отчёта, измеренные прошлым прогоном: перенесённому запросу они не принадлежат
+RUN_FIELDS = ("baseline", "plan_elided")
+CARRIED_EXECUTION_TIME = "not measured (carried over)"
+
+
+def _git(args, cwd):
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True).stdout
+
+
+class SqlDiff:
+    """Изменения .sql файлов относительно ревизии ref (обычно — базовой ветки).
+
+    Сравнение идёт с merge-base, как в pull request, и учитывает незакоммиченные и новые
+    файлы. Внутри изменённого файла запрос считается изменённым, если его отпечатка
+    нет среди отпечатков базовой версии файла: переносы и переформатирование не в счёт.
+    """
+
+    def __init__(self, ref, directory="."):
+        cwd = directory if os.path.isdir(directory) else os.path.dirname(directory) or "."
+        self.root = _git(["rev-parse", "--show-toplevel"], cwd).decode().strip()
+        self.base = _git(["merge-base", ref, "HEAD"], self.root).decode().strip()
+        # Путь файла -> путь его базовой версии в репозитории (None — файла не было)
+        self.changed = {}
+        tokens = _git(["diff", "--name-status", "-z", "-M", self.base], self.root).decode().split("\0")
+        i = 0
+        while i < len(tokens) and tokens[i]:
+            status = tokens[i][0]
+            if status in "RC":
+                old, new = tokens[i + 1], tokens[i + 2]
+                i += 3
+            else:
+                old = new = tokens[i + 1]
+                i += 2
+            if status != "D" and new.endswith(".sql"):
+                self.changed[self._key(new)] = None if status == "A" else old
+        untracked = _git(["ls-files", "--others", "--exclude-standard", "-z"], self.root).decode()
+        for path in untracked.split("\0"):
+            if path.endswith(".sql"):
+                self.changed[self._key(path)] = None
+        self._base_fingerprints = {}
+
+    def _key(self, path):
+        return os.path.realpath(os.path.join(self.root, path))
+
+    def base_fingerprints(self, filepath):
+        """Отпечатки запросов базовой версии изменённого файла"""
+        key = os.path.realpath(filepath)
+        if key not in self._base_fingerprints:
+            base_path = self.changed[key]
+            fingerprints = set()
+            if base_path is not None:
+                raw = _git(["show", f"{self.base}:{base_path}"], self.root)
+                fingerprints = {query["fingerprint"] for query in parse_sql(decode_sql(raw), base_path)}
+            self._base_fingerprints[key] = fingerprints
+        return self._base_fingerprints[key]
+
+    def is_changed(self, record):
+        """Новый или изменённый запрос; записи неизменённых файлов не трогают git"""
+        if os.path.realpath(record["file_path"]) not in self.changed:
+            return False
+        return record["fingerprint"] not in self.base_fingerprints(record["file_path"])
+
+
+def load_previous_report(path):
+    """Элементы отчёта прошлого запуска по отпечатку; фоллбэки после ошибок API не переносим"""
+    previous = {}
+    if not path or not os.path.exists(path):
+        return previous
+    for entry in read_records(path):
+        if entry.get("fingerprint") and entry["analysis"].get("source") != "fallback":
+            previous[entry["fingerprint"]] = entry
+    return previous
+
+
+def mark_carried_over(records, diff, previous):
+    """Помечает неизменённые запросы, для которых есть результат прошлого запуска"""
+    for record in records:
+        if record["fingerprint"] in previous and not diff.is_changed(record):
+            record = dict(record, carried_over=True)
+            metrics.count("diff.carried_over")
+        else:
+            metrics.count("diff.analyzed")
+        yield record
+
+
+def carried_explain(record):
+    """Заглушка вместо EXPLAIN для перенесённого запроса: план не снимается.
+
+    Плана нет и в прошлом отчёте, поэтому для таких запросов нет ни статистики таблиц
+    из каталога, ни сравнения с эталоном (--baseline).
+    """
+    if not record.get("carried_over"):
+        return None
+    result = {
+        "query": record["query"],
+        "type": record["type"],
+        "tables": [],
+        "explain_output": [],
+        "plan": None,
+        "execution_time_ms": None,
+        "planning_time_ms": None,
+        "estimated_only": False,
+        "time_budget_ms": None,
+        "file_path": record["file_path"],
+        "error": None,
+        "fingerprint": record["fingerprint"],
+        "carried_over": True,
+    }
+    if "query_id" in record:
+        result["query_id"] = record["query_id"]
+    return result
+
+
+def carried_analysis(previous):
+    """Функция item -> элемент отчёта прошлого запуска с текстом и путём текущего запроса.
+
+    Переносятся оценка и замечания; время выполнения, сравнение с эталоном и сокращения
+    плана относятся к прошлому прогону и в элемент не попадают.
+    """
+    def lookup(item):
+        if not item.get("carried_over"):
+            return None
+        entry = {key: value for key, value in previous[item["fingerprint"]].items() if key not in RUN_FIELDS}
+        entry.update(query=item["query"], file_path=item["file_path"], carried_over=True,
+                     analysis=dict(entry["analysis"], execution_time=CARRIED_EXECUTION_TIME))
+        if "query_id" in item:
+            entry["query_id"] = item["query_id"]
+        return entry
+    return lookup
@@ -0,0 +1,133 @@
+import re
+
+# Символы, с которых может начинаться что-то интересное для разбиения:
+# конец запроса, строки, идентификаторы в кавычках, dollar-quoting и комментарии
+_SPECIAL = re.compile(r"""[;'"$\-/]""")
+_STRING = re.compile(r"'[^']*(?:''[^']*)*'")
+_ESCAPE_STRING = re.compile(r"'[^'\\]*(?:(?:\\.|'')[^'\\]*)*'", re.DOTALL)
+_QUOTED_IDENT = re.compile(r'"[^"]*(?:""[^"]*)*"')
+_DOLLAR_TAG = re.compile(r'\$(?:[A-Za-z_][A-Za-z0-9_]*)?\$')
+_BLOCK_COMMENT_EDGE = re.compile(r'/\*|\*/')
+_IDENT_CHAR = re.compile(r'[A-Za-z0-9_$]')
+
+_FIRST_WORDS = re.compile(r'[\s(]*([A-Za-z]+)(?:\s+([A-Za-z]+))?')
+_ROUTINE = re.compile(r'\s*CREATE\s+(?:OR\s+REPLACE\s+)?(?:FUNCTION|PROCEDURE|TRIGGER)\b', re.IGNORECASE)
+_BEGIN = re.compile(r'\bBEGIN\b', re.IGNORECASE)
+
+QUERY_TYPES = {
+    'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'CREATE', 'DROP', 'ALTER',
+    'TRUNCATE', 'WITH', 'EXPLAIN', 'BEGIN', 'COMMIT', 'ROLLBACK', 'MERGE'
+}
+
+
+def classify_query(clean_query):
+    """Определяет тип запроса по первому ключевому слову очищенного текста"""
+    m = _FIRST_WORDS.match(clean_query)
+    if not m:
+        return 'UNKNOWN'
+    word = m.group(1).upper()
+    if word in QUERY_TYPES:
+        return word
+    if word == 'START' and (m.group(2) or '').upper() == 'TRANSACTION':
+        return 'BEGIN'
+    return 'UNKNOWN'
+
+
+def _is_escape_string(sql, quote_pos):
+    """E'...' — строка с backslash-экранированием"""
+    if quote_pos == 0 or sql[quote_pos - 1] not in 'eE':
+        return False
+    return quote_pos == 1 or not _IDENT_CHAR.match(sql[quote_pos - 2])
+
+
+def _block_comment_end(sql, start):
+    """Конец блочного комментария с учётом вложенности, как в PostgreSQL; -1 если не закрыт"""
+    depth = 0
+    for m in _BLOCK_COMMENT_EDGE.finditer(sql, start):
+        if m.group() == '/*':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return m.end()
+    return -1
+
+
+def split_statements(sql):
+    """Разбивает текст на запросы за один линейный проход.
+
+    Возвращает список пар (текст без комментариев, тип запроса) или None, если ввод
+    неоднозначен (незакрытая строка/комментарий, тело процедуры без dollar-quoting) —
+    тогда нужно использовать полный разбор sqlparse.
+    """
+    statements = []
+    pieces = []
+    seg_start = 0
+    pos = 0
+    dollar_quoted = False
+
+    def finish_statement(end):
+        nonlocal seg_start, dollar_quoted
+        pieces.append(sql[seg_start:end])
+        text = ''.join(pieces).strip()
+        pieces.clear()
+        seg_start = end
+        if text and text != ';':
+            if not dollar_quoted and _ROUTINE.match(text) and _BEGIN.search(text):
+                return False
+            statements.append((text, classify_query(text)))
+        dollar_quoted = False
+        return True
+
+    while True:
+        m = _SPECIAL.search(sql, pos)
+        if not m:
+            break
+        i = m.start()
+        c = sql[i]
+
+        if c == ';':
+            if not finish_statement(i + 1):
+                return None
+            pos = i + 1
+        elif c == "'":
+            pattern = _ESCAPE_STRING if _is_escape_string(sql, i) else _STRING
+            literal = pattern.match(sql, i)
+            if not literal:
+                return None
+            pos = literal.end()
+        elif c == '"':
+            ident = _QUOTED_IDENT.match(sql, i)
+            if not ident:
+                return None
+            pos = ident.end()
+        elif c == '$':
+            tag = _DOLLAR_TAG.match(sql, i)
+            if not tag or (i > 0 and _IDENT_CHAR.match(sql[i - 1])):
+                # $1, или $ внутри идентификатора
+                pos = i + 1
+                continue
+            end = sql.find(tag.group(), tag.end())
+            if end == -1:
+                return None
+            dollar_quoted = True
+            pos = end + len(tag.group())
+        elif sql.startswith('--', i):
+            # Перевод строки оставляем, чтобы не склеить соседние строки запроса
+            end = sql.find('\n', i)
+            end = len(sql) if end == -1 else end
+            pieces.append(sql[seg_start:i])
+            seg_start = pos = end
+        elif sql.startswith('/*', i):
+            end = _block_comment_end(sql, i)
+            if end == -1:
+                return None
+            pieces.append(sql[seg_start:i])
+            pieces.append(' ')
+            seg_start = pos = end
+        else:
+            pos = i + 1
+
+    if not finish_statement(len(sql)):
+        return None
+    return statements
@@ -0,0 +1,76 @@
+from baseline import BaselineStore, describe
+from fingerprint import fingerprint
+
+
+def _item(execution_ms, scan="Index Scan", query="SELECT * FROM t WHERE id = 1"):
+    node = {"Node Type": scan, "Relation Name": "t", "Alias": "t", "Startup Cost": 0.0, "Total Cost": 8.0,
+            "Plan Rows": 1, "Plan Width": 4, "Actual Startup Time": 0.0, "Actual Total Time": execution_ms,
+            "Actual Rows": 1, "Actual Loops": 1}
+    if scan == "Index Scan":
+        node["Index Name"] = "t_pkey"
+    return {"query": query, "type": "SELECT", "file_path": "q.sql", "fingerprint": fingerprint(query),
+            "error": None, "estimated_only": False, "execution_time_ms": execution_ms,
+            "plan": [{"Plan": node, "Execution Time": execution_ms}]}
+
+
+def _store(tmp_path, *samples):
+    store = BaselineStore(str(tmp_path / "baseline.db"), update=True)
+    for ms in samples:
+        # record() пишет отпечаток один раз за запуск — каждый замер как отдельная сборка
+        store._recorded.clear()
+        store.record(_item(ms))
+    return store
+
+
+def test_no_comparison_without_history_or_measurement(tmp_path):
+    store = BaselineStore(str(tmp_path / "baseline.db"))
+    assert store.compare(_item(10.0)) is None
+    store = _store(tmp_path, 10.0)
+    assert store.compare(dict(_item(10.0), estimated_only=True)) is None
+    assert store.compare(dict(_item(10.0), plan=None)) is None
+
+
+def test_regression_beyond_noise_threshold(tmp_path):
+    store = _store(tmp_path, 10.0, 10.2, 9.8)
+    comparison = store.compare(_item(10.5))
+    assert not comparison["regression"] and not comparison["improvement"]
+    assert comparison["samples"] == 3
+
+    comparison = store.compare(_item(50.0))
+    assert comparison["regression"]
+    assert comparison["baseline_ms"] == 10.0
+    assert "РЕГРЕССИЯ" in describe(comparison)
+
+
+def test_plan_flip_is_reported_and_resets_history(tmp_path):
+    store = _store(tmp_path, 10.0, 10.0)
+    comparison = store.compare(_item(10.0, scan="Seq Scan"))
+    assert comparison["plan_flips"] == ["t: Index Scan using t_pkey → Seq Scan"]
+    assert comparison["plan_changed"]
+
+    store._recorded.clear()
+    store.record(_item(30.0, scan="Seq Scan"))
+    # Старые замеры относились к другому плану
+    assert store.compare(_item(30.0, scan="Seq Scan"))["samples"] == 1
+
+
+def test_record_once_per_run(tmp_path):
+    store = BaselineStore(str(tmp_path / "baseline.db"), update=True)
+    store.record(_item(10.0))
+    store.record(_item(99.0))
+    assert store.compare(_item(10.0))["samples"] == 1
+
+
+def test_analyze_results_compares_before_recording(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test")
+    from LLM_aggregator import OpenRouterAnalyzer, analyze_results
+
+    store = _store(tmp_path, 0.2, 0.2, 0.2)
+    store._recorded.clear()
+    # Дольше 2s — оценка правилами, без обращения к LLM
+    slow = _item(2500.0)
+    entry = next(analyze_results([slow], OpenRouterAnalyzer(), baseline=store))
+    assert entry["baseline"]["samples"] == 3
+    assert entry["baseline"]["regression"]
+    # Новый замер всё же попал в историю
+    assert store.compare(slow)["samples"] == 4
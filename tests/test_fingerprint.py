@@ -0,0 +1,27 @@
+from fingerprint import fingerprint, normalize_query
+
+
+def test_literals_whitespace_and_case_are_normalized():
+    assert normalize_query("select  *  from T where X=1 -- comment\n;") == "select * from t where x = ?"
+    assert normalize_query("SELECT 'it''s', E'a\\'b', $$body$$, 1.5e3") == "select ? , ? , ? , ?"
+    # Идентификаторы в кавычках чувствительны к регистру
+    assert normalize_query('SELECT "Id" FROM "T"') == 'select "Id" from "T"'
+
+
+def test_copies_with_different_literals_share_fingerprint():
+    assert fingerprint("SELECT * FROM t WHERE id = 1;") == fingerprint("select * from t where id = 42")
+    assert fingerprint("SELECT * FROM t WHERE id = 1") != fingerprint("SELECT * FROM t WHERE name = 1")
+
+
+def test_in_array_and_values_lists_collapse():
+    assert normalize_query("SELECT * FROM t WHERE id IN (1, 2, 3)") == "select * from t where id in ( ?... )"
+    assert fingerprint("SELECT * FROM t WHERE id IN (1, 2, 3)") == fingerprint("SELECT * FROM t WHERE id IN (4)")
+    assert normalize_query("SELECT ARRAY[1,2,3]") == "select array [ ?... ]"
+    assert fingerprint("INSERT INTO t VALUES (1, 'a'), (2, 'b')") == fingerprint("insert into t values (3, 'c')")
+
+
+def test_function_arguments_and_row_values_do_not_collapse():
+    assert normalize_query("SELECT * FROM generate_series(1, 10)") == "select * from generate_series ( ? , ? )"
+    assert fingerprint("SELECT round(1.5, 2)") != fingerprint("SELECT round(1.5)")
+    assert normalize_query("SELECT * FROM t WHERE (a, b) = (1, 2)") == \
+        "select * from t where ( a , b ) = ( ? , ? )"
@@ -0,0 +1,94 @@
+import os
+
+from parse_cache import ParseCache
+from sqlParse import iter_parsed_queries
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _store(cache, path):
+    cache.lookup(path)
+    cache.store(path, 1.0, 10, "hash", [{"query": "SELECT 1", "type": "SELECT", "file_path": path}])
+
+
+def test_relative_and_absolute_paths_share_one_entry(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = ParseCache(str(tmp_path / "cache.db"), "v1")
+    _store(cache, "sql/a.sql")
+    cache.close()
+    cache = ParseCache(str(tmp_path / "cache.db"), "v1")
+    assert cache.lookup(str(tmp_path / "sql" / "a.sql")) == (1.0, 10, "hash")
+    assert cache.lookup("./sql/a.sql") == (1.0, 10, "hash")
+    # Путь в записях — как он задан в текущем запуске
+    assert cache.get_queries("./sql/a.sql", 1.0, 10)[0]["file_path"] == "./sql/a.sql"
+    cache.close()
+
+
+def test_evict_missing_keeps_entries_outside_root(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = ParseCache("cache.db", "v1")
+    for path in ("sql/a.sql", "sql/gone.sql", "sql_other/b.sql", "other/c.sql"):
+        _store(cache, path)
+    cache.close()
+
+    cache = ParseCache("cache.db", "v1")
+    cache.lookup("sql/a.sql")
+    cache.evict_missing("sql")
+    assert cache.stats()["evicted"] == 1
+    cache.close()
+
+    cache = ParseCache("cache.db", "v1")
+    assert cache.lookup("sql/gone.sql") is None
+    # Соседний каталог с общим префиксом имени и остальное дерево не тронуты
+    assert cache.lookup("sql_other/b.sql") is not None
+    assert cache.lookup("other/c.sql") is not None
+    cache.close()
+
+
+def test_evict_missing_for_single_file_root(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = ParseCache("cache.db", "v1")
+    _store(cache, "sql/a.sql")
+    _store(cache, "sql/b.sql")
+    cache.close()
+
+    cache = ParseCache("cache.db", "v1")
+    cache.lookup("sql/a.sql")
+    cache.evict_missing("sql/a.sql")
+    assert cache.stats()["evicted"] == 0
+    cache.close()
+
+
+def test_version_change_drops_entries(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ParseCache(path, "v1")
+    _store(cache, str(tmp_path / "a.sql"))
+    cache.close()
+
+    cache = ParseCache(path, "v2")
+    assert cache.lookup(str(tmp_path / "a.sql")) is None
+    cache.close()
+
+
+def test_subdirectory_run_does_not_evict_rest_of_tree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write("sql/a.sql", "SELECT 1;")
+    _write("sql/nested/b.sql", "SELECT 2; SELECT 3;")
+
+    cache = ParseCache("cache.db", "v1")
+    assert len(list(iter_parsed_queries("sql", cache=cache))) == 3
+    cache.close()
+
+    cache = ParseCache("cache.db", "v1")
+    assert len(list(iter_parsed_queries("./sql/nested", cache=cache))) == 2
+    cache.close()
+
+    cache = ParseCache("cache.db", "v1")
+    queries = list(iter_parsed_queries(os.path.abspath("sql"), cache=cache))
+    assert len(queries) == 3
+    assert cache.stats() == {"hits": 2, "misses": 0, "evicted": 0}
+    cache.close()
@@ -0,0 +1,78 @@
+from plan_rules import evaluate_query
+
+
+def _node(node_type, time_ms=0.01, rows=1, analyzed=True, children=(), **details):
+    node = {"Node Type": node_type, "Startup Cost": 0.0, "Total Cost": 10.0, "Plan Rows": rows, "Plan Width": 4}
+    if analyzed:
+        node.update({"Actual Startup Time": 0.0, "Actual Total Time": time_ms, "Actual Rows": rows,
+                     "Actual Loops": 1})
+    node.update(details)
+    if children:
+        node["Plans"] = list(children)
+    return node
+
+
+def _query(root, execution_ms=None, query="SELECT * FROM t WHERE a = 1", query_type="SELECT", **extra):
+    plan = {"Plan": root}
+    if execution_ms is not None:
+        plan["Execution Time"] = execution_ms
+    return dict({"query": query, "type": query_type, "plan": [plan]}, **extra)
+
+
+def test_destructive_statements_are_critical_without_plan():
+    verdict = evaluate_query({"query": "DELETE FROM t", "type": "DELETE", "plan": None})
+    assert verdict["evaluation"] == "CRITICAL"
+    assert verdict["source"] == "rules"
+    assert evaluate_query({"query": "DROP TABLE t", "type": "DROP", "plan": None})["evaluation"] == "CRITICAL"
+    assert evaluate_query({"query": "DELETE FROM t WHERE id = 1", "type": "DELETE", "plan": None}) is None
+
+
+def test_fast_index_scan_is_good():
+    root = _node("Index Scan", **{"Relation Name": "t", "Index Name": "t_pkey"})
+    verdict = evaluate_query(_query(root, execution_ms=0.05))
+    assert verdict["evaluation"] == "GOOD"
+    assert evaluate_query(_query(_node("Result"), execution_ms=0.01))["evaluation"] == "GOOD"
+
+
+def test_fast_seq_scan_is_left_to_the_model():
+    root = _node("Seq Scan", **{"Relation Name": "t", "Filter": "(a = 1)", "Rows Removed by Filter": 10})
+    assert evaluate_query(_query(root, execution_ms=0.05)) is None
+    assert evaluate_query(_query(_node("Seq Scan", **{"Relation Name": "t"}), execution_ms=0.05)) is None
+
+
+def test_large_filtered_seq_scan_needs_improvement():
+    root = _node("Seq Scan", time_ms=80, **{"Relation Name": "t", "Filter": "(a = 1)",
+                                             "Rows Removed by Filter": 200000})
+    verdict = evaluate_query(_query(root, execution_ms=80))
+    assert verdict["evaluation"] == "NEEDS_IMPROVEMENT"
+    assert "(a = 1)" in verdict["recommendations"][0]
+
+
+def test_plan_only_seq_scan_uses_catalog_row_estimate():
+    root = _node("Seq Scan", rows=10, analyzed=False, **{"Relation Name": "t", "Schema": "public",
+                                                          "Filter": "(a = 1)"})
+    query = _query(root, table_stats={"public.t": {"rows": 500000}})
+    assert evaluate_query(query)["evaluation"] == "NEEDS_IMPROVEMENT"
+
+
+def test_time_thresholds():
+    root = _node("Index Scan", **{"Relation Name": "t", "Index Name": "t_pkey"})
+    assert evaluate_query(_query(root, execution_ms=2500))["evaluation"] == "CRITICAL"
+    # Между GOOD и CRITICAL по измеренному времени решает модель
+    assert evaluate_query(_query(root, execution_ms=1000)) is None
+
+
+def test_time_budget_of_plan_only_queries():
+    root = _node("Index Scan", analyzed=False, **{"Relation Name": "t", "Index Name": "t_pkey"})
+    assert evaluate_query(_query(root, estimated_only=True, time_budget_ms=3000))["evaluation"] == "CRITICAL"
+    assert evaluate_query(_query(root, estimated_only=True,
+                                 time_budget_ms=600))["evaluation"] == "NEEDS_IMPROVEMENT"
+    assert evaluate_query(_query(root, estimated_only=True, time_budget_ms=100)) is None
+
+
+def test_generic_plan_uses_workload_mean_time():
+    root = _node("Index Scan", analyzed=False, **{"Relation Name": "t", "Index Name": "t_pkey"})
+    slow = _query(root, query="SELECT * FROM t WHERE a = $1", estimated_only=True, generic_plan=True,
+                  workload={"mean_ms": 3000.0})
+    assert evaluate_query(slow)["evaluation"] == "CRITICAL"
+    assert evaluate_query(dict(slow, workload={"mean_ms": 3.0})) is None
@@ -0,0 +1,54 @@
+from plan_model import Plan
+from plan_summary import estimate_tokens, summarize_plan, summarize_text
+
+
+def _node(node_type, total_ms, children=(), **details):
+    node = {"Node Type": node_type, "Startup Cost": 0.0, "Total Cost": 100.0, "Plan Rows": 10, "Plan Width": 8,
+            "Actual Startup Time": 0.0, "Actual Total Time": total_ms, "Actual Rows": 10, "Actual Loops": 1,
+            "Output": ["a", "b"]}
+    node.update(details)
+    if children:
+        node["Plans"] = list(children)
+    return node
+
+
+def _wide_plan(scans=40):
+    """Append из множества дешёвых сканирований и одного горячего"""
+    children = [_node("Seq Scan", 0.1, **{"Relation Name": f"part_{i}", "Filter": f"(x = {i})"})
+                for i in range(scans)]
+    children.append(_node("Seq Scan", 500.0, **{"Relation Name": "hot", "Filter": "(y > 0)"}))
+    total = sum(child["Actual Total Time"] for child in children) + 1.0
+    return Plan.from_explain([{"Plan": _node("Append", total, children), "Planning Time": 0.5,
+                               "Execution Time": total}])
+
+
+def test_small_plan_is_kept_without_output_lists():
+    plan = Plan.from_explain([{"Plan": _node("Seq Scan", 1.0, **{"Relation Name": "t"}), "Execution Time": 1.0}])
+    lines, elided = summarize_plan(plan, 1500)
+    assert lines == plan.text_lines(verbose=False) + ["Execution Time: 1.000 ms"]
+    assert elided == {"output_lists": 1}
+
+
+def test_large_plan_fits_budget_and_keeps_hottest_node():
+    plan = _wide_plan()
+    full = plan.text_lines(verbose=False)
+    budget = estimate_tokens('\n'.join(full)) // 4
+    lines, elided = summarize_plan(plan, budget)
+
+    assert estimate_tokens('\n'.join(lines)) <= budget
+    assert any("on hot" in line for line in lines)
+    assert any("скрыто узлов" in line for line in lines)
+    assert lines[-1].startswith("Execution Time:")
+    assert elided["nodes"] > 0
+    assert elided["original_lines"] == len(full) + 2  # со строками Planning/Execution Time
+    assert 0 < elided["self_time_ms"] < 500
+
+
+def test_text_plan_is_truncated_with_marker():
+    lines = [f"->  Seq Scan on part_{i}  (cost=0.00..1.00 rows=1 width=4)" for i in range(200)]
+    lines.insert(1, "      Output: a, b")
+    kept, elided = summarize_text(lines, 100)
+    assert estimate_tokens('\n'.join(kept)) <= 100
+    assert kept[-1] == f"... скрыто строк: {elided['lines']}"
+    assert elided["output_lists"] == 1
+    assert len(kept) - 1 + elided["lines"] == 200
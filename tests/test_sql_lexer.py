@@ -0,0 +1,58 @@
+import os
+
+import sqlparse
+
+from sql_lexer import classify_query, split_statements
+from sqlParse import get_clean_query, get_query_type
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_splits_on_semicolons_outside_literals():
+    assert split_statements("SELECT 1; SELECT 'a;b' FROM t; SELECT \"c;d\" FROM t;") == [
+        ("SELECT 1;", "SELECT"),
+        ("SELECT 'a;b' FROM t;", "SELECT"),
+        ('SELECT "c;d" FROM t;', "SELECT"),
+    ]
+
+
+def test_strips_comments_including_nested_block_comments():
+    assert split_statements("-- header\nSELECT 1 -- tail;\n;") == [("SELECT 1 \n;", "SELECT")]
+    assert split_statements("SELECT /* a /* nested; */ b */ 1;") == [("SELECT   1;", "SELECT")]
+
+
+def test_escape_strings_and_dollar_quoting():
+    assert split_statements("SELECT E'it\\'s;' ;") == [("SELECT E'it\\'s;' ;", "SELECT")]
+    assert split_statements("SELECT $1, $tag$;$tag$;") == [("SELECT $1, $tag$;$tag$;", "SELECT")]
+
+    statements = split_statements(
+        "CREATE FUNCTION f() RETURNS int AS $$ BEGIN RETURN 1; END; $$ LANGUAGE plpgsql; SELECT 2;")
+    assert [query_type for _, query_type in statements] == ["CREATE", "SELECT"]
+
+
+def test_ambiguous_input_falls_back_to_sqlparse():
+    assert split_statements("SELECT 'unterminated;") is None
+    assert split_statements("SELECT 1 /* unterminated") is None
+    # Тело процедуры без dollar-quoting: точки с запятой внутри BEGIN ... END
+    assert split_statements("CREATE PROCEDURE p() BEGIN SELECT 1; END;") is None
+
+
+def test_empty_statements_are_skipped():
+    assert split_statements(";;") == []
+    assert split_statements("SELECT 1") == [("SELECT 1", "SELECT")]
+
+
+def test_classify_query():
+    assert classify_query("(SELECT 1) UNION (SELECT 2)") == "SELECT"
+    assert classify_query("start transaction") == "BEGIN"
+    assert classify_query("MERGE INTO t USING s ON t.id = s.id WHEN MATCHED THEN DELETE") == "MERGE"
+    assert classify_query("VACUUM t") == "UNKNOWN"
+
+
+def test_matches_sqlparse_on_example_file():
+    with open(os.path.join(ROOT, "example.sql"), encoding="utf-8") as f:
+        sql = f.read()
+    slow = [(get_clean_query(stmt), get_query_type(stmt)) for stmt in sqlparse.parse(sql)]
+    slow = [(query, query_type) for query, query_type in slow if query and not query.isspace()]
+    fast = split_statements(sql)
+    assert [query_type for _, query_type in fast] == [query_type for _, query_type in slow]
@@ -0,0 +1,56 @@
+import csv
+
+from explainRunner import ExplainRunner, GENERIC_PLAN_UNAVAILABLE
+from fingerprint import has_parameters
+from workload import iter_workload_queries
+
+STATEMENTS = [
+    # queryid, query, calls, total_exec_time
+    ("1", "SELECT * FROM t WHERE id = $1", "10", "50.0"),
+    ("1", "SELECT * FROM t WHERE id = $1", "30", "150.0"),
+    ("2", "MERGE INTO t USING s ON t.id = s.id WHEN MATCHED THEN DELETE", "5", "500.0"),
+    ("3", "VACUUM t", "1", "900.0"),
+    ("4", "SELECT 1", "1", "1.0"),
+]
+
+
+def _snapshot(path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["queryid", "query", "calls", "total_exec_time", "rows", "shared_blks_hit",
+                         "shared_blks_read"])
+        for row in STATEMENTS:
+            writer.writerow(row + ("1", "0", "0"))
+    return str(path)
+
+
+def test_has_parameters_ignores_literals_and_comments():
+    assert has_parameters("SELECT * FROM t WHERE id = $1")
+    assert not has_parameters("SELECT '$1', \"$2\" -- $3")
+    assert not has_parameters("SELECT $$ $1 $$, $tag$ $2 $tag$")
+
+
+def test_csv_snapshot_ordered_merged_and_filtered(tmp_path):
+    records = list(iter_workload_queries(_snapshot(tmp_path / "snapshot.csv"), top=10))
+    # VACUUM не объясняется; MERGE — объясняется
+    assert [record["type"] for record in records] == ["MERGE", "SELECT", "SELECT"]
+    assert records[1]["workload"]["calls"] == 40
+    assert records[1]["workload"]["mean_ms"] == 5.0
+
+    assert [record["type"] for record in iter_workload_queries(str(tmp_path / "snapshot.csv"), top=1)] == ["MERGE"]
+
+
+def test_parameterised_statement_without_generic_plan_does_not_block_deploy(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test")
+    from LLM_aggregator import OpenRouterAnalyzer, analyze_results, check_deployment_criteria
+
+    query = {"query": "SELECT * FROM t WHERE id = $1", "type": "SELECT", "file_path": "pg_stat_statements"}
+    result = ExplainRunner._skipped_result(query, GENERIC_PLAN_UNAVAILABLE)
+    assert result["error"] is None and result["plan"] is None
+
+    report = list(analyze_results([dict(result, workload={"mean_ms": 5.0})], OpenRouterAnalyzer()))
+    analysis = report[0]["analysis"]
+    assert analysis["evaluation"] == "ACCEPTABLE"
+    assert analysis["source"] == "skipped"
+    assert analysis["execution_time"] == "5.000ms (pg_stat_statements)"
+    assert check_deployment_criteria(report)
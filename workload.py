@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import csv
+import sys
+import argparse
+
+import psycopg2
+
+from artifacts import write_records
+from sqlParse import parse_sql
+from explainRunner import get_connection_params
+from instrumentation import metrics
+
+# Источник «живой» статистики; любой другой источник — путь к CSV-снимку
+LIVE_SOURCE = "pg_stat_statements"
+# Что можно передать в EXPLAIN; служебные команды из pg_stat_statements пропускаем
+EXPLAINABLE_TYPES = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "MERGE")
+ORDER_KEYS = {"total": "total_ms", "mean": "mean_ms"}
+
+# Строки разных пользователей с одним queryid сводятся в одну; в PG 13 столбцы времени переименованы
+STATEMENTS_QUERY = """
+SELECT s.queryid, min(s.query), sum(s.calls), sum(s.{total}), sum(s.rows),
+       sum(s.shared_blks_hit), sum(s.shared_blks_read)
+FROM pg_stat_statements s
+JOIN pg_database d ON d.oid = s.dbid
+WHERE d.datname = current_database()
+GROUP BY s.queryid
+"""
+
+
+def _statement(queryid, query, calls, total_ms, rows, shared_hit, shared_read):
+    calls = int(calls or 0)
+    total_ms = float(total_ms or 0)
+    return {
+        "queryid": str(queryid),
+        "query": query,
+        "calls": calls,
+        "total_ms": round(total_ms, 3),
+        "mean_ms": round(total_ms / calls, 3) if calls else None,
+        "rows": int(rows or 0),
+        "shared_blks_hit": int(shared_hit or 0),
+        "shared_blks_read": int(shared_read or 0),
+    }
+
+
+def fetch_statements(conn):
+    """Статистика текущей БД из расширения pg_stat_statements"""
+    total = "total_exec_time" if conn.server_version >= 130000 else "total_time"
+    cursor = conn.cursor()
+    try:
+        cursor.execute(STATEMENTS_QUERY.format(total=total))
+        return [_statement(*row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+def read_statements_csv(path):
+    """Снимок pg_stat_statements, выгруженный так:
+    \\copy (SELECT * FROM pg_stat_statements) TO 'snapshot.csv' CSV HEADER
+    """
+    # Тексты запросов бывают длиннее стандартного лимита поля csv
+    csv.field_size_limit(sys.maxsize)
+    merged = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            total = row.get("total_exec_time") or row.get("total_time")
+            statement = _statement(row["queryid"], row["query"], row["calls"], total, row.get("rows"),
+                                   row.get("shared_blks_hit"), row.get("shared_blks_read"))
+            previous = merged.get(statement["queryid"])
+            if previous is None:
+                merged[statement["queryid"]] = statement
+                continue
+            for key in ("calls", "total_ms", "rows", "shared_blks_hit", "shared_blks_read"):
+                previous[key] += statement[key]
+            previous["mean_ms"] = round(previous["total_ms"] / previous["calls"], 3) if previous["calls"] else None
+    return list(merged.values())
+
+
+def iter_workload_queries(source=LIVE_SOURCE, top=50, order_by="total", min_calls=1):
+    """Записи о запросах из реальной нагрузки — top самых дорогих по суммарному или среднему времени.
+
+    Формат тот же, что у iter_parsed_queries, плюс "workload" со статистикой вызовов.
+    Порядок — по убыванию времени: при общем бюджете EXPLAIN дорогие запросы разбираются первыми.
+    """
+    if source == LIVE_SOURCE:
+        conn = psycopg2.connect(**get_connection_params())
+        try:
+            statements = fetch_statements(conn)
+        finally:
+            conn.close()
+    else:
+        statements = read_statements_csv(source)
+
+    key = ORDER_KEYS[order_by]
+    statements.sort(key=lambda s: s[key] or 0, reverse=True)
+    count = 0
+    for statement in statements:
+        if count >= top:
+            break
+        if statement["calls"] < min_calls:
+            continue
+        records = [record for record in parse_sql(statement["query"], source)
+                   if record["type"] in EXPLAINABLE_TYPES]
+        if not records:
+            metrics.count("workload.skipped")
+            continue
+        workload = {k: v for k, v in statement.items() if k != "query"}
+        count += 1
+        metrics.count("workload.queries")
+        for record in records:
+            yield dict(record, workload=workload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Запросы реальной нагрузки из pg_stat_statements')
+    parser.add_argument('source', nargs='?', default=LIVE_SOURCE,
+                        help='pg_stat_statements (БД из переменных окружения) или CSV-снимок представления')
+    parser.add_argument('--top', type=int, default=50, help='Сколько самых дорогих запросов взять')
+    parser.add_argument('--order-by', choices=sorted(ORDER_KEYS), default='total',
+                        help='Сортировка: суммарное или среднее время выполнения')
+    parser.add_argument('--min-calls', type=int, default=1, help='Пропускать запросы с меньшим числом вызовов')
+    parser.add_argument('-o', '--output', default='parsed_queries.json', help='Выходной файл: .json или .jsonl')
+    args = parser.parse_args()
+
+    count = write_records(iter_workload_queries(args.source, args.top, args.order_by, args.min_calls), args.output)
+    print(f"Selected {count} queries from {args.source} by {args.order_by} time. Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()